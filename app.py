@@ -1,16 +1,232 @@
 
-from flask import Flask, request, jsonify
+import gc
+import hashlib
+import json
+import queue
+import time
+import uuid
+from flask import Flask, request, jsonify, Response, stream_with_context
 from.joke_pipeline_manager import JokePipelineManager 
-from.transparency_module import TransparencyProvider
+from.transperancy_module import TransparencyProvider
+from.completion_cache import CompletionCache
+from.job_queue import JobQueue, QueueFullError, InMemoryJobStore, SQLiteJobStore, JOB_FAILED, JOB_SUCCEEDED
+from.run_trace import RunTraceStore
+from.plan_pruner import PlanPruner
+from.metrics import default_registry
+from.run_controller import RunController
+from.model_router import ModelRouter
+from.topic_memo import TopicMemoStore
+from.candidate_dedup import CandidateDeduplicator
+from.judge_ensemble import JudgeEnsemble
+from.trace_archive import TraceArchive
+from.replay import (TranscriptRecorder, TranscriptReplayer, recording_session, replay_session,
+                    RecordingSearchBackend, ReplaySearchBackend)
+from.web_search import WebSearchService, DDGSSearchBackend, load_ddgs
 import os
 
 app = Flask(__name__)
 
-app.config = {} 
-
 transparency_provider = TransparencyProvider()
 
-@app.route('/generate_jokes', methods=)
+# Opt-in, process-wide completion cache shared by every request's pipeline.
+completion_cache = None
+if os.environ.get("JOKEBOT_COMPLETION_CACHE_DB"):
+    completion_cache = CompletionCache(db_path=os.environ["JOKEBOT_COMPLETION_CACHE_DB"])
+
+# Finished runs' transparency traces, looked up by the run_id returned with each result.
+trace_store = RunTraceStore(
+    max_runs=int(os.environ.get("JOKEBOT_TRACE_MAX_RUNS", 256)),
+    ttl_seconds=float(os.environ.get("JOKEBOT_TRACE_TTL_SECONDS", 3600))
+)
+
+# Opt-in columnar archive of every run's trace for analysis across runs (needs pyarrow). Worker processes
+# may share the directory; rows are flushed every JOKEBOT_TRACE_ARCHIVE_FLUSH_SECONDS.
+trace_archive = None
+if os.environ.get("JOKEBOT_TRACE_ARCHIVE_DIR"):
+    trace_archive = TraceArchive(os.environ["JOKEBOT_TRACE_ARCHIVE_DIR"],
+                                 flush_interval_s=float(os.environ.get("JOKEBOT_TRACE_ARCHIVE_FLUSH_SECONDS", 30)))
+
+# Opt-in pruning of weak or duplicate plans before the instantiation/critique calls, shared so its counters cover every run.
+plan_pruner = None
+if os.environ.get("JOKEBOT_PLAN_KEEP_RATIO"):
+    plan_pruner = PlanPruner(keep_ratio=float(os.environ["JOKEBOT_PLAN_KEEP_RATIO"]),
+                             scoring_model=os.environ.get("JOKEBOT_PLAN_SCORING_MODEL"))
+
+# Per-run deadline and spend caps. A request may ask for tighter limits, never looser ones.
+RUN_LIMIT_DEFAULTS = {
+    "deadline_seconds": float(os.environ["JOKEBOT_RUN_DEADLINE_SECONDS"]) if os.environ.get("JOKEBOT_RUN_DEADLINE_SECONDS") else None,
+    "max_tokens": int(os.environ["JOKEBOT_RUN_MAX_TOKENS"]) if os.environ.get("JOKEBOT_RUN_MAX_TOKENS") else None,
+    "max_cost_usd": float(os.environ["JOKEBOT_RUN_MAX_COST_USD"]) if os.environ.get("JOKEBOT_RUN_MAX_COST_USD") else None,
+}
+
+def _run_limits(data):
+    limits = {}
+    for name, default in RUN_LIMIT_DEFAULTS.items():
+        value = data.get(name)
+        if value is None:
+            limits[name] = default
+            continue
+        try:
+            value = int(value) if name == "max_tokens" else float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"'{name}' must be a number")
+        if value <= 0:
+            raise ValueError(f"'{name}' must be positive")
+        limits[name] = value if default is None else min(value, default)
+    return limits
+
+def _run_controller(limits):
+    if all(value is None for value in limits.values()):
+        return None
+    return RunController(**limits)
+
+# Judge and perceived novelty in one call per batch instead of a novelty call per joke; a request may override.
+FUSED_EVALUATION_DEFAULT = os.environ.get("JOKEBOT_FUSED_EVALUATION", "").lower() in ("1", "true", "yes")
+
+def _fused_evaluation(data):
+    value = data.get("fused_evaluation")
+    if value is None:
+        return FUSED_EVALUATION_DEFAULT
+    if not isinstance(value, bool):
+        raise ValueError("'fused_evaluation' must be true or false")
+    return value
+
+# Extra judge models for adaptive re-judging near the top-k boundary (comma-separated); a request may
+# pass its own "judge_ensemble_models" list, and an empty list turns the ensemble off.
+JUDGE_ENSEMBLE_MODELS_DEFAULT = [model.strip() for model in os.environ.get("JOKEBOT_JUDGE_ENSEMBLE_MODELS", "").split(",")
+                                 if model.strip()]
+
+def _judge_ensemble_models(data):
+    models = data.get("judge_ensemble_models")
+    if models is None:
+        return JUDGE_ENSEMBLE_MODELS_DEFAULT
+    if not isinstance(models, list) or not all(isinstance(model, str) and model for model in models):
+        raise ValueError("'judge_ensemble_models' must be a list of model names")
+    return models
+
+def _judge_ensemble(models):
+    return JudgeEnsemble(models) if models else None
+
+# Process-wide so circuit breakers and latency percentiles see every user's calls.
+# JOKEBOT_MODEL_FALLBACKS is JSON mapping a stage (judge, joke, plan, ... or "*") to backup models.
+model_router = ModelRouter(
+    fallbacks=json.loads(os.environ.get("JOKEBOT_MODEL_FALLBACKS", "{}")),
+    hedge=os.environ.get("JOKEBOT_HEDGE_REQUESTS", "").lower() in ("1", "true", "yes")
+)
+
+# Mark the static system prompts as cache_control breakpoints for providers that only cache prompt
+# prefixes when asked to (Anthropic, Gemini); the others cache them automatically.
+PROMPT_CACHE_HINTS = os.environ.get("JOKEBOT_PROMPT_CACHE_HINTS", "").lower() in ("1", "true", "yes")
+
+# Opt-in reuse of observations and plans across runs on the same topic.
+topic_memo = None
+if os.environ.get("JOKEBOT_TOPIC_MEMO", "").lower() in ("1", "true", "yes"):
+    topic_memo = TopicMemoStore(
+        max_topics=int(os.environ.get("JOKEBOT_TOPIC_MEMO_MAX_TOPICS", 512)),
+        ttl_seconds=float(os.environ.get("JOKEBOT_TOPIC_MEMO_TTL_SECONDS", 24 * 3600)),
+        freshness=float(os.environ.get("JOKEBOT_TOPIC_MEMO_FRESHNESS", 0.3))
+    )
+
+# Near-duplicate candidates are evaluated once per cluster and the top jokes are picked for diversity.
+# Shared so its counters of avoided evaluation calls cover every run; JOKEBOT_CANDIDATE_DEDUP=0 turns it off.
+candidate_deduplicator = None
+if os.environ.get("JOKEBOT_CANDIDATE_DEDUP", "1").lower() not in ("0", "false", "no"):
+    candidate_deduplicator = CandidateDeduplicator(
+        similarity_threshold=float(os.environ.get("JOKEBOT_CANDIDATE_SIMILARITY_THRESHOLD", 0.6)),
+        diversity_lambda=float(os.environ.get("JOKEBOT_DIVERSITY_LAMBDA", 0.7))
+    )
+
+# Offline runs: JOKEBOT_RECORD_TRANSCRIPT appends every OpenRouter and web-search exchange to a JSON-lines
+# file; JOKEBOT_REPLAY_TRANSCRIPT serves them back instead of the network, delayed by the recorded latency
+# times JOKEBOT_REPLAY_LATENCY_SCALE.
+llm_session = None
+web_search = None
+if os.environ.get("JOKEBOT_REPLAY_TRANSCRIPT"):
+    replayer = TranscriptReplayer(os.environ["JOKEBOT_REPLAY_TRANSCRIPT"],
+                                  latency_scale=float(os.environ.get("JOKEBOT_REPLAY_LATENCY_SCALE", 1.0)))
+    llm_session = replay_session(replayer)
+    web_search = WebSearchService(ReplaySearchBackend(replayer), rate_per_second=1000, burst=1000)
+elif os.environ.get("JOKEBOT_RECORD_TRANSCRIPT"):
+    recorder = TranscriptRecorder(os.environ["JOKEBOT_RECORD_TRANSCRIPT"])
+    llm_session = recording_session(recorder)
+    if load_ddgs() is not None:
+        web_search = WebSearchService(RecordingSearchBackend(DDGSSearchBackend(), recorder))
+
+# Optional local joke corpus for the n-gram and embedding novelty checks. Its indexes are read-only and
+# loaded once per process, not per request (see warm_up).
+JOKE_CORPUS_PATH = os.environ.get("JOKEBOT_JOKE_CORPUS_PATH") or None
+EMBEDDING_MODEL_NAME = os.environ.get("JOKEBOT_EMBEDDING_MODEL") or None
+
+def _new_pipeline_manager(user_api_key):
+    return JokePipelineManager(openrouter_api_key=user_api_key, joke_corpus_path=JOKE_CORPUS_PATH,
+                               embedding_model_name=EMBEDDING_MODEL_NAME,
+                               completion_cache=completion_cache, trace_store=trace_store,
+                               plan_pruner=plan_pruner, model_router=model_router, topic_memo=topic_memo,
+                               llm_session=llm_session, web_search=web_search,
+                               candidate_deduplicator=candidate_deduplicator, trace_archive=trace_archive,
+                               prompt_cache_hints=PROMPT_CACHE_HINTS)
+
+def _run_job(params, progress_callback):
+    pipeline_manager = _new_pipeline_manager(params["user_openrouter_api_key"])
+    top_jokes = pipeline_manager.generate_and_evaluate_jokes(
+        params["topic"],
+        params["llm_choices"],
+        num_top_jokes=params["num_top_jokes"],
+        progress_callback=progress_callback,
+        run_id=params["run_id"],
+        controller=_run_controller(params.get("limits", {})),
+        fused_evaluation=params.get("fused_evaluation", FUSED_EVALUATION_DEFAULT),
+        judge_ensemble=_judge_ensemble(params.get("judge_ensemble_models", JUDGE_ENSEMBLE_MODELS_DEFAULT))
+    )
+    return {"top_jokes": top_jokes, "run_id": params["run_id"]}
+
+# Background runs are sized to cores, not to Flask threads. Set JOKEBOT_JOB_DB to keep job state across restarts.
+job_queue = JobQueue(
+    _run_job,
+    store=SQLiteJobStore(os.environ["JOKEBOT_JOB_DB"]) if os.environ.get("JOKEBOT_JOB_DB") else InMemoryJobStore(),
+    num_workers=int(os.environ.get("JOKEBOT_JOB_WORKERS", os.cpu_count() or 4)),
+    max_queue_depth=int(os.environ.get("JOKEBOT_JOB_QUEUE_DEPTH", 64)),
+    max_queued_per_owner=int(os.environ.get("JOKEBOT_JOB_QUEUE_DEPTH_PER_KEY", 8))
+)
+JOB_RETRY_AFTER_SECONDS = 30
+
+metrics_registry = default_registry()
+metrics_registry.register_gauge("job_queue_depth", "Background jobs waiting for a worker.", job_queue.queue_depth)
+metrics_registry.register_gauge("trace_store_runs", "Run traces currently retained.", lambda: len(trace_store))
+if topic_memo is not None:
+    metrics_registry.register_gauge("topic_memo_topics", "Topics with memoized observations and plans.", lambda: len(topic_memo))
+metrics_registry.register_gauge("model_circuit_breakers_open", "Models currently skipped by their circuit breaker.",
+                                lambda: sum(1 for stats in model_router.get_stats().values() if stats["state"] != "closed"))
+
+def warm_up():
+    """
+    Loads what requests would otherwise load on first use: the corpus indexes and embedder,
+    the judge rubrics and the web search client. Then gc.freeze() moves everything allocated
+    so far out of the collector's reach, so forked workers share those pages instead of
+    copying them the first time the collector touches them. Returns the load times.
+    """
+    start = time.perf_counter()
+    pipeline_manager = _new_pipeline_manager("warm-up") # Never calls the API; only builds the shared components
+    loaded = {"corpus_assets": pipeline_manager.novelty_checker.warm_up()}
+    for include_novelty in (False, True):
+        pipeline_manager.llm_judge.get_joke_evaluation_rubric(include_novelty)
+    loaded["web_search"] = pipeline_manager.novelty_checker.web_search is not None
+    gc.freeze()
+    loaded["seconds"] = round(time.perf_counter() - start, 4)
+    return loaded
+
+def create_app(warm=True):
+    """
+    App factory for WSGI servers. Under a pre-forking server, load it in the master so the
+    warm-up runs once and every worker inherits the loaded assets:
+        gunicorn --preload -w 4 '<package>.app:create_app()'
+    Job workers and SQLite connections are started per process after the fork.
+    """
+    if warm:
+        print(f"Warmed up: {warm_up()}")
+    return app
+
+@app.route('/generate_jokes', methods=['POST'])
 def generate_jokes_endpoint():
     data = request.get_json()
     if not data:
@@ -26,17 +242,17 @@ def generate_jokes_endpoint():
 
     try:
       
-        pipeline_manager = JokePipelineManager(openrouter_api_key=user_api_key) 
+        pipeline_manager = _new_pipeline_manager(user_api_key)
         top_jokes = pipeline_manager.generate_and_evaluate_jokes(
             topic,
-            user_llm_choices,
-            num_top_jokes=int(num_top_jokes)
+            llm_choices,
+            num_top_jokes=int(num_top_jokes),
+            controller=_run_controller(_run_limits(data)),
+            fused_evaluation=_fused_evaluation(data),
+            judge_ensemble=_judge_ensemble(_judge_ensemble_models(data))
         )
-        
-    
-        app.config = pipeline_manager.get_last_run_transparency_data()
 
-        return jsonify({"top_jokes": top_jokes}), 200
+        return jsonify({"top_jokes": top_jokes, "run_id": pipeline_manager.last_run_id}), 200
     except ValueError as ve:
         return jsonify({"error": str(ve)}), 400
     except Exception as e:
@@ -44,7 +260,137 @@ def generate_jokes_endpoint():
         traceback.print_exc()
         return jsonify({"error": f"An internal error occurred: {str(e)}"}), 500
 
-@app.route('/transparency_info', methods=)
+SSE_HEARTBEAT_SECONDS = 15 # Keeps proxies from timing out the stream between events
+
+def _sse_event(event_type: str, data) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.route('/generate_jokes/stream', methods=['POST'])
+def generate_jokes_stream_endpoint():
+    """
+    Same request body as /generate_jokes, answered as text/event-stream. The run goes
+    through the job queue like /jobs (429 when it is full), and is cancelled if the
+    client disconnects. Emits started, then observations, second_order_observations,
+    plan, candidate, near_duplicate, judge_score, novelty_score and top_k events as the
+    pipeline produces them, then a final result event (or error), then done.
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Invalid JSON payload"}), 400
+
+    topic = data.get('topic')
+    user_api_key = data.get('user_openrouter_api_key')
+    llm_choices = data.get('llm_choices', {})
+
+    if not topic or not user_api_key:
+        return jsonify({"error": "Missing 'topic' or 'user_openrouter_api_key'"}), 400
+    try:
+        num_top_jokes = int(data.get('num_top_jokes', 3))
+        limits = _run_limits(data)
+        fused_evaluation = _fused_evaluation(data)
+        judge_ensemble_models = _judge_ensemble_models(data)
+    except (TypeError, ValueError) as ve:
+        return jsonify({"error": str(ve)}), 400
+
+    events: "queue.Queue" = queue.Queue()
+    run_id = uuid.uuid4().hex
+    public_params = {"topic": topic, "llm_choices": llm_choices, "num_top_jokes": num_top_jokes, "run_id": run_id,
+                     "limits": limits, "fused_evaluation": fused_evaluation,
+                     "judge_ensemble_models": judge_ensemble_models}
+    owner = hashlib.sha256(user_api_key.encode("utf-8")).hexdigest()[:16]
+    try:
+        job_id = job_queue.submit(owner, dict(public_params, user_openrouter_api_key=user_api_key), public_params,
+                                  listener=lambda event_type, event_data: events.put((event_type, event_data)))
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": str(JOB_RETRY_AFTER_SECONDS)}
+
+    def stream():
+        finished = False
+        try:
+            yield _sse_event("started", {"topic": topic, "run_id": run_id, "job_id": job_id})
+            while True:
+                try:
+                    event_type, event_data = events.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event_type != "job_finished":
+                    yield _sse_event(event_type, event_data)
+                    continue
+                finished = True
+                if event_data["status"] == JOB_SUCCEEDED:
+                    yield _sse_event("result", event_data["result"])
+                elif event_data["status"] == JOB_FAILED:
+                    yield _sse_event("error", {"error": f"An internal error occurred: {event_data['error']}"})
+                else:
+                    yield _sse_event("error", {"error": f"Run {event_data['status']}"})
+                yield _sse_event("done", {})
+                return
+        finally:
+            # GeneratorExit on client disconnect: nobody is listening, so stop the run.
+            if not finished:
+                job_queue.cancel(job_id)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs', methods=['POST'])
+def submit_job_endpoint():
+    """Same request body as /generate_jokes. Queues the run and answers 202 with a job id."""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Invalid JSON payload"}), 400
+
+    topic = data.get('topic')
+    user_api_key = data.get('user_openrouter_api_key')
+    llm_choices = data.get('llm_choices', {})
+
+    if not topic or not user_api_key:
+        return jsonify({"error": "Missing 'topic' or 'user_openrouter_api_key'"}), 400
+    try:
+        num_top_jokes = int(data.get('num_top_jokes', 3))
+    except (TypeError, ValueError):
+        return jsonify({"error": "'num_top_jokes' must be an integer"}), 400
+    try:
+        limits = _run_limits(data)
+        fused_evaluation = _fused_evaluation(data)
+        judge_ensemble_models = _judge_ensemble_models(data)
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+
+    run_id = uuid.uuid4().hex
+    # The deadline is counted from when a worker starts the run, not from submission.
+    public_params = {"topic": topic, "llm_choices": llm_choices, "num_top_jokes": num_top_jokes, "run_id": run_id,
+                     "limits": limits, "fused_evaluation": fused_evaluation,
+                     "judge_ensemble_models": judge_ensemble_models}
+    # Fairness is per API key, but only a digest of it is ever stored.
+    owner = hashlib.sha256(user_api_key.encode("utf-8")).hexdigest()[:16]
+    try:
+        job_id = job_queue.submit(owner, dict(public_params, user_openrouter_api_key=user_api_key), public_params)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": str(JOB_RETRY_AFTER_SECONDS)}
+    return jsonify({"job_id": job_id, "run_id": run_id, "status": "queued"}), 202, {"Location": f"/jobs/{job_id}"}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status_endpoint(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id"}), 404
+    job.pop("owner", None)
+    return jsonify(job), 200
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job_endpoint(job_id):
+    if not job_queue.cancel(job_id):
+        return jsonify({"error": "Unknown or already finished job"}), 404
+    return jsonify({"job_id": job_id, "status": "cancelling"}), 202
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    # LLM calls, tokens, cost and latency per model and pipeline stage, in the Prometheus text format.
+    return Response(metrics_registry.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/transparency_info', methods=['GET'])
 def transparency_info_endpoint():
     info_type = request.args.get('type') 
     
@@ -52,8 +398,24 @@ def transparency_info_endpoint():
         details = transparency_provider.get_plansearch_code_details()
         return jsonify(details), 200
     elif info_type == 'pipeline_visualization':
-        last_run_data_for_viz = app.config.get('LAST_RUN_DATA', None)
-        viz_data = transparency_provider.get_pipeline_visualization_data(last_run_data_for_viz)
+        # Run data is only served by id, so one user's run is never returned to another.
+        run_id = request.args.get('run_id')
+        run_data = None
+        if run_id:
+            run_data = trace_store.get(run_id)
+            if run_data is None:
+                return jsonify({"error": "Unknown or expired run_id"}), 404
+        viz_data = transparency_provider.get_pipeline_visualization_data(run_data)
         return jsonify(viz_data), 200
+    elif info_type == 'run_statistics':
+        # Aggregates over every archived run (optionally only the last since_hours), never individual runs.
+        if trace_archive is None:
+            return jsonify({"error": "No trace archive configured (set JOKEBOT_TRACE_ARCHIVE_DIR)"}), 404
+        try:
+            since_hours = float(request.args['since_hours']) if request.args.get('since_hours') else None
+        except ValueError:
+            return jsonify({"error": "'since_hours' must be a number"}), 400
+        since = time.time() - since_hours * 3600 if since_hours is not None else None
+        return jsonify(transparency_provider.get_run_statistics(trace_archive, since)), 200
     else:
-        return jsonify({"error": "Invalid transparency info type requested. Use 'plansearch_code' or 'pipeline_visualization'."}), 400
+        return jsonify({"error": "Invalid transparency info type requested. Use 'plansearch_code', 'pipeline_visualization' or 'run_statistics'."}), 400
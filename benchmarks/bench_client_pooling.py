@@ -0,0 +1,80 @@
+"""
+Compares per-call requests.post (the old behaviour), the pooled OpenRouterClient and
+AsyncOpenRouterClient against a local stub server at 1/8/64 concurrent callers.
+
+    python -m <package>.benchmarks.bench_client_pooling [--calls 256] [--latency-ms 20]
+
+The stub is plain HTTP, so "connections" counts TCP handshakes only; against
+openrouter.ai each of those also pays a TLS handshake.
+"""
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+import requests
+
+from ..openrouter_client import OpenRouterClient, AsyncOpenRouterClient, aiohttp, create_pooled_session
+from .stub_server import StubOpenRouterServer
+
+MESSAGES = [{"role": "user", "content": "Tell me a joke about benchmarks."}]
+
+
+class BareRequestsClient(OpenRouterClient):
+    """The pre-pooling behaviour: a fresh requests.post (new connection) per call."""
+
+    def _make_request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = requests.post(self.api_url, headers=self._headers(), data=json.dumps(payload), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+def run_threaded(client: OpenRouterClient, calls: int, concurrency: int) -> None:
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda _: client.get_completion("stub/model", MESSAGES), range(calls)))
+
+
+def run_async(client: AsyncOpenRouterClient, calls: int, concurrency: int) -> None:
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                return await client.get_completion_async("stub/model", MESSAGES)
+
+        await asyncio.gather(*(one() for _ in range(calls)))
+        await client.aclose()
+
+    asyncio.run(main())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=256)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    print(f"{'client':<10} {'conc':>5} {'calls':>6} {'wall_s':>8} {'calls/s':>9} {'connections':>12}")
+    with StubOpenRouterServer(latency_s=args.latency_ms / 1000.0) as server:
+        for concurrency in (1, 8, 64):
+            runs = [
+                ("bare", lambda: run_threaded(BareRequestsClient("stub-key", api_url=server.url), args.calls, concurrency)),
+                ("pooled", lambda: run_threaded(OpenRouterClient("stub-key", pool_size=64, session=create_pooled_session(64), api_url=server.url), args.calls, concurrency)),
+            ]
+            if aiohttp is not None:
+                runs.append(("async", lambda: run_async(AsyncOpenRouterClient("stub-key", pool_size=64, api_url=server.url), args.calls, concurrency)))
+            for name, run in runs:
+                server.reset_counters()
+                start = time.perf_counter()
+                run()
+                wall = time.perf_counter() - start
+                print(f"{name:<10} {concurrency:>5} {server.requests_served:>6} {wall:>8.3f} "
+                      f"{server.requests_served / wall:>9.1f} {server.connections_opened:>12}")
+    if aiohttp is None:
+        print("aiohttp not installed; async client skipped.")
+
+
+if __name__ == "__main__":
+    main()
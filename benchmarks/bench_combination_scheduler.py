@@ -0,0 +1,146 @@
+"""
+Judge score per LLM call for PLANSEARCH under a fixed call budget: itertools order
+versus the CombinationScheduler (coverage + diversity, and with the judge-reward bandit).
+
+Runs offline against a simulated comedy model. Each observation has a hidden angle and
+quality (derived observations inherit their source's); a joke's judge score is the mean
+quality of its observations, plus a bonus for combining observations from different
+angles and for critique refinement, plus noise.
+
+    python -m <package>.benchmarks.bench_combination_scheduler [--topics 20] [--budget 40] [--max-plans 10] [--observations 8]
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import statistics
+import threading
+from typing import Any, Dict, List, Optional
+
+from ..call_budget import CallBudget
+from ..combination_scheduler import CombinationScheduler
+from ..llm_judge import LLMJudge
+from ..plansearch_for_jokes import PlanSearcherForJokes
+
+ANGLES = ["pun", "irony", "absurdity", "stereotype", "callback", "misdirection"]
+
+
+class SimulatedComedyClient:
+    """Stands in for OpenRouterClient; counts calls per kind."""
+
+    def __init__(self, topic: str, num_observations: int, seed: int):
+        rng = random.Random(seed)
+        self.observations: Dict[str, Dict[str, Any]] = {}
+        for i in range(num_observations):
+            angle = ANGLES[rng.randrange(len(ANGLES))]
+            text = f"{topic} {angle} {angle}-idea number {i}"
+            self.observations[text] = {"angle": angle, "quality": rng.uniform(2.0, 7.0)}
+        self.calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, kind: str) -> None:
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+
+    def _latent(self, observation: str) -> Dict[str, Any]:
+        return self.observations.get(observation.split(" twist ")[0], {"angle": None, "quality": 4.0})
+
+    def score(self, joke: str) -> float:
+        body = re.search(r"JOKE<(.*?)>", joke).group(1)
+        known = [self._latent(obs) for obs in body.split("|") if obs]
+        quality = statistics.mean(item["quality"] for item in known) if known else 4.0
+        quality += 1.5 * (len({item["angle"] for item in known}) - 1) # Unexpected juxtapositions land
+        quality += 0.5 if joke.endswith("+") else 0.0
+        noise = int.from_bytes(hashlib.blake2b(joke.encode(), digest_size=2).digest(), "little") / 65535 - 0.5
+        return max(1.0, min(10.0, quality + noise))
+
+    def _evaluation(self, joke: str) -> Dict[str, Any]:
+        score = round(self.score(joke), 2)
+        return {"originality": score, "coherence": 7, "setup_effectiveness": score, "punchline_impact": score,
+                "brevity": 7, "overall_funniness": score, "rationale": "simulated"}
+
+    def get_completion(self, model_name: str, messages: List[Dict[str, str]], temperature: float = 0.7,
+                       max_tokens: int = 500, response_format: Optional[Dict[str, str]] = None, **kwargs: Any) -> str:
+        prompt = "\n".join(message["content"] for message in messages)
+        if "[J1]" in prompt:
+            self._count("judge")
+            jokes = re.findall(r'\[(J\d+)\]\n"""\n(.*?)\n"""', prompt, re.S)
+            return json.dumps({"evaluations": [dict(self._evaluation(joke), joke_id=joke_id) for joke_id, joke in jokes]})
+        if response_format:
+            self._count("judge")
+            return json.dumps(self._evaluation(re.search(r"JOKE<.*?>\+?", prompt).group(0)))
+        if "Critically evaluate" in prompt:
+            self._count("critique")
+            return "The punchline is predictable."
+        if "Joke Plan:" in prompt:
+            self._count("joke")
+            body = re.search(r"PLAN<(.*?)>", prompt).group(1)
+            return f"JOKE<{body}>" + ("+" if "Critique of previous attempt" in prompt else "")
+        if "devise a high-level plan" in prompt:
+            self._count("plan")
+            observations = re.findall(r"^- (.*)$", prompt.split("Key Observations/Elements to incorporate:")[1], re.M)
+            return "PLAN<" + "|".join(observations) + ">"
+        self._count("observations")
+        if "initial observations" in prompt:
+            existing = re.findall(r"^- (.*)$", prompt, re.M)
+            return "\n".join(f"{existing[0]} twist {i}" for i in range(3))
+        return "\n".join(self.observations)
+
+
+def run_strategy(strategy: str, topic: str, args: argparse.Namespace, seed: int) -> Dict[str, float]:
+    client = SimulatedComedyClient(topic, args.observations, seed)
+    searcher = PlanSearcherForJokes(client, max_concurrency=4)
+    judge = LLMJudge(client)
+    scheduler = None
+    if strategy != "itertools":
+        scheduler = CombinationScheduler(bandit_weight=1.0 if strategy == "scheduler+bandit" else 0.0)
+
+    def feedback(candidate: Dict[str, Any]) -> None:
+        evaluation = judge.evaluate_jokes_batch([candidate["joke_text"]], "judge", batch_size=1)[0]
+        candidate["evaluation"] = evaluation
+        if evaluation:
+            scheduler.record_reward(candidate["observations_used"], evaluation["overall_funniness"] / 10)
+
+    budget = CallBudget(max_calls=args.budget)
+    candidates = searcher.run_plansearch(
+        topic, "obs", "plan", "joke", critique_model="critique", num_first_order_obs=args.observations,
+        max_plans_to_develop=args.max_plans, combination_scheduler=scheduler, budget=budget,
+        on_candidate=feedback if strategy == "scheduler+bandit" else None
+    )
+    pending = [candidate for candidate in candidates if "evaluation" not in candidate]
+    for candidate, evaluation in zip(pending, judge.evaluate_jokes_batch([c["joke_text"] for c in pending], "judge")):
+        candidate["evaluation"] = evaluation
+    scores = sorted((c["evaluation"]["overall_funniness"] for c in candidates if c.get("evaluation")), reverse=True)
+    plansearch_calls = budget.calls
+    return {
+        "plansearch_calls": plansearch_calls,
+        "candidates": len(candidates),
+        "score_per_call": sum(scores) / plansearch_calls if plansearch_calls else 0.0,
+        "mean_score": statistics.mean(scores) if scores else 0.0,
+        "top3_mean": statistics.mean(scores[:3]) if scores else 0.0,
+        "multi_angle_share": sum(1 for c in candidates
+                                 if len({client._latent(obs)["angle"] for obs in c["observations_used"]}) > 1)
+                             / max(1, len(candidates)),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--topics", type=int, default=20)
+    parser.add_argument("--budget", type=int, default=40, help="PLANSEARCH LLM calls per run")
+    parser.add_argument("--max-plans", type=int, default=10)
+    parser.add_argument("--observations", type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"{args.topics} topics, {args.observations} first-order observations, {args.budget} PLANSEARCH calls per run")
+    print(f"{'strategy':<18} {'calls':>6} {'cands':>6} {'score/call':>11} {'mean':>6} {'top-3':>6} {'multi-angle':>12}")
+    for strategy in ("itertools", "scheduler", "scheduler+bandit"):
+        rows = [run_strategy(strategy, f"topic{seed}", args, seed) for seed in range(args.topics)]
+        avg = {key: statistics.mean(row[key] for row in rows) for key in rows[0]}
+        print(f"{strategy:<18} {avg['plansearch_calls']:6.1f} {avg['candidates']:6.1f} {avg['score_per_call']:11.3f} "
+              f"{avg['mean_score']:6.2f} {avg['top3_mean']:6.2f} {avg['multi_angle_share']:11.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Build time, on-disk size and query latency of the n-gram corpus index on a synthetic corpus.
+
+    python -m <package>.benchmarks.bench_corpus_index [--jokes 1000000] [--n 7] [--queries 2000]
+"""
+import argparse
+import itertools
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from ..joke_corpus_index import NGramCorpusIndex, iter_joke_corpus
+
+
+def write_synthetic_corpus(path: str, num_jokes: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" for i in range(20000)]
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(vocabulary)))) # Zipf-like word frequencies
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(num_jokes):
+            f.write(" ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(12, 40))) + "\n")
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jokes", type=int, default=1_000_000)
+    parser.add_argument("--n", type=int, default=7)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="joke_corpus_bench_")
+    try:
+        corpus_path = os.path.join(workdir, "corpus.txt")
+        start = time.perf_counter()
+        write_synthetic_corpus(corpus_path, args.jokes)
+        print(f"corpus: {args.jokes} jokes, {os.path.getsize(corpus_path) / 1e6:.1f} MB (written in {time.perf_counter() - start:.1f}s)")
+
+        start = time.perf_counter()
+        NGramCorpusIndex.load_or_build(corpus_path, args.n)
+        print(f"build+persist: {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        index = NGramCorpusIndex.load_or_build(corpus_path, args.n)
+        print(f"reload (mmap): {(time.perf_counter() - start) * 1000:.2f} ms")
+        index_dir = f"{corpus_path}.ngram{args.n}.idx"
+        on_disk = sum(os.path.getsize(os.path.join(index_dir, name)) for name in os.listdir(index_dir))
+        print(f"index: {len(index.hashes)} postings, {on_disk / 1e6:.1f} MB on disk")
+
+        rng = random.Random(1)
+        sample = set(rng.sample(range(args.jokes), min(args.queries, args.jokes)))
+        known = [text for i, text in enumerate(iter_joke_corpus(corpus_path)) if i in sample]
+        novel = [" ".join(f"novel{rng.randint(0, 10**6)}" for _ in range(25)) for _ in range(args.queries)]
+        for label, queries in (("known", known), ("novel", novel)):
+            latencies = []
+            for text in queries:
+                start = time.perf_counter()
+                index.query(text)
+                latencies.append((time.perf_counter() - start) * 1e6)
+            print(f"query {label:<6} p50={statistics.median(latencies):8.1f}us  p99={percentile(latencies, 0.99):8.1f}us")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+End-to-end benchmarks replayed from a recorded transcript, so performance work can be
+measured, and regressions caught, on an offline machine:
+
+  plansearch - PlanSearcherForJokes.run_plansearch
+  pipeline   - JokePipelineManager.generate_and_evaluate_jokes
+  flask      - POST /generate_jokes, /generate_jokes/stream and /jobs (polled to completion)
+               through Flask's test client
+
+Each suite reports wall time per run, LLM and web-search calls per run, concurrency
+(mean and peak requests in flight, process CPU use) and memory (RSS growth and peak).
+
+Record a transcript once against the live services (needs an OpenRouter key and network):
+    python -m <package>.benchmarks.bench_end_to_end record --api-key KEY --transcript t.jsonl [--topic cats] [--runs 3]
+Replay it:
+    python -m <package>.benchmarks.bench_end_to_end run --transcript t.jsonl [--runs 20] [--concurrency 4]
+        [--latency-scale 1.0] [--suites plansearch,pipeline,flask] [--json out.json] [--baseline base.json]
+Without --transcript, `run` first records one against the local stub server.
+With --baseline, suites whose p50 wall time or calls per run grew by more than --tolerance fail
+the command. So does any request the transcript has no exact reply for (reported as a fidelity
+failure, whether it was served an approximate reply or none).
+"""
+import argparse
+import importlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from ..combination_scheduler import CombinationScheduler
+from ..joke_pipeline_manager import JokePipelineManager
+from ..openrouter_client import OpenRouterClient
+from ..plansearch_for_jokes import PlanSearcherForJokes
+from ..replay import (LLM, SEARCH, RecordingSearchBackend, ReplaySearchBackend, TranscriptRecorder,
+                      TranscriptReplayer, recording_session, replay_session)
+from ..web_search import DDGSSearchBackend, load_ddgs, StaticSearchBackend, WebSearchService
+from .bench_trace_soak import pipeline_responder, rss_bytes
+from .stub_server import StubOpenRouterServer
+
+API_KEY = "replay-key" # Replay never sends it anywhere
+# The pipeline's default models and PLANSEARCH settings, so the plansearch suite issues the recorded requests.
+PLANSEARCH_ARGS = {"observation_model": "google/gemma-3-27b", "plan_model": "google/gemma-3-27b",
+                   "joke_model": "deepseek/deepseek-v3", "critique_model": "mistralai/mistral-small",
+                   "use_critique_refinement": True, "max_plans_to_develop": 5, "num_second_order_obs_per_combo": 2}
+
+
+def fast_search(backend) -> WebSearchService:
+    return WebSearchService(backend, rate_per_second=10 ** 6, burst=10 ** 6)
+
+
+def record(transcript: str, api_key: str, topic: str, runs: int, api_url: Optional[str] = None,
+           search_backend=None) -> None:
+    recorder = TranscriptRecorder(transcript)
+    if search_backend is None and load_ddgs() is not None:
+        search_backend = DDGSSearchBackend()
+    web_search = fast_search(RecordingSearchBackend(search_backend, recorder)) if search_backend else None
+    for i in range(runs):
+        manager = JokePipelineManager(api_key, llm_session=recording_session(recorder), web_search=web_search)
+        if api_url:
+            manager.llm_client.api_url = api_url
+        manager.generate_and_evaluate_jokes(topic, {}, num_top_jokes=3)
+        print(f"recorded run {i + 1}/{runs}: {recorder.records} exchanges so far")
+
+
+def record_from_stub(transcript: str, topic: str, runs: int, latency_ms: float) -> None:
+    with StubOpenRouterServer(latency_s=latency_ms / 1000, responder=pipeline_responder) as server:
+        record(transcript, "stub-key", topic, runs, api_url=server.url,
+               search_backend=StaticSearchBackend(latency_s=latency_ms / 1000))
+
+
+def measure(name: str, replayer: TranscriptReplayer, runs: int, concurrency: int, run_once: Callable[[int], None]) -> Dict[str, Any]:
+    before = replayer.get_stats()
+    rss_before = rss_bytes()
+    cpu_before = sum(os.times()[:2])
+    durations: List[float] = []
+    lock = threading.Lock()
+
+    def timed(i: int) -> None:
+        start = time.perf_counter()
+        run_once(i)
+        with lock:
+            durations.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, range(runs)))
+    wall = time.perf_counter() - start
+    after = replayer.get_stats()
+    delta = lambda kind, key: after[kind][key] - before[kind][key]
+    calls = lambda kind: delta(kind, "exact") + delta(kind, "approximate") + delta(kind, "misses")
+    durations.sort()
+    quantile = lambda q: durations[min(len(durations) - 1, int(q * len(durations)))]
+    return {
+        "suite": name, "runs": runs, "concurrency": concurrency, "wall_seconds": round(wall, 3),
+        "runs_per_second": round(runs / wall, 3), "p50_seconds": round(quantile(0.5), 3),
+        "p95_seconds": round(quantile(0.95), 3),
+        "llm_calls_per_run": round(calls(LLM) / runs, 2), "search_calls_per_run": round(calls(SEARCH) / runs, 2),
+        "llm_unmatched_share": round((delta(LLM, "approximate") + delta(LLM, "misses")) / max(1, calls(LLM)), 3),
+        # Replies served for a different request than the one recorded: the run was not faithfully replayed.
+        "fidelity_failures": sum(delta(kind, "approximate") + delta(kind, "misses") for kind in (LLM, SEARCH)),
+        "llm_mean_in_flight": round(delta(LLM, "busy_seconds") / wall, 2),
+        "llm_peak_in_flight": after[LLM]["peak_in_flight"],
+        "cpu_utilization": round((sum(os.times()[:2]) - cpu_before) / wall, 2),
+        "rss_growth_mib": round((rss_bytes() - rss_before) / 2 ** 20, 1),
+        "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1), # KiB on Linux
+    }
+
+
+def plansearch_suite(replayer: TranscriptReplayer, topic: str) -> Callable[[int], None]:
+    searcher = PlanSearcherForJokes(OpenRouterClient(API_KEY, session=replay_session(replayer)))
+    # A fresh scheduler per run, as the pipeline uses, so combinations (and prompts) match the recording.
+    return lambda i: searcher.run_plansearch(topic=topic, combination_scheduler=CombinationScheduler(bandit_weight=0.0),
+                                             **PLANSEARCH_ARGS)
+
+
+def pipeline_suite(replayer: TranscriptReplayer, topic: str) -> Callable[[int], None]:
+    session, web_search = replay_session(replayer), fast_search(ReplaySearchBackend(replayer))
+
+    def run_once(i: int) -> None:
+        manager = JokePipelineManager(API_KEY, llm_session=session, web_search=web_search)
+        manager.generate_and_evaluate_jokes(topic, {}, num_top_jokes=3)
+
+    return run_once
+
+
+def flask_suite(app_module: Any, topic: str) -> Callable[[int], None]:
+    body = {"topic": topic, "user_openrouter_api_key": API_KEY, "num_top_jokes": 3}
+
+    def run_once(i: int) -> None:
+        client = app_module.app.test_client()
+        endpoint = ("sync", "stream", "job")[i % 3]
+        if endpoint == "sync":
+            response = client.post("/generate_jokes", json=body)
+            assert response.status_code == 200, response.get_data(as_text=True)
+        elif endpoint == "stream":
+            response = client.post("/generate_jokes/stream", json=body)
+            assert b"event: result" in response.get_data(), response.get_data(as_text=True)[-300:]
+        else:
+            job_id = client.post("/jobs", json=body).get_json()["job_id"]
+            while True:
+                job = client.get(f"/jobs/{job_id}").get_json()
+                if job["status"] not in ("queued", "running"):
+                    break
+                time.sleep(0.02)
+            assert job["status"] == "succeeded", job
+
+    return run_once
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> List[str]:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {result["suite"]: result for result in json.load(f)}
+    regressions = []
+    for result in results:
+        base = baseline.get(result["suite"])
+        for key in ("p50_seconds", "llm_calls_per_run", "search_calls_per_run"):
+            if base and base[key] and result[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{result['suite']}: {key} {base[key]} -> {result[key]}")
+    return regressions
+
+
+def run(args: argparse.Namespace) -> int:
+    transcript = args.transcript
+    if transcript is None:
+        transcript = os.path.join(tempfile.mkdtemp(prefix="jokebot-replay-"), "stub_transcript.jsonl")
+        record_from_stub(transcript, args.topic, args.record_runs, args.stub_latency_ms)
+        print(f"recorded a stub transcript: {transcript}")
+    # The flask suite replays through the app's own JOKEBOT_REPLAY_TRANSCRIPT wiring, so it gets its own replayer.
+    os.environ["JOKEBOT_REPLAY_TRANSCRIPT"] = transcript
+    os.environ["JOKEBOT_REPLAY_LATENCY_SCALE"] = str(args.latency_scale)
+    # record() runs the pipeline without candidate deduplication; the app must too, or it judges other batches.
+    os.environ["JOKEBOT_CANDIDATE_DEDUP"] = "0"
+
+    results = []
+    for suite in args.suites.split(","):
+        if suite == "flask":
+            app_module = importlib.import_module("..app", __package__)
+            replayer, run_once = app_module.replayer, flask_suite(app_module, args.topic)
+        else:
+            replayer = TranscriptReplayer(transcript, latency_scale=args.latency_scale)
+            run_once = (plansearch_suite if suite == "plansearch" else pipeline_suite)(replayer, args.topic)
+        results.append(measure(suite, replayer, args.runs, args.concurrency, run_once))
+
+    columns = [("suite", 10, "s"), ("p50_seconds", 8, ".3f"), ("p95_seconds", 8, ".3f"), ("runs_per_second", 8, ".2f"),
+               ("llm_calls_per_run", 9, ".1f"), ("search_calls_per_run", 9, ".1f"), ("llm_unmatched_share", 9, ".1%"),
+               ("llm_mean_in_flight", 9, ".1f"), ("llm_peak_in_flight", 9, "d"), ("cpu_utilization", 8, ".2f"),
+               ("fidelity_failures", 9, "d"), ("rss_growth_mib", 9, ".1f"), ("peak_rss_mib", 9, ".1f")]
+    headers = ["suite", "p50 s", "p95 s", "runs/s", "llm/run", "web/run", "unmatched", "in-flight", "peak", "cpu",
+               "infidel", "rss +MiB", "peak MiB"]
+    print(f"{args.runs} runs per suite, {args.concurrency} concurrent, latency x{args.latency_scale}")
+    print(" ".join(f"{header:<{width}}" if i == 0 else f"{header:>{width}}"
+                   for i, (header, (_, width, _)) in enumerate(zip(headers, columns))))
+    for result in results:
+        print(" ".join(f"{result[key]:<{width}{fmt}}" if i == 0 else f"{result[key]:>{width}{fmt}}"
+                       for i, (key, width, fmt) in enumerate(columns)))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    failures = [f"{result['suite']}: {result['fidelity_failures']} request(s) without an exact recorded reply"
+                for result in results if result["fidelity_failures"]]
+    for failure in failures:
+        print(f"FIDELITY FAILURE {failure}")
+    regressions = compare(results, args.baseline, args.tolerance) if args.baseline else []
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if failures or regressions else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="Record a transcript against OpenRouter and DuckDuckGo")
+    record_parser.add_argument("--api-key", default=os.environ.get("OPENROUTER_API_KEY"), required=False)
+    record_parser.add_argument("--transcript", required=True)
+    record_parser.add_argument("--topic", default="cats")
+    record_parser.add_argument("--runs", type=int, default=3)
+    run_parser = commands.add_parser("run", help="Replay a transcript through the benchmark suites")
+    run_parser.add_argument("--transcript")
+    run_parser.add_argument("--topic", default="cats", help="The topic the transcript was recorded with")
+    run_parser.add_argument("--runs", type=int, default=20)
+    run_parser.add_argument("--concurrency", type=int, default=4)
+    run_parser.add_argument("--latency-scale", type=float, default=1.0)
+    run_parser.add_argument("--suites", default="plansearch,pipeline,flask")
+    run_parser.add_argument("--record-runs", type=int, default=3, help="Runs recorded when no transcript is given")
+    run_parser.add_argument("--stub-latency-ms", type=float, default=30)
+    run_parser.add_argument("--json", help="Write the results here, e.g. to use as a later --baseline")
+    run_parser.add_argument("--baseline")
+    run_parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        if not args.api_key:
+            parser.error("record needs --api-key or OPENROUTER_API_KEY")
+        record(args.transcript, args.api_key, args.topic, args.runs)
+    else:
+        sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Fused versus two-call evaluation: LLM calls, tokens and latency spent scoring the same
+candidates, and how closely the fused ranking follows the two-call one (Spearman rho).
+Candidates go through the pipeline's streaming evaluator against a local stub
+OpenRouter server that plays a noisy judge:
+
+  - every joke has a hidden funniness and novelty
+  - each call reports them with independent noise
+  - a fused call's novelty leans toward the joke's funniness by --halo, the halo effect
+    of rating several traits in one response
+
+Latency is a fixed overhead per call plus a cost per generated token.
+
+    python -m <package>.benchmarks.bench_fused_evaluation [--jokes 60] [--judge-batch-size 5] [--halo 0.2]
+"""
+import argparse
+import json
+import random
+import re
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Sequence, Tuple
+
+from ..joke_pipeline_manager import JokePipelineManager, _StreamingEvaluator
+from ..llm_judge import FUSED_NOVELTY_KEY
+from ..metrics import summarize_usage
+from ..run_trace import RunTrace, reset_current_trace, set_current_trace
+from ..web_search import StaticSearchBackend, WebSearchService
+from .stub_server import StubOpenRouterServer
+
+JUDGE_MODEL, NOVELTY_MODEL = "judge/model", "novelty/model"
+SUBJECTS = ["cats", "tax season", "quantum physics", "dentists", "a haunted printer", "sourdough", "airport security",
+            "the gym", "group chats", "pirates", "a vegan vampire", "Mondays"]
+
+
+def make_jokes(count: int, seed: int) -> Dict[str, Tuple[float, float]]:
+    """Joke text -> hidden (funniness 1-10, novelty 0-1)."""
+    rng = random.Random(seed)
+    return {f"Joke {i}: why did {rng.choice(SUBJECTS)} bring a ladder to {rng.choice(SUBJECTS)}? "
+            f"Because it heard the punchline was on the next level, variant {i}.":
+            (rng.uniform(2, 9), rng.uniform(0.1, 0.9)) for i in range(count)}
+
+
+def make_responder(jokes: Dict[str, Tuple[float, float]], args: argparse.Namespace):
+    def noisy(joke: str, kind: str) -> random.Random:
+        return random.Random(zlib.crc32(f"{args.seed}|{kind}|{joke}".encode()))
+
+    def judge(joke: str, fused: bool) -> Dict[str, Any]:
+        funniness, novelty = jokes[joke]
+        rng = noisy(joke, "judge")
+        funny = max(1, min(10, round(funniness + rng.gauss(0, args.funniness_noise))))
+        evaluation = {key: max(1, min(10, round(funniness + rng.gauss(0, 1.5))))
+                      for key in ("originality", "coherence", "setup_effectiveness", "punchline_impact", "brevity")}
+        evaluation.update(overall_funniness=funny,
+                          rationale="Clear setup and a tidy misdirection, though the punchline is telegraphed.")
+        if fused:
+            leaning = (1 - args.halo) * novelty + args.halo * funny / 10
+            evaluation[FUSED_NOVELTY_KEY] = round(max(0.0, min(1.0, leaning + rng.gauss(0, args.novelty_noise))), 2)
+        return evaluation
+
+    def respond(payload: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = "\n".join(message["content"] for message in payload["messages"])
+        fused = f'"{FUSED_NOVELTY_KEY}"' in prompt
+        batch = re.findall(r'^\[(J\d+)\]\n"""\n(.*?)\n"""', prompt, re.M | re.S)
+        if batch:
+            content = json.dumps({"evaluations": [dict(judge(joke, fused), joke_id=joke_id) for joke_id, joke in batch]})
+        elif payload.get("response_format"):
+            content = json.dumps(judge(re.search(r'Joke to Evaluate:\n"""\n(.*?)\n"""', prompt, re.S).group(1), fused))
+        else:
+            joke = re.search(r'Joke: "(.*)"', prompt).group(1)
+            rng = noisy(joke, "novelty")
+            content = f"{max(0.0, min(1.0, jokes[joke][1] + rng.gauss(0, args.novelty_noise))):.2f}"
+        completion_tokens = max(1, len(content) // 4)
+        time.sleep((args.call_overhead_ms + completion_tokens * args.ms_per_output_token) / 1000)
+        return {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": max(1, len(prompt) // 4), "completion_tokens": completion_tokens}}
+
+    return respond
+
+
+def spearman(a: Sequence[float], b: Sequence[float]) -> float:
+    def ranks(values: Sequence[float]) -> List[float]:
+        order = sorted(range(len(values)), key=lambda i: values[i])
+        result = [0.0] * len(values)
+        start = 0
+        while start < len(order):
+            end = start
+            while end + 1 < len(order) and values[order[end + 1]] == values[order[start]]:
+                end += 1
+            for position in range(start, end + 1):
+                result[order[position]] = (start + end) / 2 # Ties share their average rank
+            start = end + 1
+        return result
+
+    ra, rb = ranks(a), ranks(b)
+    mean_a, mean_b = sum(ra) / len(ra), sum(rb) / len(rb)
+    covariance = sum((x - mean_a) * (y - mean_b) for x, y in zip(ra, rb))
+    spread = (sum((x - mean_a) ** 2 for x in ra) * sum((y - mean_b) ** 2 for y in rb)) ** 0.5
+    return covariance / spread if spread else 0.0
+
+
+def run(server_url: str, jokes: Sequence[str], args: argparse.Namespace, fused: bool) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    manager = JokePipelineManager(openrouter_api_key="bench-key")
+    manager.llm_client.api_url = server_url
+    manager.novelty_checker.web_search = WebSearchService(StaticSearchBackend(), rate_per_second=10 ** 6, burst=10 ** 6)
+    trace = RunTrace(None, "bench", {})
+    token = set_current_trace(trace)
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            evaluator = _StreamingEvaluator(manager, executor, JUDGE_MODEL, NOVELTY_MODEL, args.judge_batch_size,
+                                            fused_evaluation=fused)
+            for joke in jokes:
+                evaluator.submit({"joke_text": joke})
+            evaluator.flush()
+            evaluator.wait()
+    finally:
+        reset_current_trace(token)
+    usage = summarize_usage(trace.totals("llm_usage"))
+    usage["wall_seconds"] = time.perf_counter() - start
+    return usage, {joke_detail["joke_text"]: joke_detail["combined_score"] for joke_detail in evaluator.ranked_jokes}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jokes", type=int, default=60)
+    parser.add_argument("--judge-batch-size", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--halo", type=float, default=0.2, help="How far fused novelty leans toward funniness")
+    parser.add_argument("--funniness-noise", type=float, default=1.0)
+    parser.add_argument("--novelty-noise", type=float, default=0.1)
+    parser.add_argument("--call-overhead-ms", type=float, default=60)
+    parser.add_argument("--ms-per-output-token", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    hidden = make_jokes(args.jokes, args.seed)
+    jokes = list(hidden)
+    with StubOpenRouterServer(responder=make_responder(hidden, args)) as server:
+        results = {mode: run(server.url, jokes, args, mode == "fused") for mode in ("two-call", "fused")}
+
+    print(f"{args.jokes} candidates, judge batches of {args.judge_batch_size}, {args.concurrency} concurrent, "
+          f"halo {args.halo}")
+    print(f"{'mode':<9} {'calls':>6} {'prompt tok':>11} {'output tok':>11} {'LLM s':>7} {'wall s':>7}")
+    for mode, (usage, _) in results.items():
+        print(f"{mode:<9} {usage['calls']:6d} {usage['prompt_tokens']:11d} {usage['completion_tokens']:11d} "
+              f"{usage['latency_seconds']:7.2f} {usage['wall_seconds']:7.2f}")
+    (separate, separate_scores), (fused, fused_scores) = results["two-call"], results["fused"]
+    saved = lambda key: 1 - fused[key] / separate[key] if separate[key] else 0.0
+    print(f"saved     {saved('calls'):6.0%} {saved('prompt_tokens'):11.0%} {saved('completion_tokens'):11.0%} "
+          f"{saved('latency_seconds'):7.0%} {saved('wall_seconds'):7.0%}")
+
+    truth = [0.7 * hidden[joke][0] + 0.3 * 10 * hidden[joke][1] for joke in jokes]
+    print(f"Spearman rho, fused vs two-call ranking: "
+          f"{spearman([fused_scores[joke] for joke in jokes], [separate_scores[joke] for joke in jokes]):.3f}")
+    for mode, (_, scores) in results.items():
+        print(f"Spearman rho, {mode} vs hidden scores: {spearman([scores[joke] for joke in jokes], truth):.3f}")
+
+
+if __name__ == "__main__":
+    main()
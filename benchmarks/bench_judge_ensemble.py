@@ -0,0 +1,106 @@
+"""
+Top-k stability and judging cost for a single judgement per joke, exhaustive N-sample
+ensembles, and the adaptive JudgeEnsemble. The judges are simulated in-process: every
+joke has a hidden funniness and each judge model reports it with its own bias and noise.
+
+  stability - mean Jaccard overlap of the top-k sets between independent trials
+  accuracy  - mean overlap of the top-k with the hidden top-k
+
+    python -m <package>.benchmarks.bench_judge_ensemble [--jokes 30] [--k 3] [--trials 40] [--noise 1.5]
+"""
+import argparse
+import itertools
+import math
+import random
+from typing import Any, Dict, List, Optional
+
+from ..judge_ensemble import JudgeEnsemble
+
+MODELS = ["judge/a", "judge/b", "judge/c"]
+
+
+class SimulatedJudge:
+    """Stands in for LLMJudge.evaluate_jokes_batch."""
+
+    def __init__(self, hidden: Dict[str, float], noise: float, biases: Dict[str, float], rng: random.Random):
+        self.hidden = hidden
+        self.noise = noise
+        self.biases = biases
+        self.rng = rng
+        self.calls = 0
+        self.judgements = 0
+
+    def evaluate_jokes_batch(self, joke_texts: List[str], judge_model_name: str, batch_size: int = 5,
+                             **kwargs: Any) -> List[Optional[Dict[str, Any]]]:
+        self.calls += math.ceil(len(joke_texts) / max(1, batch_size))
+        self.judgements += len(joke_texts)
+        return [{"overall_funniness": max(1, min(10, round(self.hidden[joke] + self.biases[judge_model_name]
+                                                          + self.rng.gauss(0, self.noise))))}
+                for joke in joke_texts]
+
+
+def score(joke_detail: Dict[str, Any], funniness: float) -> float:
+    # The pipeline's combined_score
+    return 0.7 * funniness + 0.3 * joke_detail["novelty_scores"]["final_novelty_score"] * 10
+
+
+def top_k(candidates: List[Dict[str, Any]], k: int) -> frozenset:
+    return frozenset(joke_detail["joke_text"] for joke_detail in
+                     sorted(candidates, key=lambda joke_detail: -joke_detail["combined_score"])[:k])
+
+
+def trial(strategy: str, hidden: Dict[str, float], novelty: Dict[str, float], args: argparse.Namespace,
+          seed: int) -> Dict[str, Any]:
+    judge = SimulatedJudge(hidden, args.noise, dict(zip(MODELS, (0.0, 0.4, -0.4))), random.Random(seed))
+    jokes = list(hidden)
+    candidates = [{"joke_text": joke, "novelty_scores": {"final_novelty_score": novelty[joke]}} for joke in jokes]
+    for joke_detail, judgement in zip(candidates, judge.evaluate_jokes_batch(jokes, MODELS[0])):
+        joke_detail["evaluation"] = judgement
+        joke_detail["combined_score"] = score(joke_detail, judgement["overall_funniness"])
+    if strategy.startswith("exhaustive"):
+        samples = {joke: [joke_detail["evaluation"]["overall_funniness"]] for joke, joke_detail in zip(jokes, candidates)}
+        for model in itertools.islice(itertools.cycle(MODELS[1:] + MODELS[:1]), args.samples - 1):
+            for joke, judgement in zip(jokes, judge.evaluate_jokes_batch(jokes, model)):
+                samples[joke].append(judgement["overall_funniness"])
+        for joke, joke_detail in zip(jokes, candidates):
+            joke_detail["combined_score"] = score(joke_detail, sum(samples[joke]) / len(samples[joke]))
+    elif strategy == "adaptive":
+        ensemble = JudgeEnsemble(MODELS[1:], max_samples_per_joke=args.samples, max_rounds=args.max_rounds)
+        ensemble.rank(candidates, args.k, judge, MODELS[0], score)
+    return {"top": top_k(candidates, args.k), "calls": judge.calls, "judgements": judge.judgements}
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jokes", type=int, default=30)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--trials", type=int, default=40)
+    parser.add_argument("--noise", type=float, default=1.5, help="Judge noise, in funniness points")
+    parser.add_argument("--samples", type=int, default=5, help="Judgements per joke for the exhaustive ensemble")
+    parser.add_argument("--max-rounds", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    hidden = {f"joke {i}": rng.uniform(3, 8) for i in range(args.jokes)}
+    novelty = {joke: rng.uniform(0.3, 0.7) for joke in hidden}
+    truth = top_k([{"joke_text": joke, "combined_score": score({"novelty_scores": {"final_novelty_score": novelty[joke]}},
+                                                                 hidden[joke])} for joke in hidden], args.k)
+
+    print(f"{args.jokes} jokes, top {args.k}, {args.trials} trials, judge noise {args.noise}")
+    print(f"{'strategy':<14} {'stability':>9} {'accuracy':>9} {'calls':>7} {'judgements':>11}")
+    for strategy in ("single", f"exhaustive x{args.samples}", "adaptive"):
+        results = [trial(strategy, hidden, novelty, args, seed) for seed in range(args.trials)]
+        pairs = list(itertools.combinations([result["top"] for result in results], 2))
+        stability = sum(jaccard(a, b) for a, b in pairs) / len(pairs)
+        accuracy = sum(len(result["top"] & truth) / args.k for result in results) / len(results)
+        mean = lambda key: sum(result[key] for result in results) / len(results)
+        print(f"{strategy:<14} {stability:9.2f} {accuracy:9.2f} {mean('calls'):7.1f} {mean('judgements'):11.1f}")
+
+
+if __name__ == "__main__":
+    main()
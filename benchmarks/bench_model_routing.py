@@ -0,0 +1,99 @@
+"""
+Success rate and latency percentiles of OpenRouterClient under a misbehaving primary
+model, without and with the ModelRouter, against a local stub OpenRouter server.
+
+  errors  - the primary answers 503 to error_rate of calls and 429 (Retry-After) to
+            some more; a backup model is healthy
+  tail    - the primary is fast except for a slow tail_rate of calls; the backup is
+            a little slower but steady
+
+    python -m <package>.benchmarks.bench_model_routing [--calls 300] [--concurrency 8]
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from ..metrics import llm_stage
+from ..model_router import ModelRouter
+from ..openrouter_client import OpenRouterClient
+from .stub_server import StubOpenRouterServer, default_responder
+
+MESSAGES = [{"role": "user", "content": "Judge this joke."}]
+PRIMARY, BACKUP = "primary/model", "backup/model"
+
+
+def make_responder(args: argparse.Namespace, scenario: str) -> Callable[[Dict[str, Any]], Any]:
+    rng = random.Random(7)
+    lock = threading.Lock()
+
+    def respond(payload: Dict[str, Any]) -> Any:
+        with lock:
+            roll = rng.random()
+        if payload["model"] == BACKUP:
+            time.sleep(args.backup_ms / 1000)
+            return default_responder(payload)
+        if scenario == "errors":
+            time.sleep(args.primary_ms / 1000)
+            if roll < args.error_rate:
+                return 503, {"error": {"message": "upstream unavailable"}}, {}
+            if roll < args.error_rate + args.rate_limit_rate:
+                return 429, {"error": {"message": "rate limited"}}, {"Retry-After": "0.05"}
+            return default_responder(payload)
+        time.sleep((args.tail_ms if roll < args.tail_rate else args.primary_ms) / 1000)
+        return default_responder(payload)
+
+    return respond
+
+
+def run(args: argparse.Namespace, scenario: str, router: Optional[ModelRouter], max_retries: int) -> Dict[str, float]:
+    with StubOpenRouterServer(responder=make_responder(args, scenario)) as server:
+        client = OpenRouterClient("bench-key", api_url=server.url, router=router, max_retries=max_retries)
+
+        def call(_: int) -> Optional[float]:
+            start = time.perf_counter()
+            with llm_stage("judge"):
+                reply = client.get_completion(PRIMARY, MESSAGES)
+            return time.perf_counter() - start if reply else None
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(call, range(args.calls)))
+        served = server.requests_served
+    latencies = sorted(result for result in results if result is not None)
+    quantile = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0.0
+    return {"success": len(latencies) / len(results), "p50": quantile(0.50), "p95": quantile(0.95),
+            "p99": quantile(0.99), "requests_per_call": served / len(results)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--primary-ms", type=float, default=20)
+    parser.add_argument("--backup-ms", type=float, default=40)
+    parser.add_argument("--tail-ms", type=float, default=1000)
+    parser.add_argument("--tail-rate", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.3)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    configurations = [
+        ("errors", "no router, no retries", lambda: None, 0),
+        ("errors", "retries only", lambda: None, 2),
+        ("errors", "retries + fallback", lambda: ModelRouter({"judge": [BACKUP]}), 2),
+        ("tail", "no router", lambda: None, 0),
+        ("tail", "fallback, no hedging", lambda: ModelRouter({"judge": [BACKUP]}), 0),
+        ("tail", "hedged at p95", lambda: ModelRouter({"judge": [BACKUP]}, hedge=True, hedge_min_samples=20), 0),
+    ]
+    print(f"{args.calls} calls, {args.concurrency} concurrent")
+    print(f"{'scenario':<8} {'configuration':<24} {'success':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/call':>9}")
+    for scenario, name, make_router, max_retries in configurations:
+        result = run(args, scenario, make_router(), max_retries)
+        print(f"{scenario:<8} {name:<24} {result['success']:8.1%} {result['p50']:8.1f} {result['p95']:8.1f} "
+              f"{result['p99']:8.1f} {result['requests_per_call']:9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Provider prompt-prefix caching under three prompt layouts, measured through the pipeline's own
+per-call accounting (cached prompt tokens and latency per stage in each run's trace):
+
+  legacy        - each call as one user message with the variable text (joke, topic, observations)
+                  ahead of the static instructions and rubric, as the prompts were laid out before
+  prefix-first  - static system message first, variable user message after it
+  prefix+hints  - the same, with cache_control breakpoints for models that need them
+
+The stub server simulates a provider cache: per model, the longest previously seen prompt prefix
+is cached in blocks of --block-tokens (at least --min-prefix-tokens), automatically for most
+models but only up to a cache_control breakpoint for anthropic/ models. Latency grows with the
+uncached prompt tokens, so cached calls come back faster. Tokens are estimated as 4 characters.
+
+    python -m <package>.benchmarks.bench_prompt_cache [--runs 5]
+"""
+import argparse
+import hashlib
+import threading
+import time
+from typing import Any, Dict, List, Set
+
+from ..joke_pipeline_manager import JokePipelineManager
+from ..metrics import prompt_cache_summary
+from ..run_trace import RunTraceStore
+from ..web_search import StaticSearchBackend, WebSearchService
+from .bench_trace_soak import pipeline_responder
+from .stub_server import StubOpenRouterServer
+
+LAYOUTS = ("legacy", "prefix-first", "prefix+hints")
+BREAKPOINT_MODEL_PREFIXES = ("anthropic/",)
+
+
+def message_text(message: Dict[str, Any]) -> str:
+    content = message["content"]
+    return content if isinstance(content, str) else "".join(part.get("text", "") for part in content)
+
+
+class PrefixCacheSimulator:
+    def __init__(self, block_tokens: int, min_prefix_tokens: int):
+        self.block_chars = block_tokens * 4
+        self.min_prefix_tokens = min_prefix_tokens
+        self._seen: Dict[str, Set[bytes]] = {}
+        self._lock = threading.Lock()
+
+    def cached_tokens(self, model: str, prompt: str, cacheable_chars: int) -> int:
+        """Tokens of prompt[:cacheable_chars] already cached for model; the prefix is cached for next time."""
+        digests = []
+        hasher = hashlib.blake2b(digest_size=16)
+        for start in range(0, cacheable_chars - self.block_chars + 1, self.block_chars):
+            hasher.update(prompt[start:start + self.block_chars].encode("utf-8"))
+            digests.append(hasher.copy().digest())
+        with self._lock:
+            seen = self._seen.setdefault(model, set())
+            hits = 0
+            while hits < len(digests) and digests[hits] in seen:
+                hits += 1
+            seen.update(digests)
+        cached = hits * self.block_chars // 4
+        return cached if cached >= self.min_prefix_tokens else 0
+
+
+def caching_responder(layout: str, simulator: PrefixCacheSimulator, args: argparse.Namespace):
+    def respond(payload: Dict[str, Any]) -> Dict[str, Any]:
+        messages = payload["messages"]
+        if layout == "legacy":
+            variable = [message_text(message) for message in messages if message["role"] != "system"]
+            static = [message_text(message) for message in messages if message["role"] == "system"]
+            messages = [{"role": "user", "content": "\n\n".join(variable + static)}]
+        prompt, breakpoint = "", 0
+        for message in messages:
+            prompt += f"<{message['role']}>{message_text(message)}"
+            if not isinstance(message["content"], str) and any("cache_control" in part for part in message["content"]):
+                breakpoint = len(prompt)
+        model = payload["model"]
+        cacheable = breakpoint if model.startswith(BREAKPOINT_MODEL_PREFIXES) else len(prompt)
+        cached_tokens = simulator.cached_tokens(model, prompt, cacheable)
+
+        reply = pipeline_responder({"messages": [{"role": "user", "content": prompt}],
+                                    "response_format": payload.get("response_format")})
+        prompt_tokens = max(1, len(prompt) // 4)
+        completion_tokens = max(1, len(reply["choices"][0]["message"]["content"]) // 4)
+        time.sleep((args.call_overhead_ms + (prompt_tokens - cached_tokens) * args.ms_per_prompt_token
+                    + cached_tokens * args.ms_per_cached_token + completion_tokens * args.ms_per_output_token) / 1000)
+        reply["usage"] = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+        return reply
+
+    return respond
+
+
+def run_layout(layout: str, args: argparse.Namespace) -> Dict[str, Any]:
+    simulator = PrefixCacheSimulator(args.block_tokens, args.min_prefix_tokens)
+    trace_store = RunTraceStore(max_runs=args.runs, ttl_seconds=None)
+    web_search = WebSearchService(StaticSearchBackend(), rate_per_second=10 ** 6, burst=10 ** 6)
+    rows: List[Dict[str, Any]] = []
+    wall_times = []
+    with StubOpenRouterServer(responder=caching_responder(layout, simulator, args)) as server:
+        for run in range(args.runs):
+            manager = JokePipelineManager(openrouter_api_key="bench", trace_store=trace_store,
+                                          prompt_cache_hints=layout == "prefix+hints")
+            manager.llm_client.api_url = server.url
+            manager.novelty_checker.web_search = web_search
+            start = time.perf_counter()
+            manager.generate_and_evaluate_jokes(f"topic {run}", {}, num_top_jokes=3)
+            wall_times.append(time.perf_counter() - start)
+            rows.extend(trace_store.get(manager.last_run_id)["llm_usage"])
+    stages = sorted({row["stage"] for row in rows})
+    by_stage = {}
+    for stage in stages:
+        stage_rows = [row for row in rows if row["stage"] == stage]
+        calls = sum(row["calls"] - row["cache_hits"] for row in stage_rows)
+        by_stage[stage] = dict(prompt_cache_summary(stage_rows), seconds_per_call=sum(
+            row["latency_seconds"] for row in stage_rows) / calls if calls else None)
+    return {
+        "overall": prompt_cache_summary(rows),
+        "by_stage": by_stage,
+        "uncached_prompt_tokens_per_run": sum(row["prompt_tokens"] - row["cached_prompt_tokens"] for row in rows) / args.runs,
+        "llm_seconds_per_run": sum(row["latency_seconds"] for row in rows) / args.runs,
+        "wall_seconds_per_run": sum(wall_times) / args.runs
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--block-tokens", type=int, default=64)
+    parser.add_argument("--min-prefix-tokens", type=int, default=64)
+    parser.add_argument("--call-overhead-ms", type=float, default=20.0)
+    parser.add_argument("--ms-per-prompt-token", type=float, default=0.5)
+    parser.add_argument("--ms-per-cached-token", type=float, default=0.05)
+    parser.add_argument("--ms-per-output-token", type=float, default=1.0)
+    args = parser.parse_args()
+
+    results = {layout: run_layout(layout, args) for layout in LAYOUTS}
+    print(f"{args.runs} pipeline runs per layout, {args.block_tokens}-token cache blocks\n")
+    print(f"{'layout':<14} {'cached_ratio':>12} {'cached_calls':>13} {'uncached_tokens/run':>20} "
+          f"{'llm_s/run':>10} {'wall_s/run':>11}")
+    for layout, result in results.items():
+        overall = result["overall"]
+        calls = f"{overall['cached_calls']}/{overall['cached_calls'] + overall['uncached_calls']}"
+        print(f"{layout:<14} {overall['cached_token_ratio'] or 0:12.3f} {calls:>13} "
+              f"{result['uncached_prompt_tokens_per_run']:20.0f} {result['llm_seconds_per_run']:10.2f} "
+              f"{result['wall_seconds_per_run']:11.2f}")
+
+    print("\ncached-token ratio and seconds per call, by stage")
+    stages = sorted({stage for result in results.values() for stage in result["by_stage"]})
+    print(f"{'stage':<14} " + " ".join(f"{layout:>16}" for layout in LAYOUTS))
+    for stage in stages:
+        cells = []
+        for layout in LAYOUTS:
+            summary = results[layout]["by_stage"].get(stage, {})
+            cells.append(f"{summary.get('cached_token_ratio') or 0:.3f} / {summary.get('seconds_per_call') or 0:.3f}s")
+        print(f"{stage:<14} " + " ".join(f"{cell:>16}" for cell in cells))
+
+if __name__ == "__main__":
+    main()
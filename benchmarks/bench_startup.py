@@ -0,0 +1,165 @@
+"""
+Startup time and per-worker memory of the novelty assets under a pre-forking server.
+
+Import: wall time of a cold `import <package>.app` in a fresh interpreter, and which heavy
+optional modules that import pulled in.
+
+Workers: builds a synthetic joke corpus and its n-gram and embedding indexes once, then forks
+--workers processes per mode. Each one scores --queries jokes through a NoveltyChecker.
+  lazy          - every worker loads the memory-mapped indexes itself after the fork
+  lazy-inmem    - every worker reads the index arrays into its own memory
+  preload       - the parent warms the shared registry (mmap) and gc.freeze()s before forking
+  preload-inmem - the same with in-memory arrays, shared copy-on-write
+ready_ms is fork to first answer. PSS splits shared pages between the processes mapping them,
+so the PSS total (workers plus the master) is the real footprint; USS is what a worker alone holds.
+Linux only (/proc/self/smaps_rollup).
+
+    python -m <package>.benchmarks.bench_startup [--workers 4] [--corpus-jokes 50000] [--queries 50]
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from ..novelty_checker import NoveltyChecker
+from ..shared_assets import SharedAssets
+from ..web_search import StaticSearchBackend, WebSearchService
+
+PACKAGE = __package__.rsplit(".", 1)[0]
+HEAVY_MODULES = ("nltk", "duckduckgo_search", "sentence_transformers", "torch", "numpy", "flask", "requests")
+WORDS = ("penguin tuxedo waiter serve cold fish ice slide waddle colony chef soup taxes dentist robot cat dog "
+         "banker coffee monday printer wifi password meeting deadline server cloud bug feature").split()
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {package}.app
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "modules": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure_import(repeats: int) -> Dict[str, Any]:
+    env = dict(os.environ, JOKEBOT_JOB_WORKERS="1")
+    cwd = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", IMPORT_PROBE.format(package=PACKAGE, heavy=HEAVY_MODULES)],
+                                cwd=cwd, env=env, capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {"median_ms": statistics.median(run["seconds"] for run in runs) * 1000, "modules": runs[-1]["modules"]}
+
+
+def memory() -> Dict[str, int]:
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    return {"rss": fields.get("Rss", 0), "pss": fields.get("Pss", 0),
+            "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)}
+
+
+def write_corpus(path: str, num_jokes: int, seed: int) -> None:
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(num_jokes):
+            f.write(" ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 24))) + "\n")
+
+
+def checker(corpus_path: str, assets: SharedAssets) -> NoveltyChecker:
+    return NoveltyChecker(None, joke_corpus_path=corpus_path, use_ann=False, shared_assets=assets,
+                          web_search=WebSearchService(StaticSearchBackend()))
+
+
+def serve(novelty_checker: NoveltyChecker, jokes: List[str]) -> None:
+    novelty_checker.check_semantic_similarity_batch(jokes)
+    for joke in jokes:
+        novelty_checker.check_n_gram_overlap(joke)
+
+
+def run_mode(mode: str, corpus_path: str, jokes: List[str], workers: int) -> Dict[str, Any]:
+    in_memory = mode.endswith("inmem")
+    assets = SharedAssets(mmap=not in_memory)
+    if mode.startswith("preload"):
+        checker(corpus_path, assets).warm_up()
+        gc.freeze()
+    children = []
+    for _ in range(workers):
+        report_read, report_write = os.pipe()
+        go_read, go_write = os.pipe()
+        forked_at = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            os.close(report_read)
+            os.close(go_write)
+            serve(checker(corpus_path, assets), jokes)
+            ready_ms = (time.perf_counter() - forked_at) * 1000
+            serve(checker(corpus_path, assets), jokes) # Steady state: a second request
+            os.write(report_write, b"ready\n")
+            os.read(go_read, 1) # Measured only once every worker is up, so shared pages are split between all of them
+            os.write(report_write, json.dumps(dict(memory(), ready_ms=ready_ms)).encode("utf-8"))
+            os.close(report_write)
+            os.read(go_read, 1)
+            os._exit(0)
+        os.close(report_write)
+        os.close(go_read)
+        children.append((pid, os.fdopen(report_read), go_write))
+    for _, report, _ in children:
+        report.readline()
+    for _, _, go in children:
+        os.write(go, b"m")
+    results = [json.loads(report.readline()) for _, report, _ in children]
+    master = memory()
+    for pid, report, go in children:
+        os.write(go, b"x")
+        os.close(go)
+        report.close()
+        os.waitpid(pid, 0)
+    gc.unfreeze()
+    return {"workers": results, "master": master}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--corpus-jokes", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=50, help="Jokes scored per request")
+    parser.add_argument("--import-repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    imported = measure_import(args.import_repeats)
+    print(f"import {PACKAGE}.app: {imported['median_ms']:.0f} ms median of {args.import_repeats}, "
+          f"heavy modules loaded: {', '.join(imported['modules']) or 'none'}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_path = os.path.join(tmp, "jokes.txt")
+        write_corpus(corpus_path, args.corpus_jokes, args.seed)
+        start = time.perf_counter()
+        checker(corpus_path, SharedAssets()).warm_up() # Builds and persists the indexes once
+        print(f"built indexes for {args.corpus_jokes} jokes in {time.perf_counter() - start:.1f} s")
+        rng = random.Random(args.seed + 1)
+        jokes = [" ".join(rng.choice(WORDS) for _ in range(16)) for _ in range(args.queries)]
+
+        print(f"\n{args.workers} workers, {args.queries} jokes per request")
+        print(f"{'mode':<14} {'ready_ms':>9} {'rss_MiB':>8} {'pss_MiB':>8} {'uss_MiB':>8} {'pss_total_MiB':>14}")
+        for mode in ("lazy", "lazy-inmem", "preload", "preload-inmem"):
+            measured = run_mode(mode, corpus_path, jokes, args.workers)
+            results = measured["workers"]
+            mean = lambda key: statistics.mean(result[key] for result in results)
+            total_pss = sum(result["pss"] for result in results) + measured["master"]["pss"]
+            print(f"{mode:<14} {mean('ready_ms'):9.1f} {mean('rss') / 2 ** 20:8.1f} {mean('pss') / 2 ** 20:8.1f} "
+                  f"{mean('uss') / 2 ** 20:8.1f} {total_pss / 2 ** 20:14.1f}")
+
+
+if __name__ == "__main__":
+    main()
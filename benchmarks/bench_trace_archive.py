@@ -0,0 +1,155 @@
+"""
+Cross-run trace analysis: the columnar TraceArchive versus JSON-lines traces loaded into
+Python dicts. Synthetic run traces have the pipeline's shape; one stage is made slow and
+one model unreliable, and both analyses must find them.
+
+Reports append cost per run, flush and compaction time, on-disk size, and for each
+query path its wall time and peak Python heap (tracemalloc). The archive's column data
+stays in memory-mapped segment pages, which are not heap allocations.
+
+    python -m <package>.benchmarks.bench_trace_archive [--runs 5000]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from ..trace_archive import TraceArchive
+
+STAGES = ("observations", "plan", "joke", "critique", "refinement", "judge", "novelty")
+MODELS = ("google/gemma-3-27b", "deepseek/deepseek-v3", "mistralai/mistral-small", "anthropic/claude-3.5-sonnet")
+SLOW_STAGE = "critique"
+BAD_MODEL = "deepseek/deepseek-v3"
+
+
+def synthetic_trace(rng: random.Random, index: int) -> Dict[str, Any]:
+    jokes = [f"joke {index}-{i} about {rng.choice(('cats', 'taxes', 'wifi'))} " + "word " * rng.randint(8, 20)
+             for i in range(10)]
+    usage = []
+    for stage in STAGES:
+        model = rng.choice(MODELS)
+        calls = rng.randint(2, 10)
+        per_call = rng.uniform(0.5, 1.5) * (4 if stage == SLOW_STAGE else 1)
+        usage.append({"model": model, "stage": stage, "calls": calls, "errors": sum(
+            rng.random() < (0.2 if model == BAD_MODEL else 0.01) for _ in range(calls)),
+            "cache_hits": 0, "prompt_tokens": calls * 400, "completion_tokens": calls * 80,
+            "cost_usd": calls * 0.0004, "retries": 0, "latency_seconds": calls * per_call})
+    return {
+        "run_id": f"run-{index}", "created_at": time.time(), "topic": "cats", "evaluation_mode": "separate_novelty_call",
+        "models": {"observation": MODELS[0], "plan": MODELS[0], "joke_instantiation": rng.choice(MODELS),
+                   "critique": MODELS[2], "judge": MODELS[3], "novelty_llm": MODELS[2]},
+        "wall_time_seconds": rng.uniform(20, 60), "llm_usage": usage,
+        "llm_usage_totals": {"calls": sum(row["calls"] for row in usage), "latency_seconds": sum(row["latency_seconds"] for row in usage)},
+        "final_ranked_jokes_summary": [{"joke": joke[:60] + "...", "score": rng.uniform(4, 8)} for joke in jokes[:3]],
+        "plansearch_data": {
+            "observations": [{"topic": "cats", "existing_observations": None,
+                              "generated_observations": [f"observation {i}" for i in range(6)]}],
+            "plans": [{"topic": "cats", "observation_combo": ["observation 1", "observation 2"],
+                       "generated_plan": "plan text " * 20} for _ in range(5)],
+            "jokes_generated": [{"topic": "cats", "plan": "plan text " * 20, "critique": "critique " * 10,
+                                 "joke": joke, "sample_index": 0} for joke in jokes]
+        },
+        "novelty_checker_data": {"novelty_checks": [{"joke_text": joke, "scores": {
+            "n_gram_overlap_score": 0.0, "semantic_similarity_corpus_score": rng.random(), "web_found_penalty_score": 0.0,
+            "perceived_novelty_llm_score": rng.random(), "final_novelty_score": rng.random()}} for joke in jokes]},
+        "llm_judge_data": {"evaluations": [{"joke_text": joke, "judge_model": MODELS[3], "raw_response": "{...}",
+                                            "parsed_evaluation": {"overall_funniness": rng.randint(1, 10),
+                                                                  "rationale": "fine " * 15},
+                                            "batch_presentation_order": i, "batch_size": 5}
+                                           for i, joke in enumerate(jokes)]}
+    }
+
+
+def dict_analysis(path: str) -> Tuple[str, str]:
+    """The approach without an archive: load every trace, then aggregate in Python."""
+    with open(path, encoding="utf-8") as f:
+        traces = [json.loads(line) for line in f]
+    stage_latency: Dict[str, float] = {}
+    model_calls: Dict[str, List[int]] = {}
+    for trace in traces:
+        for row in trace["llm_usage"]:
+            stage_latency[row["stage"]] = stage_latency.get(row["stage"], 0.0) + row["latency_seconds"]
+            counts = model_calls.setdefault(row["model"], [0, 0])
+            counts[0] += row["calls"]
+            counts[1] += row["errors"]
+    slowest = max(stage_latency, key=stage_latency.get)
+    worst = max(model_calls, key=lambda model: model_calls[model][1] / model_calls[model][0])
+    return slowest, worst
+
+
+def archive_analysis(archive: TraceArchive) -> Tuple[str, str]:
+    slowest = archive.stage_latency()[0]["stage"]
+    worst = archive.model_stats()[0]["model"]
+    archive.joke_quality_by_model()
+    archive.run_summary()
+    return slowest, worst
+
+
+def measured(fn: Callable[[], Any]) -> Tuple[Any, float, float]:
+    """Result, wall time of an untraced call, and peak Python heap of a second, traced call."""
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak / 2 ** 20
+
+
+def directory_bytes(directory: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5000)
+    parser.add_argument("--flush-runs", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    traces = [synthetic_trace(rng, index) for index in range(args.runs)]
+    with tempfile.TemporaryDirectory() as tmp:
+        jsonl_path = os.path.join(tmp, "traces.jsonl")
+        with open(jsonl_path, "w", encoding="utf-8") as f:
+            for trace in traces:
+                f.write(json.dumps(trace) + "\n")
+
+        archive = TraceArchive(os.path.join(tmp, "archive"), flush_interval_s=3600, flush_runs=10 ** 9)
+        start = time.perf_counter()
+        flush_seconds = 0.0
+        for index, trace in enumerate(traces, 1):
+            archive.append(trace)
+            if index % args.flush_runs == 0:
+                flush_start = time.perf_counter()
+                archive.flush()
+                flush_seconds += time.perf_counter() - flush_start
+        append_seconds = time.perf_counter() - start - flush_seconds
+        archive.flush()
+        start = time.perf_counter()
+        merged = archive.compact()
+        compact_seconds = time.perf_counter() - start
+        segments = sum(sum(levels.values()) for levels in archive.segment_counts().values())
+
+        print(f"{args.runs} runs, flushed every {args.flush_runs}")
+        print(f"append {append_seconds / args.runs * 1e6:.0f} us/run (buffering only), flushes {flush_seconds:.2f} s total, "
+              f"compaction {compact_seconds:.2f} s ({merged} segments merged, {segments} left)")
+        print(f"on disk: archive {directory_bytes(archive.directory) / 2 ** 20:.1f} MiB, "
+              f"JSON lines {os.path.getsize(jsonl_path) / 2 ** 20:.1f} MiB\n")
+
+        del traces
+        print(f"{'analysis':<12} {'seconds':>8} {'heap_MiB':>9}  slowest stage / least reliable model")
+        for name, fn in (("dicts", lambda: dict_analysis(jsonl_path)), ("archive", lambda: archive_analysis(archive))):
+            (slowest, worst), seconds, peak = measured(fn)
+            ok = "ok" if (slowest, worst) == (SLOW_STAGE, BAD_MODEL) else "WRONG"
+            print(f"{name:<12} {seconds:8.3f} {peak:9.1f}  {slowest} / {worst} ({ok})")
+        archive.close()
+
+
+if __name__ == "__main__":
+    main()
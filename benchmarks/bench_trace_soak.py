@@ -0,0 +1,93 @@
+"""
+Soak test for run-scoped transparency traces: runs thousands of full pipeline runs
+against a local stub OpenRouter server and samples process RSS as they complete.
+With a bounded RunTraceStore RSS levels off once the store is full; pass
+--max-runs 0 to keep every trace and watch it grow instead.
+
+    python -m <package>.benchmarks.bench_trace_soak [--runs 3000] [--concurrency 8] [--max-runs 256]
+"""
+import argparse
+import json
+import os
+import re
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+from ..joke_pipeline_manager import JokePipelineManager
+from ..run_trace import RunTraceStore
+from ..web_search import StaticSearchBackend, WebSearchService
+from .stub_server import StubOpenRouterServer
+
+EVALUATION = {"originality": 6, "coherence": 7, "setup_effectiveness": 6, "punchline_impact": 5, "brevity": 8,
+              "overall_funniness": 6, "rationale": "Solid wordplay. " * 200} # Large raw responses, as real judges return
+
+
+def pipeline_responder(payload: Dict[str, Any]) -> Dict[str, Any]:
+    prompt = "\n".join(message["content"] for message in payload["messages"])
+    joke_ids = re.findall(r"^\[(J\d+)\]", prompt, re.M)
+    if joke_ids:
+        content = json.dumps({"evaluations": [dict(EVALUATION, joke_id=joke_id) for joke_id in joke_ids]})
+    elif payload.get("response_format"):
+        content = json.dumps(EVALUATION)
+    elif "novelty score" in prompt:
+        content = "0.6"
+    elif "brainstorm" in prompt.lower():
+        content = "\n".join(f"observation {i} {len(prompt) % 97}" for i in range(6))
+    else:
+        content = f"A joke about {len(prompt)} things walks into a bar."
+    return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # Peak, not current, off Linux
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-runs", type=int, default=256, help="RunTraceStore capacity; 0 keeps every trace")
+    parser.add_argument("--samples", type=int, default=10)
+    args = parser.parse_args()
+
+    trace_store = RunTraceStore(max_runs=args.max_runs or 10 ** 9, ttl_seconds=None)
+    web_search = WebSearchService(StaticSearchBackend(), rate_per_second=10 ** 6, burst=10 ** 6)
+    completed = 0
+    leaked = 0
+    lock = threading.Lock()
+    sample_every = max(1, args.runs // args.samples)
+
+    with StubOpenRouterServer(responder=pipeline_responder) as server:
+        def run(i: int) -> None:
+            nonlocal completed, leaked
+            manager = JokePipelineManager(openrouter_api_key="soak", trace_store=trace_store)
+            manager.llm_client.api_url = server.url
+            manager.novelty_checker.web_search = web_search
+            topic = f"soak topic {i}"
+            manager.generate_and_evaluate_jokes(topic, {}, num_top_jokes=3)
+            trace = trace_store.get(manager.last_run_id) or manager.get_last_run_transparency_data()
+            topics = {entry["topic"] for entry in trace.get("plansearch_data", {}).get("observations", [])}
+            with lock:
+                completed += 1
+                leaked += topics != {topic} # Records from another concurrent run
+                if completed % sample_every == 0:
+                    print(f"runs={completed:6d}  rss={rss_bytes() / 2 ** 20:8.1f} MiB  stored_traces={len(trace_store)}")
+
+        print(f"{args.runs} runs, concurrency {args.concurrency}, trace store capacity {args.max_runs or 'unbounded'}")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(run, range(args.runs)))
+        elapsed = time.perf_counter() - start
+
+    print(f"done in {elapsed:.1f}s ({args.runs / elapsed:.1f} runs/s), runs with foreign trace records: {leaked}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional
+
+
+def default_responder(payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "choices": [{"index": i, "message": {"role": "assistant", "content": f"stub reply {i} from {payload.get('model')}"}}
+                    for i in range(payload.get("n", 1))],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    }
+
+
+class _CountingHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connections_opened = 0
+        self.requests_served = 0
+        self._count_lock = threading.Lock()
+
+    def get_request(self):
+        conn = super().get_request()
+        with self._count_lock:
+            self.connections_opened += 1
+        return conn
+
+
+class StubOpenRouterServer:
+    """
+    Local HTTP/1.1 keep-alive server that speaks the chat/completions shape.
+    Counts accepted TCP connections so benchmarks can show handshake savings.
+    `responder(payload)` returns the JSON body, or a (status, body, headers) tuple.
+    """
+
+    def __init__(self,
+                 latency_s: float = 0.0,
+                 responder: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                 host: str = "127.0.0.1",
+                 port: int = 0):
+        self.latency_s = latency_s
+        self.responder = responder or default_responder
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True # headers and body are separate writes
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if stub.latency_s:
+                    time.sleep(stub.latency_s)
+                result = stub.responder(payload)
+                status, headers = 200, {}
+                if isinstance(result, tuple):
+                    status, result, headers = result
+                body = json.dumps(result).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+                with self.server._count_lock:
+                    self.server.requests_served += 1
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = _CountingHTTPServer((host, port), Handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/v1/chat/completions"
+
+    @property
+    def connections_opened(self) -> int:
+        return self._server.connections_opened
+
+    @property
+    def requests_served(self) -> int:
+        return self._server.requests_served
+
+    def reset_counters(self) -> None:
+        with self._server._count_lock:
+            self._server.connections_opened = 0
+            self._server.requests_served = 0
+
+    def start(self) -> "StubOpenRouterServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-openrouter", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubOpenRouterServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
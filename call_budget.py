@@ -0,0 +1,44 @@
+
+import threading
+from typing import Dict, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) for budgeting before a call is made."""
+    return len(text) // 4 + 1
+
+
+class CallBudget:
+    """
+    Thread-safe cap on LLM calls and tokens for one run. Each call reserves its prompt's
+    estimated tokens plus the requested max_tokens up front, so the cap is never exceeded.
+    None means unlimited.
+    """
+
+    def __init__(self, max_calls: Optional[int] = None, max_tokens: Optional[int] = None):
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self.calls = 0
+        self.tokens = 0
+        self.denied = 0
+        self._lock = threading.Lock()
+
+    def try_spend(self, tokens: int, calls: int = 1) -> bool:
+        with self._lock:
+            if (self.max_calls is not None and self.calls + calls > self.max_calls) or \
+               (self.max_tokens is not None and self.tokens + tokens > self.max_tokens):
+                self.denied += calls
+                return False
+            self.calls += calls
+            self.tokens += tokens
+            return True
+
+    def exhausted(self) -> bool:
+        """True once the call cap is reached or any call has been turned away."""
+        with self._lock:
+            return self.denied > 0 or (self.max_calls is not None and self.calls >= self.max_calls)
+
+    def get_stats(self) -> Dict[str, Optional[int]]:
+        with self._lock:
+            return {"calls": self.calls, "tokens": self.tokens, "denied": self.denied,
+                    "max_calls": self.max_calls, "max_tokens": self.max_tokens}
@@ -0,0 +1,130 @@
+
+import re
+import threading
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+
+def normalize_joke(joke_text: str) -> str:
+    text = re.sub(r"[^\w\s]", "", joke_text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def shingles(normalized: str, size: int = 2) -> FrozenSet[str]:
+    """Word n-grams of every length from 1 to size."""
+    tokens = normalized.split()
+    return frozenset(" ".join(tokens[i:i + n]) for n in range(1, size + 1) for i in range(len(tokens) - n + 1))
+
+
+class CandidateClusters:
+    """
+    One run's near-duplicate clusters, built as candidates stream in. The first candidate
+    of each cluster is its representative and the only one evaluated.
+    """
+
+    def __init__(self, deduplicator: "CandidateDeduplicator"):
+        self.deduplicator = deduplicator
+        self._representatives: List[Tuple[Any, Dict[str, Any]]] = [] # (features, joke_detail)
+        self._features: Dict[str, Any] = {} # joke_text -> features, for the final selection
+        self._members: Dict[int, List[Dict[str, Any]]] = {} # id(representative) -> its duplicates
+        self._duplicate_ids = set()
+        self._lock = threading.Lock()
+
+    def assign(self, joke_detail: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Returns the representative joke_detail is a near-duplicate of, or None if it starts a cluster."""
+        features = self.deduplicator.features(joke_detail["joke_text"])
+        with self._lock:
+            self._features[joke_detail["joke_text"]] = features
+            for representative_features, representative in self._representatives:
+                if self.deduplicator.similarity(features, representative_features) >= self.deduplicator.similarity_threshold:
+                    self._members.setdefault(id(representative), []).append(joke_detail)
+                    self._duplicate_ids.add(id(joke_detail))
+                    return representative
+            self._representatives.append((features, joke_detail))
+        return None
+
+    def is_duplicate(self, joke_detail: Dict[str, Any]) -> bool:
+        with self._lock:
+            return id(joke_detail) in self._duplicate_ids
+
+    def duplicates_of(self, representative: Dict[str, Any]) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._members.get(id(representative), []))
+
+    def features_of(self, joke_text: str) -> Any:
+        with self._lock:
+            features = self._features.get(joke_text)
+        return features if features is not None else self.deduplicator.features(joke_text)
+
+
+class CandidateDeduplicator:
+    """
+    Collapses near-duplicate candidate jokes before evaluation and picks a diverse top-k.
+    Two candidates are near-duplicates when the Jaccard similarity of their word 1..shingle_size
+    gram sets (cosine, with an embedder) reaches similarity_threshold; only the first of each
+    cluster pays for web search, novelty and judge calls. Final selection is maximal marginal
+    relevance: each pick maximizes diversity_lambda * combined_score / 10 minus
+    (1 - diversity_lambda) * its highest similarity to a joke already picked, so 1.0 is a
+    plain sort by score. Counters are cumulative.
+    """
+
+    def __init__(self,
+                 similarity_threshold: float = 0.6,
+                 shingle_size: int = 2,
+                 diversity_lambda: float = 0.7,
+                 embedder: Optional[Callable[[List[str]], Any]] = None):
+        if not 0 <= diversity_lambda <= 1:
+            raise ValueError("diversity_lambda must be in [0, 1]")
+        self.similarity_threshold = similarity_threshold
+        self.shingle_size = shingle_size
+        self.diversity_lambda = diversity_lambda
+        self.embedder = embedder
+        self._lock = threading.Lock()
+        self.stats = {"candidates_seen": 0, "duplicates_collapsed": 0, "web_searches_avoided": 0,
+                      "novelty_llm_calls_avoided": 0, "judge_evaluations_avoided": 0}
+
+    def features(self, joke_text: str) -> Any:
+        normalized = normalize_joke(joke_text)
+        if self.embedder is not None:
+            return self.embedder([normalized])[0]
+        return shingles(normalized, self.shingle_size)
+
+    def similarity(self, a: Any, b: Any) -> float:
+        if self.embedder is not None:
+            return float(a @ b)
+        union = a | b
+        return len(a & b) / len(union) if union else 1.0
+
+    def start_run(self) -> CandidateClusters:
+        return CandidateClusters(self)
+
+    def record(self, duplicate: bool, novelty_llm_call: bool) -> Dict[str, int]:
+        """Counts one candidate; for a collapsed duplicate, the evaluation calls it did not make."""
+        avoided = {"web_searches_avoided": int(duplicate), "judge_evaluations_avoided": int(duplicate),
+                   "novelty_llm_calls_avoided": int(duplicate and novelty_llm_call)}
+        with self._lock:
+            self.stats["candidates_seen"] += 1
+            self.stats["duplicates_collapsed"] += int(duplicate)
+            for key, value in avoided.items():
+                self.stats[key] += value
+        return avoided
+
+    def select_diverse(self, ranked: List[Dict[str, Any]], k: int, clusters: CandidateClusters) -> List[Dict[str, Any]]:
+        """Top k of ranked (best first) by maximal marginal relevance."""
+        features = [clusters.features_of(joke_detail["joke_text"]) for joke_detail in ranked]
+        remaining = list(range(len(ranked)))
+        selected: List[int] = []
+
+        def marginal(index: int) -> float:
+            redundancy = max((self.similarity(features[index], features[other]) for other in selected), default=0.0)
+            relevance = ranked[index].get("combined_score", 0) / 10
+            return self.diversity_lambda * relevance - (1 - self.diversity_lambda) * redundancy
+
+        while remaining and len(selected) < k:
+            best = max(remaining, key=marginal) # First (best-ranked) on ties
+            selected.append(best)
+            remaining.remove(best)
+        return [ranked[index] for index in selected]
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats)
@@ -0,0 +1,140 @@
+
+import itertools
+import math
+import re
+import threading
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+Combo = Tuple[str, ...]
+
+
+def iter_observation_combinations(observations: Sequence[str], max_subset_size: int = 2) -> Iterator[Combo]:
+    """
+    Lazily yields the subsets of 1..max_subset_size observations, interleaving sizes so
+    any bounded prefix already mixes singletons, pairs, triples and so on.
+    """
+    generators = [itertools.combinations(observations, size) for size in range(1, max_subset_size + 1)]
+    while generators:
+        for generator in list(generators):
+            combo = next(generator, None)
+            if combo is None:
+                generators.remove(generator)
+            else:
+                yield combo
+
+
+def _word_set(text: str) -> FrozenSet[str]:
+    return frozenset(re.sub(r"[^\w\s]", "", text.lower()).split())
+
+
+class CombinationScheduler:
+    """
+    Orders observation subsets for PLANSEARCH so a limited LLM budget goes to the
+    most promising combinations instead of the first few in itertools order.
+    schedule() yields subsets best-first, each scored against what was already scheduled:
+      coverage  - share of its observations no earlier subset has used
+      diversity - mean pairwise distance between its observations (0 for a singleton);
+                  word-set Jaccard by default, cosine when an embedder is given
+      reward    - UCB over the judge rewards of jokes built on its observations, fed
+                  back through record_reward (off unless bandit_weight > 0)
+    Only pool_size candidates are materialized at a time, so large max_subset_size
+    values never build the full combinatorial list.
+    """
+
+    def __init__(self,
+                 coverage_weight: float = 1.0,
+                 diversity_weight: float = 1.0,
+                 bandit_weight: float = 0.0,
+                 exploration: float = 0.5,
+                 pool_size: int = 256,
+                 embedder: Optional[Callable[[List[str]], "object"]] = None):
+        self.coverage_weight = coverage_weight
+        self.diversity_weight = diversity_weight
+        self.bandit_weight = bandit_weight
+        self.exploration = exploration
+        self.pool_size = max(1, pool_size)
+        self.embedder = embedder
+        self._rewards: Dict[str, List[float]] = {} # observation -> [reward sum, count]
+        self._total_rewards = 0
+        self._lock = threading.Lock()
+
+    def record_reward(self, combo: Iterable[str], reward: float) -> None:
+        """Feeds back a judge-derived reward in [0, 1] for a joke built on combo."""
+        with self._lock:
+            for observation in combo:
+                stats = self._rewards.setdefault(observation, [0.0, 0])
+                stats[0] += reward
+                stats[1] += 1
+            self._total_rewards += 1
+
+    def _bandit_score(self, combo: Combo) -> float:
+        with self._lock:
+            scores = []
+            for observation in combo:
+                total, count = self._rewards.get(observation, (0.0, 0))
+                if count == 0:
+                    scores.append(1.0 + self.exploration) # Optimistic for untried observations
+                else:
+                    scores.append(total / count + self.exploration * math.sqrt(math.log(self._total_rewards + 1) / count))
+            return sum(scores) / len(scores)
+
+    def _distance_fn(self, texts: List[str]) -> Callable[[str, str], float]:
+        if self.embedder is not None:
+            vectors = dict(zip(texts, self.embedder(texts)))
+            return lambda a, b: max(0.0, min(1.0, 1.0 - float(vectors[a] @ vectors[b])))
+        words = {text: _word_set(text) for text in texts}
+
+        def jaccard_distance(a: str, b: str) -> float:
+            union = words[a] | words[b]
+            return 1.0 - len(words[a] & words[b]) / len(union) if union else 0.0
+        return jaccard_distance
+
+    def _diversity(self, combo: Combo, distance: Callable[[str, str], float]) -> float:
+        pairs = list(itertools.combinations(combo, 2))
+        if not pairs:
+            return 0.0
+        return sum(distance(a, b) for a, b in pairs) / len(pairs)
+
+    def schedule(self,
+                 observations: Sequence[str],
+                 max_subset_size: int = 2,
+                 extra_combos: Iterable[Combo] = ()) -> Iterator[Combo]:
+        """
+        Yields subsets of observations (plus extra_combos, e.g. derived observation groups)
+        best-first. Each pick is made when the consumer asks for it, so rewards recorded
+        while earlier picks are in flight shape later ones.
+        """
+        extra_combos = [tuple(combo) for combo in extra_combos if combo]
+        texts = list(dict.fromkeys(list(observations) + [obs for combo in extra_combos for obs in combo]))
+        distance = self._distance_fn(texts) if texts else None
+        source = itertools.chain(extra_combos, iter_observation_combinations(observations, max_subset_size))
+        used: Dict[str, int] = {}
+        seen = set()
+        pool: List[Tuple[Combo, float]] = [] # (combo, static diversity score), in arrival order
+
+        def refill() -> None:
+            while len(pool) < self.pool_size:
+                combo = next(source, None)
+                if combo is None:
+                    return
+                key = frozenset(combo)
+                if key in seen:
+                    continue
+                seen.add(key)
+                pool.append((combo, self._diversity(combo, distance)))
+
+        refill()
+        while pool:
+            best_index, best_score = 0, -math.inf
+            for index, (combo, diversity) in enumerate(pool):
+                coverage = sum(1 for obs in combo if not used.get(obs)) / len(combo)
+                score = self.coverage_weight * coverage + self.diversity_weight * diversity
+                if self.bandit_weight:
+                    score += self.bandit_weight * self._bandit_score(combo)
+                if score > best_score: # Strict, so ties keep arrival order
+                    best_index, best_score = index, score
+            combo, _ = pool.pop(best_index)
+            for obs in combo:
+                used[obs] = used.get(obs, 0) + 1
+            yield combo
+            refill()
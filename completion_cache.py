@@ -0,0 +1,170 @@
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class CompletionCache:
+    """
+    Two-tier, content-addressed cache for chat completion responses.
+    Keys are a SHA-256 over the canonical JSON of the request payload, so any change
+    to model, messages, temperature, max_tokens or response_format is a different entry.
+    The memory tier is an LRU bounded by entry count; the optional SQLite tier persists
+    across restarts and is bounded by entry count (least recently used evicted first).
+    Both tiers honour the same TTL. Disk housekeeping is amortized: an approximate row
+    count is kept in memory, and expired rows are purged and the table trimmed only once
+    that count passes max_disk_entries (down to 90% of it) or every purge_interval stores.
+    """
+
+    def __init__(self,
+                 db_path: Optional[str] = None,
+                 max_memory_entries: int = 1024,
+                 max_disk_entries: int = 100_000,
+                 ttl_seconds: float = 7 * 24 * 3600,
+                 purge_interval: int = 1000):
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+        self.purge_interval = purge_interval
+        self._disk_entries = 0 # Upper bound: replaced keys are counted as new rows until the next purge
+        self._stores_since_purge = 0
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0,
+                      "memory_evictions": 0, "disk_evictions": 0, "expired": 0}
+        self._conn: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_last_access ON completions(last_access)")
+            self._conn.commit()
+            self._disk_entries = self._count_rows()
+            # A SQLite connection must not be used across fork(); a pre-forked worker opens its own.
+            reopen = weakref.WeakMethod(self._reopen_after_fork)
+            os.register_at_fork(after_in_child=lambda: reopen() and reopen()())
+
+    def _reopen_after_fork(self) -> None:
+        self._lock = threading.Lock()
+        if self._conn is not None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._disk_entries = self._count_rows()
+
+    def _count_rows(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    @staticmethod
+    def make_key(payload: Dict[str, Any]) -> str:
+        canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def _remember(self, key: str, created_at: float, value: Dict[str, Any]) -> None:
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.stats["memory_evictions"] += 1
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.stats["hits"] += 1
+                    self.stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+                self.stats["expired"] += 1
+
+            if self._conn is not None:
+                row = self._conn.execute("SELECT response, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    response, created_at = row
+                    if not self._expired(created_at, now):
+                        self._conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, key))
+                        self._conn.commit()
+                        value = json.loads(response)
+                        self._remember(key, created_at, value)
+                        self.stats["hits"] += 1
+                        self.stats["disk_hits"] += 1
+                        return value
+                    self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                    self._conn.commit()
+                    self._disk_entries -= 1
+                    self.stats["expired"] += 1
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            self.stats["stores"] += 1
+            if self._conn is None:
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, response, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            self._disk_entries += 1
+            self._stores_since_purge += 1
+            if self._disk_entries > self.max_disk_entries or self._stores_since_purge >= self.purge_interval:
+                self._purge(now)
+            self._conn.commit()
+
+    def _purge(self, now: float) -> None:
+        """Drops expired rows, then the least recently used ones down to 90% of max_disk_entries."""
+        if self.ttl_seconds is not None:
+            cursor = self._conn.execute("DELETE FROM completions WHERE created_at < ?", (now - self.ttl_seconds,))
+            self.stats["expired"] += cursor.rowcount
+        count = self._count_rows()
+        overflow = count - self.max_disk_entries
+        if overflow > 0:
+            overflow += self.max_disk_entries // 10 # Headroom, so a full table is not trimmed on every store
+            cursor = self._conn.execute(
+                "DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+            self.stats["disk_evictions"] += cursor.rowcount
+            count -= cursor.rowcount
+        self._disk_entries = count
+        self._stores_since_purge = 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM completions")
+                self._conn.commit()
+                self._disk_entries = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+            if self._conn is not None:
+                stats["disk_entries"] = self._count_rows()
+            return stats
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
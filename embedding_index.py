@@ -0,0 +1,259 @@
+
+import hashlib
+import json
+import os
+import re
+from typing import Callable, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from.joke_corpus_index import iter_joke_corpus, corpus_fingerprint
+
+DEFAULT_EMBEDDING_MODEL = "hashing"
+
+
+class HashingEmbedder:
+    """
+    CPU-only, dependency-free embedder: signed feature hashing of word unigrams and
+    bigrams into `dim` buckets, L2-normalized. Catches reworded jokes that keep most
+    of their vocabulary; use a sentence-transformers model for paraphrase-level recall.
+    """
+
+    def __init__(self, dim: int = 512, preprocess: Optional[Callable[[str], str]] = None):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+        self.preprocess = preprocess or (lambda text: re.sub(r"[^\w\s]", "", text.lower()))
+
+    def _features(self, text: str) -> List[str]:
+        tokens = self.preprocess(text).split()
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def __call__(self, texts: List[str]) -> "np.ndarray":
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                matrix[row, digest % self.dim] += 1.0 if (digest >> 63) else -1.0
+        return normalize_rows(matrix)
+
+
+class SentenceTransformerEmbedder:
+    """Wraps a local sentence-transformers model, pinned to CPU."""
+
+    def __init__(self, model_name: str):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError(f"Embedding model '{model_name}' requires sentence-transformers. Run 'pip install sentence-transformers'")
+        self.name = model_name
+        self.model = SentenceTransformer(model_name, device="cpu")
+
+    def __call__(self, texts: List[str]) -> "np.ndarray":
+        return np.asarray(self.model.encode(texts, batch_size=64, normalize_embeddings=True), dtype=np.float32)
+
+
+def get_embedder(embedding_model_name: Optional[str] = None,
+                 preprocess: Optional[Callable[[str], str]] = None) -> Callable[[List[str]], "np.ndarray"]:
+    if not embedding_model_name or embedding_model_name == DEFAULT_EMBEDDING_MODEL:
+        return HashingEmbedder(preprocess=preprocess)
+    return SentenceTransformerEmbedder(embedding_model_name)
+
+
+def normalize_rows(matrix: "np.ndarray") -> "np.ndarray":
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _merge_top_k(best_scores: "np.ndarray", best_ids: "np.ndarray",
+                 scores: "np.ndarray", ids: "np.ndarray", k: int) -> Tuple["np.ndarray", "np.ndarray"]:
+    all_scores = np.concatenate([best_scores, scores], axis=1)
+    all_ids = np.concatenate([best_ids, ids], axis=1)
+    if all_scores.shape[1] > k:
+        keep = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+        all_scores = np.take_along_axis(all_scores, keep, axis=1)
+        all_ids = np.take_along_axis(all_ids, keep, axis=1)
+    return all_scores, all_ids
+
+
+class EmbeddingCorpusIndex:
+    """
+    Precomputed, L2-normalized corpus embeddings stored as a float16 or int8 .npy matrix
+    and memory-mapped on load. Queries are scored as one batched matrix product per
+    corpus chunk with a running top-k, never pair by pair. An optional IVF layer
+    (k-means coarse quantizer) restricts scoring to the `nprobe` closest clusters for
+    corpora too large for brute force.
+    """
+
+    META_FILE = "meta.json"
+    INT8_SCALE = 127.0
+
+    def __init__(self, matrix: "np.ndarray", embedder_name: str, dtype: str,
+                 ivf_centroids: Optional["np.ndarray"] = None,
+                 ivf_order: Optional["np.ndarray"] = None,
+                 ivf_offsets: Optional["np.ndarray"] = None):
+        self.matrix = matrix
+        self.embedder_name = embedder_name
+        self.dtype = dtype
+        self.ivf_centroids = ivf_centroids
+        self.ivf_order = ivf_order
+        self.ivf_offsets = ivf_offsets
+
+    @property
+    def has_ann(self) -> bool:
+        return self.ivf_centroids is not None
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @classmethod
+    def _encode(cls, embeddings: "np.ndarray", dtype: str) -> "np.ndarray":
+        if dtype == "int8":
+            return np.clip(np.rint(embeddings * cls.INT8_SCALE), -127, 127).astype(np.int8)
+        return embeddings.astype(np.float16)
+
+    def _decode(self, block: "np.ndarray") -> "np.ndarray":
+        block = block.astype(np.float32)
+        return block / self.INT8_SCALE if self.dtype == "int8" else block
+
+    @classmethod
+    def build(cls, texts: Iterable[str], embedder: Callable[[List[str]], "np.ndarray"], index_dir: str,
+              num_texts: int, dtype: str = "float16", batch_size: int = 1024,
+              source_fingerprint: Optional[str] = None) -> None:
+        """Embeds texts batch by batch straight into an on-disk .npy matrix."""
+        if np is None:
+            raise ImportError("EmbeddingCorpusIndex requires numpy. Run 'pip install numpy'")
+        os.makedirs(index_dir, exist_ok=True)
+        matrix = None
+        row = 0
+        batch: List[str] = []
+
+        def flush():
+            nonlocal matrix, row
+            embeddings = embedder(batch)
+            if matrix is None:
+                matrix = np.lib.format.open_memmap(os.path.join(index_dir, "embeddings.npy"), mode="w+",
+                                                   dtype=np.int8 if dtype == "int8" else np.float16,
+                                                   shape=(num_texts, embeddings.shape[1]))
+            matrix[row:row + len(batch)] = cls._encode(embeddings, dtype)
+            row += len(batch)
+            batch.clear()
+
+        for text in texts:
+            batch.append(text)
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        if matrix is not None:
+            matrix.flush()
+        with open(os.path.join(index_dir, cls.META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"embedder": getattr(embedder, "name", "custom"), "dtype": dtype, "rows": row,
+                       "source_fingerprint": source_fingerprint}, f)
+
+    def build_ann(self, index_dir: str, num_lists: Optional[int] = None, iterations: int = 8,
+                  sample_size: int = 50_000, seed: int = 0) -> None:
+        """Trains the IVF coarse quantizer on a sample and persists the inverted lists."""
+        num_rows = len(self)
+        num_lists = num_lists or max(1, int(np.sqrt(num_rows)))
+        rng = np.random.default_rng(seed)
+        sample_ids = np.sort(rng.choice(num_rows, size=min(sample_size, num_rows), replace=False))
+        sample = self._decode(self.matrix[sample_ids])
+        centroids = sample[rng.choice(len(sample), size=min(num_lists, len(sample)), replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(len(centroids)):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = normalize_rows(centroids)
+
+        assignment = np.empty(num_rows, dtype=np.int32)
+        for start in range(0, num_rows, 65536):
+            block = self._decode(self.matrix[start:start + 65536])
+            assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable").astype(np.uint32)
+        offsets = np.searchsorted(assignment[order], np.arange(len(centroids) + 1)).astype(np.int64)
+
+        np.save(os.path.join(index_dir, "ivf_centroids.npy"), centroids.astype(np.float32))
+        np.save(os.path.join(index_dir, "ivf_order.npy"), order)
+        np.save(os.path.join(index_dir, "ivf_offsets.npy"), offsets)
+        self.ivf_centroids, self.ivf_order, self.ivf_offsets = centroids.astype(np.float32), order, offsets
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True) -> "EmbeddingCorpusIndex":
+        if np is None:
+            raise ImportError("EmbeddingCorpusIndex requires numpy. Run 'pip install numpy'")
+        with open(os.path.join(index_dir, cls.META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        mmap_mode = "r" if mmap else None
+        matrix = np.load(os.path.join(index_dir, "embeddings.npy"), mmap_mode=mmap_mode)
+        ivf = [None, None, None]
+        if os.path.exists(os.path.join(index_dir, "ivf_centroids.npy")):
+            ivf = [np.load(os.path.join(index_dir, f"ivf_{name}.npy"), mmap_mode=mmap_mode if name != "centroids" else None)
+                   for name in ("centroids", "order", "offsets")]
+        return cls(matrix, meta["embedder"], meta["dtype"], *ivf)
+
+    @classmethod
+    def load_or_build(cls, corpus_path: str, embedder: Callable[[List[str]], "np.ndarray"],
+                      dtype: str = "float16", index_dir: Optional[str] = None,
+                      ann: bool = False, mmap: bool = True) -> "EmbeddingCorpusIndex":
+        """Loads the persisted embeddings for corpus_path, re-embedding only if the corpus or embedder changed."""
+        embedder_name = getattr(embedder, "name", "custom")
+        slug = re.sub(r"[^\w.-]", "_", embedder_name)
+        index_dir = index_dir or f"{corpus_path}.emb-{slug}-{dtype}.idx"
+        fingerprint = corpus_fingerprint(corpus_path)
+        meta_path = os.path.join(index_dir, cls.META_FILE)
+        fresh = False
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            fresh = meta.get("source_fingerprint") == fingerprint and meta.get("embedder") == embedder_name
+        if not fresh:
+            print(f"Embedding joke corpus {corpus_path} with {embedder_name} ...")
+            for name in ("ivf_centroids.npy", "ivf_order.npy", "ivf_offsets.npy"):
+                if os.path.exists(os.path.join(index_dir, name)):
+                    os.remove(os.path.join(index_dir, name))
+            num_texts = sum(1 for _ in iter_joke_corpus(corpus_path))
+            cls.build(iter_joke_corpus(corpus_path), embedder, index_dir, num_texts, dtype, source_fingerprint=fingerprint)
+        index = cls.load(index_dir, mmap=mmap)
+        if ann and not index.has_ann and len(index):
+            index.build_ann(index_dir)
+        return index
+
+    def top_k(self, queries: "np.ndarray", k: int = 1, chunk_rows: int = 65536) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Exact cosine top-k for a (Q, D) batch of normalized query embeddings."""
+        num_queries = queries.shape[0]
+        best_scores = np.full((num_queries, 0), -np.inf, dtype=np.float32)
+        best_ids = np.zeros((num_queries, 0), dtype=np.int64)
+        queries_t = np.ascontiguousarray(queries.astype(np.float32).T)
+        for start in range(0, len(self), chunk_rows):
+            scores = (self._decode(self.matrix[start:start + chunk_rows]) @ queries_t).T
+            ids = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+            best_scores, best_ids = _merge_top_k(best_scores, best_ids, scores, ids, k)
+        return _sorted_top_k(best_scores, best_ids)
+
+    def top_k_ann(self, queries: "np.ndarray", k: int = 1, nprobe: int = 8) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Approximate top-k: scores only rows in each query's `nprobe` nearest IVF lists."""
+        queries = queries.astype(np.float32)
+        probes = np.argsort(-(queries @ self.ivf_centroids.T), axis=1)[:, :nprobe]
+        out_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        out_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for q, lists in enumerate(probes):
+            rows = np.concatenate([self.ivf_order[self.ivf_offsets[c]:self.ivf_offsets[c + 1]] for c in lists])
+            if not len(rows):
+                continue
+            rows = np.sort(rows) # Sequential reads from the memory map
+            scores = self._decode(self.matrix[rows]) @ queries[q]
+            keep = np.argsort(-scores)[:k]
+            out_scores[q, :len(keep)] = scores[keep]
+            out_ids[q, :len(keep)] = rows[keep]
+        return out_scores, out_ids
+
+
+def _sorted_top_k(scores: "np.ndarray", ids: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+    order = np.argsort(-scores, axis=1)
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
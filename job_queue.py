@@ -0,0 +1,359 @@
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from.progress_events import ProgressCallback, RunCancelled
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATES = {JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED}
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobStore:
+    """
+    Persists job state. Records hold only JSON-serializable, non-secret fields:
+    request parameters that carry credentials stay in the JobQueue's memory.
+    """
+
+    def create(self, job: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def mark_interrupted(self) -> int:
+        """Fails jobs left queued/running by processes that are gone. Returns how many."""
+        return 0
+
+
+def _boot_id() -> str:
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class InMemoryJobStore(JobStore):
+    def __init__(self, max_finished_jobs: int = 1000):
+        self.max_finished_jobs = max_finished_jobs
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, job: Dict[str, Any]) -> None:
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            if fields.get("status") in FINISHED_STATES:
+                self._jobs.move_to_end(job_id)
+                finished = [key for key, value in self._jobs.items() if value["status"] in FINISHED_STATES]
+                for key in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+                    del self._jobs[key]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Job state in SQLite, so status and results survive restarts. Several server processes
+    may share one database: each job records the host, pid and boot id of the process that
+    runs it, and mark_interrupted only fails jobs whose process is no longer running.
+    """
+
+    JSON_FIELDS = ("params", "result", "progress")
+    PROCESS_COLUMNS = {"host": "TEXT", "pid": "INTEGER", "boot_id": "TEXT"}
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, owner TEXT, status TEXT NOT NULL, params TEXT, result TEXT, progress TEXT, "
+            "error TEXT, created_at REAL, started_at REAL, finished_at REAL, host TEXT, pid INTEGER, boot_id TEXT)"
+        )
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, column_type in self.PROCESS_COLUMNS.items():
+            if column not in existing: # Databases created before jobs recorded their process
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        self._conn.commit()
+        self._host = socket.gethostname()
+        self._boot_id = _boot_id()
+        self._lock = threading.Lock()
+        # A SQLite connection must not be used across fork(); a pre-forked worker opens its own.
+        reopen = weakref.WeakMethod(self._reopen_after_fork)
+        os.register_at_fork(after_in_child=lambda: reopen() and reopen()())
+
+    def _reopen_after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+
+    def _encode(self, fields: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: json.dumps(value, default=str) if key in self.JSON_FIELDS and value is not None else value
+                for key, value in fields.items()}
+
+    def create(self, job: Dict[str, Any]) -> None:
+        # Jobs run in the process that queued them, so that process owns the job.
+        row = dict(self._encode(job), host=self._host, pid=os.getpid(), boot_id=self._boot_id)
+        columns = ", ".join(row.keys())
+        placeholders = ", ".join("?" for _ in row)
+        with self._lock:
+            self._conn.execute(f"INSERT INTO jobs ({columns}) VALUES ({placeholders})", list(row.values()))
+            self._conn.commit()
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        row = self._encode(fields)
+        assignments = ", ".join(f"{column} = ?" for column in row)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", list(row.values()) + [job_id])
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            job = dict(zip([description[0] for description in cursor.description], row))
+        for key in self.JSON_FIELDS:
+            if job.get(key) is not None:
+                job[key] = json.loads(job[key])
+        return job
+
+    def _process_gone(self, host: Optional[str], pid: Optional[int], boot_id: Optional[str]) -> bool:
+        if pid is None:
+            return True # Recorded before jobs had an owning process
+        if host != self._host:
+            return False # Another machine's process; it recovers its own jobs
+        if boot_id != self._boot_id:
+            return True
+        return pid == os.getpid() or not _pid_alive(pid)
+
+    def mark_interrupted(self) -> int:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, host, pid, boot_id FROM jobs WHERE status IN (?, ?)", (JOB_QUEUED, JOB_RUNNING)
+            ).fetchall()
+            stale = [job_id for job_id, host, pid, boot_id in rows if self._process_gone(host, pid, boot_id)]
+            if not stale:
+                return 0
+            placeholders = ", ".join("?" for _ in stale)
+            cursor = self._conn.execute(
+                f"UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status IN (?, ?) AND id IN ({placeholders})",
+                [JOB_FAILED, "Interrupted by a server restart", time.time(), JOB_QUEUED, JOB_RUNNING] + stale
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+
+# run_job(params, progress_callback) -> JSON-serializable result
+JobRunner = Callable[[Dict[str, Any], ProgressCallback], Any]
+
+
+class JobQueue:
+    """
+    Bounded worker pool for pipeline runs.
+    Jobs wait in one FIFO per owner (e.g. per API key) and workers serve the owners
+    round-robin, so one heavy user cannot starve the others. Submissions beyond
+    max_queue_depth (or max_queued_per_owner for one owner) raise QueueFullError.
+    Cancelling a queued job drops it; cancelling a running job makes its next
+    progress event raise RunCancelled inside the pipeline. A job's listener, if given,
+    sees every progress event of the run and then ("job_finished", final job record).
+    Worker threads start with the first submission in each process, so a queue
+    created before a pre-forking server forks its workers still runs jobs in them.
+    """
+
+    def __init__(self,
+                 run_job: JobRunner,
+                 store: Optional[JobStore] = None,
+                 num_workers: int = 4,
+                 max_queue_depth: int = 64,
+                 max_queued_per_owner: int = 8):
+        self.run_job = run_job
+        self.store = store or InMemoryJobStore()
+        self.num_workers = num_workers
+        self.max_queue_depth = max_queue_depth
+        self.max_queued_per_owner = max_queued_per_owner
+        self._queues: "OrderedDict[str, Deque[str]]" = OrderedDict()
+        self._params: Dict[str, Dict[str, Any]] = {}
+        self._cancel_events: Dict[str, threading.Event] = {}
+        self._listeners: Dict[str, ProgressCallback] = {}
+        self._queued = 0
+        self._condition = threading.Condition()
+        self._shutdown = False
+        interrupted = self.store.mark_interrupted()
+        if interrupted:
+            print(f"Marked {interrupted} job(s) from a previous run as interrupted.")
+        self._workers: List[threading.Thread] = []
+        self._workers_pid: Optional[int] = None
+
+    def _ensure_workers(self) -> None:
+        # Called with self._condition held. Threads do not survive fork(), so a child starts its own.
+        if self._workers_pid == os.getpid():
+            return
+        self._workers = [
+            threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True) for i in range(self.num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._workers_pid = os.getpid()
+
+    def submit(self, owner: str, params: Dict[str, Any], public_params: Optional[Dict[str, Any]] = None,
+               listener: Optional[ProgressCallback] = None) -> str:
+        """
+        Queues a job and returns its id. `params` go to run_job and are never persisted;
+        `public_params` (no secrets) are stored with the job record.
+        """
+        job_id = uuid.uuid4().hex
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("Job queue is shut down")
+            self._ensure_workers()
+            if self._queued >= self.max_queue_depth:
+                raise QueueFullError(f"Job queue is full ({self.max_queue_depth} jobs waiting)")
+            owner_queue = self._queues.get(owner)
+            if owner_queue is not None and len(owner_queue) >= self.max_queued_per_owner:
+                raise QueueFullError(f"Too many queued jobs for this key ({self.max_queued_per_owner} waiting)")
+            self.store.create({
+                "id": job_id, "owner": owner, "status": JOB_QUEUED, "params": public_params or {},
+                "result": None, "progress": None, "error": None,
+                "created_at": time.time(), "started_at": None, "finished_at": None
+            })
+            self._params[job_id] = params
+            self._cancel_events[job_id] = threading.Event()
+            if listener is not None:
+                self._listeners[job_id] = listener
+            self._queues.setdefault(owner, deque()).append(job_id)
+            self._queued += 1
+            self._condition.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Returns False if the job is unknown or already finished."""
+        with self._condition:
+            for owner, owner_queue in self._queues.items():
+                if job_id in owner_queue:
+                    owner_queue.remove(job_id)
+                    if not owner_queue:
+                        del self._queues[owner]
+                    self._queued -= 1
+                    self._params.pop(job_id, None)
+                    self._cancel_events.pop(job_id, None)
+                    self.store.update(job_id, status=JOB_CANCELLED, finished_at=time.time())
+                    self._notify_finished(job_id, self._listeners.pop(job_id, None))
+                    return True
+            cancel_event = self._cancel_events.get(job_id)
+        if cancel_event is None:
+            return False
+        cancel_event.set()
+        return True
+
+    def _notify_finished(self, job_id: str, listener: Optional[ProgressCallback]) -> None:
+        if listener is None:
+            return
+        try:
+            listener("job_finished", self.store.get(job_id))
+        except Exception as e:
+            print(f"Job listener failed for job '{job_id}': {e}")
+
+    def queue_depth(self) -> int:
+        with self._condition:
+            return self._queued
+
+    def _next_job(self) -> Optional[str]:
+        with self._condition:
+            while not self._queues and not self._shutdown:
+                self._condition.wait()
+            if self._shutdown:
+                return None
+            owner, owner_queue = next(iter(self._queues.items()))
+            job_id = owner_queue.popleft()
+            del self._queues[owner]
+            if owner_queue:
+                self._queues[owner] = owner_queue # Back of the rotation
+            self._queued -= 1
+            return job_id
+
+    def _worker_loop(self) -> None:
+        while True:
+            job_id = self._next_job()
+            if job_id is None:
+                return
+            params = self._params.pop(job_id)
+            with self._condition:
+                cancel_event = self._cancel_events[job_id]
+                listener = self._listeners.get(job_id)
+            self.store.update(job_id, status=JOB_RUNNING, started_at=time.time())
+
+            def progress(event_type: str, data: Dict[str, Any]) -> None:
+                if cancel_event.is_set():
+                    raise RunCancelled()
+                if event_type == "top_k":
+                    self.store.update(job_id, progress=data)
+                if listener is not None:
+                    listener(event_type, data)
+
+            try:
+                result = self.run_job(params, progress)
+                if cancel_event.is_set():
+                    raise RunCancelled()
+                self.store.update(job_id, status=JOB_SUCCEEDED, result=result, finished_at=time.time())
+            except RunCancelled:
+                self.store.update(job_id, status=JOB_CANCELLED, finished_at=time.time())
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                self.store.update(job_id, status=JOB_FAILED, error=str(e), finished_at=time.time())
+            finally:
+                with self._condition:
+                    self._cancel_events.pop(job_id, None)
+                    self._listeners.pop(job_id, None)
+                self._notify_finished(job_id, listener)
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
@@ -0,0 +1,149 @@
+
+import csv
+import hashlib
+import json
+import os
+from array import array
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def iter_joke_corpus(corpus_path: str) -> Iterator[str]:
+    """
+    Streams jokes from a corpus file without holding it in memory.
+    Supports .txt (one joke per line), .jsonl / .json (strings or objects with a
+    "joke" or "text" field) and .csv (a "joke" or "text" column).
+    """
+    extension = os.path.splitext(corpus_path)[1].lower()
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        if extension == ".csv":
+            for row in csv.DictReader(f):
+                text = row.get("joke") or row.get("text")
+                if text:
+                    yield text
+        elif extension in (".jsonl", ".json"):
+            records: Iterable = json.load(f) if extension == ".json" else (json.loads(line) for line in f if line.strip())
+            for record in records:
+                text = record if isinstance(record, str) else (record.get("joke") or record.get("text"))
+                if text:
+                    yield text
+        else:
+            for line in f:
+                if line.strip():
+                    yield line.strip()
+
+
+def corpus_fingerprint(corpus_path: str) -> str:
+    """Identifies a corpus file version; persisted indexes are rebuilt when it changes."""
+    stat = os.stat(corpus_path)
+    return f"{os.path.abspath(corpus_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def hash_shingles(tokens: List[str], n: int) -> List[int]:
+    """64-bit hashes of the distinct word n-grams in tokens."""
+    if len(tokens) < n:
+        return []
+    grams = {" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)}
+    return [int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "little") for gram in grams]
+
+
+class NGramCorpusIndex:
+    """
+    Hashed-shingle inverted index over a joke corpus.
+    Postings are stored as two parallel arrays sorted by shingle hash (uint64 hashes,
+    uint32 joke ids), so a lookup is a binary search per candidate shingle and the
+    arrays can be memory-mapped straight from disk.
+    """
+
+    META_FILE = "meta.json"
+
+    def __init__(self, hashes: "np.ndarray", doc_ids: "np.ndarray", n: int, num_docs: int,
+                 preprocess: Optional[Callable[[str], str]] = None):
+        self.hashes = hashes
+        self.doc_ids = doc_ids
+        self.n = n
+        self.num_docs = num_docs
+        self.preprocess = preprocess or (lambda text: text)
+
+    def _shingles(self, text: str) -> List[int]:
+        return hash_shingles(self.preprocess(text).split(), self.n)
+
+    @classmethod
+    def build(cls, texts: Iterable[str], n: int = 7, preprocess: Optional[Callable[[str], str]] = None) -> "NGramCorpusIndex":
+        if np is None:
+            raise ImportError("NGramCorpusIndex requires numpy. Run 'pip install numpy'")
+        preprocess = preprocess or (lambda text: text)
+        hashes = array("Q")
+        doc_ids = array("I")
+        num_docs = 0
+        for doc_id, text in enumerate(texts):
+            doc_hashes = hash_shingles(preprocess(text).split(), n)
+            hashes.extend(doc_hashes)
+            doc_ids.extend([doc_id] * len(doc_hashes))
+            num_docs = doc_id + 1
+
+        hashes_np = np.frombuffer(hashes, dtype=np.uint64)
+        doc_ids_np = np.frombuffer(doc_ids, dtype=np.uint32)
+        order = np.argsort(hashes_np, kind="stable")
+        return cls(hashes_np[order], doc_ids_np[order], n, num_docs, preprocess)
+
+    def save(self, index_dir: str, source_fingerprint: Optional[str] = None) -> None:
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(os.path.join(index_dir, "hashes.npy"), self.hashes)
+        np.save(os.path.join(index_dir, "doc_ids.npy"), self.doc_ids)
+        with open(os.path.join(index_dir, self.META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"n": self.n, "num_docs": self.num_docs, "source_fingerprint": source_fingerprint}, f)
+
+    @classmethod
+    def load(cls, index_dir: str, preprocess: Optional[Callable[[str], str]] = None, mmap: bool = True) -> "NGramCorpusIndex":
+        if np is None:
+            raise ImportError("NGramCorpusIndex requires numpy. Run 'pip install numpy'")
+        with open(os.path.join(index_dir, cls.META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        mmap_mode = "r" if mmap else None
+        hashes = np.load(os.path.join(index_dir, "hashes.npy"), mmap_mode=mmap_mode)
+        doc_ids = np.load(os.path.join(index_dir, "doc_ids.npy"), mmap_mode=mmap_mode)
+        return cls(hashes, doc_ids, meta["n"], meta["num_docs"], preprocess)
+
+    @classmethod
+    def load_or_build(cls, corpus_path: str, n: int = 7, preprocess: Optional[Callable[[str], str]] = None,
+                      index_dir: Optional[str] = None, mmap: bool = True) -> "NGramCorpusIndex":
+        """Loads the persisted index for corpus_path, rebuilding it only if the corpus changed."""
+        index_dir = index_dir or f"{corpus_path}.ngram{n}.idx"
+        fingerprint = corpus_fingerprint(corpus_path)
+        meta_path = os.path.join(index_dir, cls.META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("source_fingerprint") == fingerprint and meta.get("n") == n:
+                return cls.load(index_dir, preprocess, mmap=mmap)
+
+        print(f"Building {n}-gram index for joke corpus {corpus_path} ...")
+        index = cls.build(iter_joke_corpus(corpus_path), n, preprocess)
+        index.save(index_dir, fingerprint)
+        return cls.load(index_dir, preprocess, mmap=mmap)
+
+    def query(self, text: str) -> Tuple[float, Optional[int]]:
+        """
+        Returns (overlap, joke_id): the largest fraction of the text's n-grams that
+        appear in a single corpus joke, and that joke's id (None if no overlap).
+        """
+        shingles = self._shingles(text)
+        if not shingles or len(self.hashes) == 0:
+            return 0.0, None
+        query = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+        starts = np.searchsorted(self.hashes, query, side="left")
+        ends = np.searchsorted(self.hashes, query, side="right")
+        matched = [self.doc_ids[start:end] for start, end in zip(starts, ends) if end > start]
+        if not matched:
+            return 0.0, None
+        ids, counts = np.unique(np.concatenate(matched), return_counts=True)
+        best = int(np.argmax(counts))
+        return float(counts[best]) / len(shingles), int(ids[best])
+
+    def size_bytes(self) -> int:
+        return int(self.hashes.nbytes + self.doc_ids.nbytes)
@@ -1,25 +1,337 @@
 
-from typing import List, Dict, Any, Optional
+import bisect
+import contextvars
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Callable, Set, Tuple
 from.openrouter_client import OpenRouterClient
+from.completion_cache import CompletionCache
 from.plansearch_for_jokes import PlanSearcherForJokes 
 from.llm_judge import LLMJudge 
 from.novelty_checker import NoveltyChecker 
+from.progress_events import ProgressCallback, RunCancelled, emit_progress
+from.run_trace import RunTrace, RunTraceStore, set_current_trace, reset_current_trace
+from.call_budget import CallBudget
+from.combination_scheduler import CombinationScheduler
+from.plan_pruner import PlanPruner
+from.metrics import summarize_usage
+from.run_controller import RunController, set_current_controller, reset_current_controller
+from.model_router import ModelRouter
+from.topic_memo import TopicMemoStore
+from.web_search import WebSearchService
+from.candidate_dedup import CandidateClusters, CandidateDeduplicator
+from.judge_ensemble import JudgeEnsemble
+from.trace_archive import TraceArchive
+
+class _CandidateEvaluation:
+    def __init__(self, joke_detail: Dict[str, Any], expected_parts: Set[str]):
+        self.joke_detail = joke_detail
+        self.expected_parts = expected_parts
+        self.parts: Dict[str, Any] = {}
+
+
+class _StreamingEvaluator:
+    """
+    Evaluates candidates while PLANSEARCH is still producing them.
+    Each candidate's web lookup and LLM novelty call start the moment it arrives; judge
+    calls (and the local corpus similarity) run in micro-batches of judge_batch_size.
+    A candidate is scored and inserted into the running ranking as soon as its last
+    check finishes, so wall-clock time tracks the longest chain rather than the sum.
+    With fused_evaluation the judge also rates perceived novelty in the same structured
+    response, replacing the separate per-candidate novelty LLM call. With clusters, a
+    near-duplicate of an earlier candidate is not evaluated at all.
+    """
+
+    def __init__(self, manager: "JokePipelineManager", executor: ThreadPoolExecutor,
+                 judge_model: str, novelty_llm_model: Optional[str], judge_batch_size: int,
+                 num_top_jokes: int = 3, progress_callback: Optional[ProgressCallback] = None,
+                 combination_scheduler: Optional[CombinationScheduler] = None,
+                 controller: Optional[RunController] = None,
+                 fused_evaluation: bool = False,
+                 clusters: Optional[CandidateClusters] = None):
+        self.manager = manager
+        self.clusters = clusters
+        self.evaluations_avoided: Dict[str, int] = {}
+        self.combination_scheduler = combination_scheduler
+        self.controller = controller
+        self.num_top_jokes = num_top_jokes
+        self.progress_callback = progress_callback
+        self.executor = executor
+        self.judge_model = judge_model
+        self.novelty_llm_model = None if fused_evaluation else novelty_llm_model
+        self.fused_evaluation = fused_evaluation
+        self.judge_batch_size = max(1, judge_batch_size)
+        self.ranked_jokes: List[Dict[str, Any]] = [] # Best first, updated as candidates finish
+        self._ranking_keys: List[Tuple[float, int]] = []
+        self._pending_judge: List[_CandidateEvaluation] = []
+        self._outstanding = 0
+        self._finished = 0
+        self._cancelled = False
+        self.stopped_reason: Optional[str] = None # Set once the controller's deadline or caps end evaluation
+        self._condition = threading.Condition()
+
+    def _emit(self, event_type: str, data: Dict[str, Any]) -> None:
+        try:
+            emit_progress(self.progress_callback, event_type, data)
+        except RunCancelled:
+            with self._condition:
+                self._cancelled = True
+                self._condition.notify_all()
+
+    def submit(self, joke_detail: Dict[str, Any]) -> None:
+        if self.clusters is not None:
+            representative = self.clusters.assign(joke_detail)
+            avoided = self.manager.candidate_deduplicator.record(representative is not None, bool(self.novelty_llm_model))
+            if representative is not None:
+                with self._condition:
+                    for key, value in avoided.items():
+                        self.evaluations_avoided[key] = self.evaluations_avoided.get(key, 0) + value
+                self._emit("near_duplicate", {
+                    "joke_text": joke_detail["joke_text"], "representative": representative["joke_text"]
+                })
+                return
+        expected_parts = {"evaluation", "semantic_similarity_corpus_score", "web_found_penalty_score"}
+        if self.novelty_llm_model or self.fused_evaluation:
+            expected_parts.add("perceived_novelty_llm_score")
+        evaluation = _CandidateEvaluation(joke_detail, expected_parts)
+        joke_text = joke_detail["joke_text"]
+        checker = self.manager.novelty_checker
+
+        with self._condition:
+            if self._cancelled:
+                raise RunCancelled()
+            self._outstanding += 1
+            self._pending_judge.append(evaluation)
+            batch = None
+            if len(self._pending_judge) >= self.judge_batch_size:
+                batch, self._pending_judge = self._pending_judge, []
+
+        self._submit(self._run_part, evaluation, "web_found_penalty_score", None,
+                     checker.check_web_cross_reference, joke_text)
+        if self.novelty_llm_model:
+            self._submit(self._run_part, evaluation, "perceived_novelty_llm_score", 0.5,
+                         checker.assess_perceived_novelty_with_llm, joke_text, self.novelty_llm_model)
+        if batch:
+            self._submit(self._judge_batch, batch)
+
+    def _submit(self, fn: Callable[..., Any], *args: Any) -> None:
+        # Tasks run in a copy of the caller's context so their records land in this run's trace.
+        self.executor.submit(contextvars.copy_context().run, self._run_task, fn, *args)
+
+    def _run_task(self, fn: Callable[..., Any], *args: Any) -> None:
+        reason = self.controller.evaluation_stop_reason() if self.controller is not None else None
+        if reason is not None:
+            # Checked before every judge batch and novelty call: the run returns its best-so-far ranking.
+            with self._condition:
+                self.stopped_reason = self.stopped_reason or reason
+                self._condition.notify_all()
+            return
+        fn(*args)
+
+    def flush(self) -> None:
+        with self._condition:
+            batch, self._pending_judge = self._pending_judge, []
+        if batch:
+            self._submit(self._judge_batch, batch)
+
+    def wait(self) -> bool:
+        """Waits for every submitted candidate; False if the controller's deadline or caps cut it short."""
+        with self._condition:
+            while self._finished < self._outstanding and not self._cancelled:
+                time_left = self.controller.time_left() if self.controller is not None else None
+                if time_left is not None and time_left <= 0:
+                    self.stopped_reason = self.stopped_reason or "deadline"
+                if self.stopped_reason is not None:
+                    return False
+                self._condition.wait(timeout=time_left)
+            if self._cancelled:
+                raise RunCancelled()
+            return True
+
+    def snapshot_ranking(self, candidates: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Copies of the candidates scored so far, best first, followed by the unscored ones in
+        candidate order without their partial results; and how many were unscored. Copies,
+        so evaluation tasks still in flight cannot change what is returned.
+        """
+        with self._condition:
+            scored = [dict(joke_detail) for joke_detail in self.ranked_jokes]
+            scored_ids = {id(joke_detail) for joke_detail in self.ranked_jokes}
+        unscored = []
+        for joke_detail in candidates:
+            if id(joke_detail) not in scored_ids:
+                unscored.append({key: value for key, value in joke_detail.items()
+                                 if key not in ("evaluation", "novelty_scores", "combined_score")})
+        return scored + unscored, len(unscored)
+
+    def _run_part(self, evaluation: _CandidateEvaluation, part: str, default: Any,
+                  fn: Callable[..., Any], *args: Any) -> None:
+        try:
+            value = fn(*args)
+        except Exception as e:
+            print(f"Evaluation step '{part}' failed: {e}")
+            value = default
+        self._set_parts(evaluation, {part: value})
+
+    def _judge_batch(self, batch: List[_CandidateEvaluation]) -> None:
+        joke_texts = [evaluation.joke_detail["joke_text"] for evaluation in batch]
+        try:
+            similarities = self.manager.novelty_checker.check_semantic_similarity_batch(joke_texts)
+        except Exception as e:
+            print(f"Evaluation step 'semantic_similarity_corpus_score' failed: {e}")
+            similarities = [0.0] * len(batch)
+        try:
+            judgements = self.manager.llm_judge.evaluate_jokes_batch(joke_texts, self.judge_model, batch_size=len(batch),
+                                                                     include_novelty=self.fused_evaluation)
+        except Exception as e:
+            print(f"Evaluation step 'evaluation' failed: {e}")
+            judgements = [None] * len(batch)
+        for evaluation, similarity, judgement in zip(batch, similarities, judgements):
+            self._emit("judge_score", {
+                "joke_text": evaluation.joke_detail["joke_text"], "evaluation": judgement
+            })
+            parts = {"semantic_similarity_corpus_score": similarity, "evaluation": judgement}
+            if self.fused_evaluation:
+                parts["perceived_novelty_llm_score"] = LLMJudge.fused_novelty_score(judgement)
+            self._set_parts(evaluation, parts)
+
+    def _set_parts(self, evaluation: _CandidateEvaluation, values: Dict[str, Any]) -> None:
+        with self._condition:
+            evaluation.parts.update(values)
+            if not evaluation.expected_parts.issubset(evaluation.parts.keys()):
+                return
+        self._finalize(evaluation)
+
+    def _finalize(self, evaluation: _CandidateEvaluation) -> None:
+        joke_detail = evaluation.joke_detail
+        try:
+            precomputed = {key: value for key, value in evaluation.parts.items() if key != "evaluation"}
+            joke_detail["novelty_scores"] = self.manager.novelty_checker.calculate_overall_novelty_score(
+                joke_detail["joke_text"], self.novelty_llm_model, precomputed_scores=precomputed
+            )
+            joke_detail["evaluation"] = evaluation.parts["evaluation"]
+            joke_detail["combined_score"] = self.manager._combined_score(joke_detail)
+            if self.combination_scheduler is not None and joke_detail["evaluation"]:
+                self.combination_scheduler.record_reward(joke_detail["observations_used"], joke_detail["combined_score"] / 10)
+        except Exception as e:
+            print(f"Scoring failed for candidate: {e}")
+            joke_detail.setdefault("combined_score", 0)
+        self._emit("novelty_score", {
+            "joke_text": joke_detail["joke_text"], "novelty_scores": joke_detail.get("novelty_scores")
+        })
+        with self._condition:
+            key = (-joke_detail["combined_score"], self._finished)
+            position = bisect.bisect(self._ranking_keys, key)
+            self._ranking_keys.insert(position, key)
+            self.ranked_jokes.insert(position, joke_detail)
+            top_k = [{"joke_text": jk["joke_text"], "combined_score": jk["combined_score"]}
+                     for jk in self.ranked_jokes[:self.num_top_jokes]]
+            self._finished += 1
+            evaluated = self._finished
+            self._condition.notify_all()
+        self._emit("top_k", {"top_jokes": top_k, "evaluated": evaluated})
+
 
 class JokePipelineManager:
-    def __init__(self, openrouter_api_key: str, joke_corpus_path: Optional[str] = None):
-        self.llm_client = OpenRouterClient(api_key=openrouter_api_key)
-        self.plan_searcher = PlanSearcherForJokes(self.llm_client)
+    def __init__(self, openrouter_api_key: str, joke_corpus_path: Optional[str] = None,
+                 completion_cache: Optional[CompletionCache] = None,
+                 embedding_model_name: Optional[str] = None,
+                 trace_store: Optional[RunTraceStore] = None,
+                 combination_bandit_weight: float = 0.0,
+                 plan_pruner: Optional[PlanPruner] = None,
+                 samples_per_plan: int = 1,
+                 model_router: Optional[ModelRouter] = None,
+                 topic_memo: Optional[TopicMemoStore] = None,
+                 llm_session: Optional[requests.Session] = None,
+                 web_search: Optional[WebSearchService] = None,
+                 candidate_deduplicator: Optional[CandidateDeduplicator] = None,
+                 trace_archive: Optional[TraceArchive] = None,
+                 prompt_cache_hints: bool = False):
+        self.llm_client = OpenRouterClient(api_key=openrouter_api_key, cache=completion_cache, router=model_router,
+                                           session=llm_session, prompt_cache_hints=prompt_cache_hints)
+        self.plan_searcher = PlanSearcherForJokes(self.llm_client, samples_per_plan=samples_per_plan)
         self.llm_judge = LLMJudge(self.llm_client)
      
-        self.novelty_checker = NoveltyChecker(self.llm_client, joke_corpus_path=joke_corpus_path) 
+        self.novelty_checker = NoveltyChecker(self.llm_client, joke_corpus_path=joke_corpus_path,
+                                              embedding_model_name=embedding_model_name, web_search=web_search)
         
+        self.trace_store = trace_store
+        self.combination_bandit_weight = combination_bandit_weight
+        self.plan_pruner = plan_pruner
+        self.topic_memo = topic_memo
+        self.candidate_deduplicator = candidate_deduplicator
+        self.trace_archive = trace_archive
+        self.last_run_id: Optional[str] = None
         self.last_run_transparency_data = {}
 
     def generate_and_evaluate_jokes(self,
                                     topic: str,
                                     user_llm_choices: Dict[str, str],
                                     num_top_jokes: int = 3,
-                                    use_critique_refinement: bool = True) -> List]:
+                                    use_critique_refinement: bool = True,
+                                    judge_batch_size: int = 5,
+                                    max_eval_concurrency: int = 8,
+                                    progress_callback: Optional[ProgressCallback] = None,
+                                    run_id: Optional[str] = None,
+                                    plansearch_budget: Optional[CallBudget] = None,
+                                    controller: Optional[RunController] = None,
+                                    max_plans_to_develop: int = 5,
+                                    fused_evaluation: bool = False,
+                                    judge_ensemble: Optional[JudgeEnsemble] = None) -> List[Dict[str, Any]]:
+        """
+        Runs the pipeline under a fresh RunTrace (id `run_id`, or a generated one in last_run_id).
+        The finished trace, including per-stage LLM token/cost/latency totals, is kept in
+        last_run_transparency_data and, if configured, trace_store and trace_archive.
+        plansearch_budget caps the LLM calls and tokens PLANSEARCH may spend on this run.
+        controller instead bounds the whole run by a deadline and token/cost caps, returning
+        the best-so-far ranking when time or budget runs out; it replaces plansearch_budget.
+        fused_evaluation takes perceived novelty from the judge's response instead of a
+        separate call to the novelty_llm model.
+        judge_ensemble re-judges the candidates near the top-k boundary, with more judge
+        models and samples, until the top k are settled.
+        """
+        if controller is not None and plansearch_budget is not None:
+            raise ValueError("Pass either plansearch_budget or controller, not both.")
+        trace = RunTrace(run_id, topic, user_llm_choices)
+        self.last_run_id = trace.run_id
+        token = set_current_trace(trace)
+        controller_token = set_current_controller(controller)
+        if controller is not None:
+            controller.start(trace)
+        trace.set_summary(evaluation_mode="fused" if fused_evaluation else "separate_novelty_call")
+        try:
+            return self._generate_and_evaluate_jokes(topic, user_llm_choices, num_top_jokes, use_critique_refinement,
+                                                     judge_batch_size, max_eval_concurrency, progress_callback, trace,
+                                                     controller or plansearch_budget, max_plans_to_develop,
+                                                     fused_evaluation, judge_ensemble)
+        finally:
+            reset_current_controller(controller_token)
+            reset_current_trace(token)
+            if controller is not None:
+                trace.set_summary(run_controller=controller.get_stats())
+            trace.set_summary(llm_usage_totals=summarize_usage(trace.totals("llm_usage")),
+                              wall_time_seconds=round(time.time() - trace.created_at, 3))
+            self.last_run_transparency_data = trace.to_dict()
+            if self.trace_store is not None:
+                self.trace_store.put(trace)
+            if self.trace_archive is not None:
+                self.trace_archive.append(self.last_run_transparency_data)
+
+    def _generate_and_evaluate_jokes(self,
+                                     topic: str,
+                                     user_llm_choices: Dict[str, str],
+                                     num_top_jokes: int,
+                                     use_critique_refinement: bool,
+                                     judge_batch_size: int,
+                                     max_eval_concurrency: int,
+                                     progress_callback: Optional[ProgressCallback],
+                                     trace: RunTrace,
+                                     plansearch_budget: Optional[CallBudget],
+                                     max_plans_to_develop: int,
+                                     fused_evaluation: bool,
+                                     judge_ensemble: Optional[JudgeEnsemble]) -> List[Dict[str, Any]]:
         print(f"Pipeline started for topic: {topic} with LLM choices: {user_llm_choices}")
         
         
@@ -29,63 +341,94 @@ class JokePipelineManager:
         critique_model = user_llm_choices.get("critique", "mistralai/mistral-small") # Mistral Small is often low-cost or free tier
         judge_model = user_llm_choices.get("judge", "anthropic/claude-3.5-sonnet") # Sonnet 3.5 is good, check for free tiers or use a smaller free one
         novelty_llm_model = user_llm_choices.get("novelty_llm", "mistralai/mistral-small")
+        trace.set_summary(models={"observation": obs_model, "plan": plan_model, "joke_instantiation": joke_model,
+                                  "critique": critique_model, "judge": judge_model, "novelty_llm": novelty_llm_model})
 
-        candidate_jokes_details = self.plan_searcher.run_plansearch(
-            topic=topic,
-            observation_model=obs_model,
-            plan_model=plan_model,
-            joke_model=joke_model,
-            critique_model=critique_model if use_critique_refinement else None,
-            use_critique_refinement=use_critique_refinement,
-            max_plans_to_develop=5,
-            num_second_order_obs_per_combo=2
-        )
+        # Per run: its bandit statistics are about this topic's observations only.
+        combination_scheduler = CombinationScheduler(bandit_weight=self.combination_bandit_weight)
+        controller = plansearch_budget if isinstance(plansearch_budget, RunController) else None
+        clusters = self.candidate_deduplicator.start_run() if self.candidate_deduplicator is not None else None
+        evaluation_complete = True
+        executor = ThreadPoolExecutor(max_workers=max(1, max_eval_concurrency), thread_name_prefix="evaluation")
+        try:
+            evaluator = _StreamingEvaluator(self, executor, judge_model, novelty_llm_model, judge_batch_size,
+                                            num_top_jokes=num_top_jokes, progress_callback=progress_callback,
+                                            combination_scheduler=combination_scheduler, controller=controller,
+                                            fused_evaluation=fused_evaluation, clusters=clusters)
+            candidate_jokes_details = self.plan_searcher.run_plansearch(
+                topic=topic,
+                observation_model=obs_model,
+                plan_model=plan_model,
+                joke_model=joke_model,
+                critique_model=critique_model if use_critique_refinement else None,
+                use_critique_refinement=use_critique_refinement,
+                max_plans_to_develop=max_plans_to_develop,
+                num_second_order_obs_per_combo=2,
+                on_candidate=evaluator.submit,
+                progress_callback=progress_callback,
+                combination_scheduler=combination_scheduler,
+                budget=plansearch_budget,
+                plan_pruner=self.plan_pruner,
+                topic_memo=self.topic_memo
+            )
+            evaluator.flush()
+            evaluation_complete = evaluator.wait()
+        finally:
+            # Past the deadline, queued evaluation work is dropped rather than waited for.
+            executor.shutdown(wait=evaluation_complete, cancel_futures=not evaluation_complete)
 
         if not candidate_jokes_details:
             print("No candidate jokes generated by PLANSEARCH.")
-            self.last_run_transparency_data = {
-                'topic': topic, 'llm_choices': user_llm_choices, 'plansearch_data': self.plan_searcher.get_transparency_data(),
-                'error': "No candidate jokes from PLANSEARCH"
-            }
-            return
+            trace.set_summary(error="No candidate jokes from PLANSEARCH")
+            return []
 
-        evaluated_jokes =
-        for i, joke_detail in enumerate(candidate_jokes_details):
-            joke_text = joke_detail["joke_text"]
-           
-            novelty_scores = self.novelty_checker.calculate_overall_novelty_score(
-                joke_text,
-                perceived_novelty_model_name=novelty_llm_model
-            )
-            joke_detail["novelty_scores"] = novelty_scores
-            
-            evaluation = self.llm_judge.evaluate_joke(joke_text, judge_model)
-            joke_detail["evaluation"] = evaluation
-
-
-            if evaluation and "overall_funniness" in evaluation:
-                funniness_score = float(evaluation.get("overall_funniness", 0))
-                scaled_novelty = novelty_scores.get("final_novelty_score", 0.0) * 10 
-                
-                combined_score = (0.7 * funniness_score) + (0.3 * scaled_novelty)
-                joke_detail["combined_score"] = combined_score
-                evaluated_jokes.append(joke_detail)
-            else:
-                joke_detail["combined_score"] = 0 
-                evaluated_jokes.append(joke_detail)
-
-        ranked_jokes = sorted(evaluated_jokes, key=lambda x: x.get("combined_score", 0), reverse=True)
+        if clusters is not None:
+            # Only cluster representatives were evaluated; each carries its near-duplicates along.
+            total_candidates = len(candidate_jokes_details)
+            candidate_jokes_details = [joke_detail for joke_detail in candidate_jokes_details
+                                       if not clusters.is_duplicate(joke_detail)]
+            for joke_detail in candidate_jokes_details:
+                duplicates = clusters.duplicates_of(joke_detail)
+                if duplicates:
+                    joke_detail["near_duplicates"] = [duplicate["joke_text"] for duplicate in duplicates]
+            trace.set_summary(candidate_dedup=dict(
+                evaluator.evaluations_avoided, candidates=total_candidates, clusters=len(candidate_jokes_details),
+                duplicates_collapsed=total_candidates - len(candidate_jokes_details)
+            ))
+
+        if judge_ensemble is not None and evaluation_complete:
+            trace.set_summary(judge_ensemble=judge_ensemble.rank(
+                candidate_jokes_details, num_top_jokes, self.llm_judge, judge_model,
+                lambda joke_detail, funniness: self._combined_score(joke_detail, funniness), controller
+            ))
+
+        if not evaluation_complete:
+            # Best-so-far: evaluated candidates by score, then the rest unscored.
+            candidate_jokes_details, unevaluated = evaluator.snapshot_ranking(candidate_jokes_details)
+            trace.set_summary(deadline_reached=evaluator.stopped_reason == "deadline",
+                              evaluation_stopped=evaluator.stopped_reason, unevaluated_candidates=unevaluated)
+            print(f"Run evaluation stopped ({evaluator.stopped_reason}) with {unevaluated} of "
+                  f"{len(candidate_jokes_details)} candidates unevaluated.")
+
+        # Final ranking follows candidate order on ties, independent of evaluation completion order.
+        ranked_jokes = sorted(candidate_jokes_details, key=lambda x: x.get("combined_score", 0), reverse=True)
+        if clusters is not None:
+            ranked_jokes = self.candidate_deduplicator.select_diverse(ranked_jokes, num_top_jokes, clusters)
         
-        self.last_run_transparency_data = {
-            'topic': topic, 
-            'llm_choices': user_llm_choices,
-            'plansearch_data': self.plan_searcher.get_transparency_data(),
-            'novelty_checker_data': self.novelty_checker.get_transparency_data(),
-            'llm_judge_data': self.llm_judge.get_transparency_data(),
-            'final_ranked_jokes_summary': [{ "joke": jk["joke_text"][:60]+"...", "score": jk.get("combined_score")} for jk in ranked_jokes[:num_top_jokes]]
-        }
+        trace.set_summary(
+            final_ranked_jokes_summary=[{ "joke": jk["joke_text"][:60]+"...", "score": jk.get("combined_score")} for jk in ranked_jokes[:num_top_jokes]]
+        )
 
         return ranked_jokes[:num_top_jokes]
 
+    def _combined_score(self, joke_detail: Dict[str, Any], funniness: Optional[float] = None) -> float:
+        evaluation = joke_detail.get("evaluation")
+        if evaluation and "overall_funniness" in evaluation:
+            funniness_score = float(evaluation.get("overall_funniness", 0)) if funniness is None else funniness
+            scaled_novelty = joke_detail["novelty_scores"].get("final_novelty_score", 0.0) * 10 
+            
+            return (0.7 * funniness_score) + (0.3 * scaled_novelty)
+        return 0
+
     def get_last_run_transparency_data(self) -> Dict:
         return self.last_run_transparency_data
\ No newline at end of file
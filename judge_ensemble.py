@@ -0,0 +1,163 @@
+
+import math
+from statistics import NormalDist
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from.run_controller import RunController
+from.run_trace import current_trace
+
+# score_fn(joke_detail, funniness) -> combined_score with that funniness
+ScoreFn = Callable[[Dict[str, Any], float], float]
+
+
+def _judge_requests() -> Optional[int]:
+    """Judge requests the current run has sent so far (completion cache hits excluded); None outside a run."""
+    trace = current_trace()
+    if trace is None:
+        return None
+    return sum(row.get("calls", 0) - row.get("cache_hits", 0) for row in trace.totals("llm_usage") if row["stage"] == "judge")
+
+
+class JudgeEnsemble:
+    """
+    Adaptive re-judging of the candidates around the top-k boundary.
+    Every candidate starts with its one regular judgement. A candidate is ambiguous while
+    its confidence interval on combined_score overlaps the boundary between the top k and
+    the rest (LUCB-style: top-k lower bounds below the best upper bound outside, or outside
+    upper bounds above the worst top-k lower bound). Each round, the max_per_round ambiguous
+    candidates nearest the boundary (one batched call) get one more judgement. Rounds rotate
+    through judge_models after the primary judge and sample at `temperature` without the
+    completion cache. Judging stops once the top-k set is separated, no ambiguous candidate
+    has samples left, max_rounds is reached, or the run's deadline or token/cost cap is hit.
+    Funniness uncertainty is the within-joke spread of judgements, pooled over candidates
+    and shrunk toward prior_sd, over sqrt(samples); novelty is treated as fixed.
+    """
+
+    def __init__(self,
+                 judge_models: Sequence[str],
+                 max_samples_per_joke: int = 5,
+                 max_rounds: int = 8,
+                 confidence: float = 0.9,
+                 prior_sd: float = 1.5,
+                 prior_weight: float = 2.0,
+                 temperature: float = 0.7,
+                 batch_size: int = 5,
+                 max_per_round: Optional[int] = 5):
+        if not 0 < confidence < 1:
+            raise ValueError("confidence must be in (0, 1)")
+        self.judge_models = list(judge_models)
+        self.max_samples_per_joke = max(1, max_samples_per_joke)
+        self.max_rounds = max_rounds
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.prior_sd = prior_sd
+        self.prior_weight = prior_weight
+        self.temperature = temperature
+        self.batch_size = batch_size
+        self.max_per_round = max_per_round
+
+    @staticmethod
+    def _funniness(evaluation: Optional[Dict[str, Any]]) -> Optional[float]:
+        try:
+            return float(evaluation["overall_funniness"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _pooled_sd(self, samples: List[List[float]]) -> float:
+        squares, dof = 0.0, 0
+        for values in samples:
+            if len(values) > 1:
+                mean = sum(values) / len(values)
+                squares += sum((value - mean) ** 2 for value in values)
+                dof += len(values) - 1
+        return math.sqrt((self.prior_weight * self.prior_sd ** 2 + squares) / (self.prior_weight + dof))
+
+    def _intervals(self, candidates: List[Dict[str, Any]], samples: List[List[float]],
+                   score_fn: ScoreFn) -> List[Tuple[float, float, float]]:
+        """(lower, score, upper) on combined_score per candidate."""
+        sd = self._pooled_sd(samples)
+        intervals = []
+        for joke_detail, values in zip(candidates, samples):
+            mean = sum(values) / len(values)
+            half_width = self.z * sd / math.sqrt(len(values))
+            intervals.append((score_fn(joke_detail, mean - half_width), score_fn(joke_detail, mean),
+                              score_fn(joke_detail, mean + half_width)))
+        return intervals
+
+    def _ambiguous(self, intervals: List[Tuple[float, float, float]], k: int) -> List[int]:
+        """Candidates whose interval straddles the top-k boundary, the least certain side of it first."""
+        order = sorted(range(len(intervals)), key=lambda index: -intervals[index][1]) # Stable on ties
+        top, rest = order[:k], order[k:]
+        if not rest:
+            return []
+        worst_top_lower = min(intervals[index][0] for index in top)
+        best_rest_upper = max(intervals[index][2] for index in rest)
+        if worst_top_lower >= best_rest_upper:
+            return []
+        boundary = (intervals[top[-1]][1] + intervals[rest[0]][1]) / 2
+        ambiguous = [index for index in top if intervals[index][0] < best_rest_upper] + \
+                    [index for index in rest if intervals[index][2] > worst_top_lower]
+        # Distance to the boundary in units of the interval's half-width
+        return sorted(ambiguous, key=lambda index: abs(intervals[index][1] - boundary) /
+                      max(intervals[index][2] - intervals[index][1], 1e-9))
+
+    def rank(self,
+             candidates: List[Dict[str, Any]],
+             k: int,
+             llm_judge: Any,
+             primary_model: str,
+             score_fn: ScoreFn,
+             controller: Optional[RunController] = None) -> Dict[str, Any]:
+        """
+        Re-judges candidates (evaluated joke details) in place: each gets an "ensemble" entry
+        with its funniness samples and their mean, and combined_score is recomputed from
+        that mean. Returns a summary of the judging spent; its extra_judge_calls are the judge
+        requests the run's trace recorded while re-judging (per-joke fallbacks and retried
+        models included), or None outside a run, so rank once the run's other judging is done.
+        """
+        models = list(dict.fromkeys([primary_model] + self.judge_models))
+        scored = [joke_detail for joke_detail in candidates if self._funniness(joke_detail.get("evaluation")) is not None]
+        samples = [[self._funniness(joke_detail["evaluation"])] for joke_detail in scored]
+        sample_models = [[primary_model] for _ in scored]
+        rounds = extra_judgements = 0
+        requests_before = _judge_requests()
+        ambiguous = self._ambiguous(self._intervals(scored, samples, score_fn), k)
+
+        stopped = None
+        while ambiguous and rounds < self.max_rounds:
+            stopped = controller.evaluation_stop_reason() if controller is not None else None
+            if stopped is not None:
+                break
+            wanted = [index for index in ambiguous if len(samples[index]) < self.max_samples_per_joke]
+            wanted = wanted[:self.max_per_round] if self.max_per_round else wanted
+            if not wanted:
+                break
+            model = models[(rounds + 1) % len(models)]
+            judgements = llm_judge.evaluate_jokes_batch([scored[index]["joke_text"] for index in wanted], model,
+                                                        batch_size=self.batch_size, temperature=self.temperature,
+                                                        use_cache=False, seed=rounds) # A fresh order per round
+            rounds += 1
+            for index, judgement in zip(wanted, judgements):
+                funniness = self._funniness(judgement)
+                if funniness is not None:
+                    samples[index].append(funniness)
+                    sample_models[index].append(model)
+                    extra_judgements += 1
+            ambiguous = self._ambiguous(self._intervals(scored, samples, score_fn), k)
+
+        requests_after = _judge_requests()
+        extra_calls = requests_after - requests_before if requests_before is not None else None
+        sd = self._pooled_sd(samples)
+        for joke_detail, values, value_models in zip(scored, samples, sample_models):
+            mean = sum(values) / len(values)
+            joke_detail["ensemble"] = {
+                "funniness_mean": mean, "funniness_samples": values, "models": value_models,
+                "half_width": self.z * sd / math.sqrt(len(values))
+            }
+            joke_detail["combined_score"] = score_fn(joke_detail, mean)
+        return {
+            "models": models, "rounds": rounds, "extra_judgements": extra_judgements, "extra_judge_calls": extra_calls,
+            "settled": not ambiguous, "ambiguous_remaining": len(ambiguous), "stopped": stopped,
+            "pooled_sd": round(sd, 3),
+            "judgements": len(scored) + extra_judgements,
+            "exhaustive_judgements": len(scored) * self.max_samples_per_joke
+        }
@@ -1,15 +1,29 @@
 
+import hashlib
 import json
-from typing import Dict, Optional, Tuple, List
+import random
+from functools import lru_cache
+from typing import Dict, Optional, Tuple, List, Any
 from.openrouter_client import OpenRouterClient 
-class LLMJudge:
-    def __init__(self, llm_client: OpenRouterClient):
-        self.llm_client = llm_client
-        self.transparency_data = {"evaluations":}
+from.run_trace import record_trace, trace_component
+from.metrics import llm_stage
 
+REQUIRED_EVALUATION_KEYS = {"originality", "coherence", "setup_effectiveness", "punchline_impact", "brevity", "overall_funniness", "rationale"}
+# Fused mode: the judge also rates perceived novelty (0.0-1.0), replacing NoveltyChecker's separate LLM call.
+FUSED_NOVELTY_KEY = "perceived_novelty"
 
-    def get_joke_evaluation_rubric(self) -> str: 
-        return """
+
+@lru_cache(maxsize=None)
+def evaluation_rubric(include_novelty: bool = False) -> str:
+    """The judge rubric text. Built once per process and shared by every LLMJudge."""
+    novelty_criterion = novelty_field = ""
+    if include_novelty:
+        novelty_criterion = (
+            "\n        7.  **Perceived Novelty:** (0.0-1.0) Does it feel like a fresh, creative joke (1.0), "
+            "or a common, recycled, or clichéd one (0.0)?"
+        )
+        novelty_field = f'\n            "{FUSED_NOVELTY_KEY}": <score_0.0_1.0>,'
+    return f"""
         Please evaluate the joke based on the following criteria. Provide a score from 1 (very poor) to 10 (excellent) for each, and an overall funniness score (1-10). Also, provide a brief overall rationale.
 
         1.  **Originality/Novelty:** (1-10) Does the joke feel fresh and not like a common or overused joke?
@@ -17,70 +31,208 @@ class LLMJudge:
         3.  **Setup Effectiveness:** (1-10) Does the setup effectively build anticipation or misdirection?
         4.  **Punchline Impact:** (1-10) Is the punchline surprising, witty, and satisfying?
         5.  **Brevity/Conciseness:** (1-10) Is the joke concise, or does it have unnecessary words? (Note: Brevity is often good, but not always. Judge in context.)
-        6.  **Overall Funniness:** (1-10) How funny is the joke overall?
+        6.  **Overall Funniness:** (1-10) How funny is the joke overall?{novelty_criterion}
 
         Output your evaluation in JSON format like this:
-        {
+        {{
             "originality": <score_1_10>,
             "coherence": <score_1_10>,
             "setup_effectiveness": <score_1_10>,
             "punchline_impact": <score_1_10>,
             "brevity": <score_1_10>,
-            "overall_funniness": <score_1_10>,
+            "overall_funniness": <score_1_10>,{novelty_field}
             "rationale": "<brief overall textual rationale for the funniness score>"
-        }
+        }}
         """
 
-    def _construct_judge_prompt(self, joke_text: str, rubric: str, bias_instructions: Optional[str] = None) -> str:
+
+class LLMJudge:
+    TRACE_COMPONENT = "llm_judge_data"
+    TRACE_SECTIONS = ("evaluations",)
+
+    def __init__(self, llm_client: OpenRouterClient):
+        self.llm_client = llm_client
+
+
+    def _required_keys(self, include_novelty: bool) -> set:
+        return (REQUIRED_EVALUATION_KEYS | {FUSED_NOVELTY_KEY}) if include_novelty else REQUIRED_EVALUATION_KEYS
+
+    @staticmethod
+    def fused_novelty_score(evaluation: Optional[Dict[str, Any]]) -> float:
+        """The perceived novelty of a fused evaluation, on NoveltyChecker's 0.0-1.0 scale (0.5 if unusable)."""
+        try:
+            return max(0.0, min(1.0, float(evaluation[FUSED_NOVELTY_KEY])))
+        except (KeyError, TypeError, ValueError):
+            return 0.5
+
+    def get_joke_evaluation_rubric(self, include_novelty: bool = False) -> str:
+        return evaluation_rubric(include_novelty)
+
+    def _construct_judge_messages(self, joke_text: str, rubric: str,
+                                  bias_instructions: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        The instructions, rubric and bias guidance are the same for every joke, so they form
+        the system message and the joke alone is the user message: providers can then reuse
+        their prompt cache for everything up to the joke.
+        """
         bias_mitigation_text = bias_instructions or (
             "IMPORTANT: Evaluate objectively. Do not let the length of the joke unduly influence your funniness score. "
             "A short joke can be funnier than a long one. Focus on cleverness and impact. "
             "The order of presentation should not affect your judgment if multiple jokes were being compared (though here you evaluate one)."
         ) 
 
-        return (
-            f"You are a discerning comedy critic. Your task is to evaluate the following joke based on the provided rubric. "
+        system_content = (
+            f"You are a discerning comedy critic. Your task is to evaluate the joke the user gives you based on the provided rubric. "
             f"Please be thoughtful and analytical in your assessment.\n\n"
-            f"Joke to Evaluate:\n\"\"\"\n{joke_text}\n\"\"\"\n\n"
             f"Evaluation Rubric and Output Format:\n{rubric}\n\n"
             f"{bias_mitigation_text}\n\n"
             f"Provide your evaluation in the specified JSON format only."
         )
+        return [{"role": "system", "content": system_content},
+                {"role": "user", "content": f"Joke to Evaluate:\n\"\"\"\n{joke_text}\n\"\"\""}]
 
     def evaluate_joke(self,
                       joke_text: str,
                       judge_model_name: str,
-                      bias_instructions: Optional[str] = None) -> Optional]:
-        rubric = self.get_joke_evaluation_rubric()
-        prompt_content = self._construct_judge_prompt(joke_text, rubric, bias_instructions)
-        
-        messages = [{"role": "user", "content": prompt_content}]
+                      bias_instructions: Optional[str] = None,
+                      include_novelty: bool = False,
+                      temperature: float = 0.3,
+                      use_cache: Optional[bool] = None) -> Optional[Dict[str, Any]]:
+        rubric = self.get_joke_evaluation_rubric(include_novelty)
+        messages = self._construct_judge_messages(joke_text, rubric, bias_instructions)
         response_format_json = {"type": "json_object"} 
         
-        raw_response = self.llm_client.get_completion(
-            judge_model_name, 
-            messages, 
-            temperature=0.3, 
-            max_tokens=400,
-            response_format=response_format_json
-        )
+        with llm_stage("judge"):
+            raw_response = self.llm_client.get_completion(
+                judge_model_name,
+                messages,
+                temperature=temperature,
+                max_tokens=400,
+                response_format=response_format_json,
+                use_cache=use_cache
+            )
 
         evaluation = None
         if raw_response:
             try:
                 evaluation = json.loads(raw_response)
-                required_keys = {"originality", "coherence", "setup_effectiveness", "punchline_impact", "brevity", "overall_funniness", "rationale"}
-                if not required_keys.issubset(evaluation.keys()):
+                if not self._required_keys(include_novelty).issubset(evaluation.keys()):
                     print(f"LLM Judge response missing required keys: {raw_response}")
                     evaluation = None 
             except json.JSONDecodeError:
                 print(f"LLM Judge response was not valid JSON: {raw_response}")
                 evaluation = None
         
-        self.transparency_data["evaluations"].append({
+        record_trace(self.TRACE_COMPONENT, "evaluations", {
             "joke_text": joke_text, "judge_model": judge_model_name, "raw_response": raw_response, "parsed_evaluation": evaluation
         })
         return evaluation
 
+    def _construct_batch_judge_messages(self, jokes: List[Tuple[str, str]], rubric: str,
+                                        bias_instructions: Optional[str] = None) -> List[Dict[str, str]]:
+        """Like _construct_judge_messages: a system message shared by every batch, then the batch's jokes."""
+        bias_mitigation_text = bias_instructions or (
+            "IMPORTANT: Evaluate objectively and score each joke on its own merits, as if it were the only one. "
+            "Do not let the length of a joke unduly influence your funniness score. "
+            "The jokes are listed in a random order; their position must not affect your judgment."
+        )
+        jokes_str = "\n\n".join([f"[{joke_id}]\n\"\"\"\n{joke_text}\n\"\"\"" for joke_id, joke_text in jokes])
+
+        system_content = (
+            f"You are a discerning comedy critic. Your task is to evaluate each of the jokes the user gives you independently, "
+            f"using the same rubric for every joke. Please be thoughtful and analytical in your assessment.\n\n"
+            f"Evaluation Rubric and Per-Joke Output Format:\n{rubric}\n\n"
+            f"{bias_mitigation_text}\n\n"
+            f"Provide your evaluation as a single JSON object of the form "
+            f"{{\"evaluations\": [{{\"joke_id\": \"<id>\", <per-joke fields from the rubric>}}, ...]}} "
+            f"with exactly one entry per joke id. Output JSON only."
+        )
+        return [{"role": "system", "content": system_content},
+                {"role": "user", "content": f"Jokes to Evaluate:\n{jokes_str}"}]
+
+    @staticmethod
+    def _shuffle_seed(joke_texts: List[str], seed: Optional[int]) -> int:
+        # hashlib rather than hash(): str hashes differ between processes.
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(str(seed).encode("utf-8"))
+        for joke_text in joke_texts:
+            digest.update(b"\x00" + joke_text.encode("utf-8"))
+        return int.from_bytes(digest.digest(), "little")
+
+    def evaluate_jokes_batch(self,
+                             joke_texts: List[str],
+                             judge_model_name: str,
+                             batch_size: int = 5,
+                             bias_instructions: Optional[str] = None,
+                             seed: Optional[int] = None,
+                             include_novelty: bool = False,
+                             temperature: float = 0.3,
+                             use_cache: Optional[bool] = None) -> List[Optional[Dict[str, Any]]]:
+        """
+        Scores jokes `batch_size` at a time in one structured-JSON request per batch, so the
+        rubric is sent once per batch rather than once per joke. Presentation order is
+        shuffled within each batch, seeded from the batch's jokes (and seed, if given), so the
+        same batch always yields the same prompt and can be served from the completion cache
+        or a replayed transcript. Jokes whose entry is missing or invalid fall back to
+        evaluate_joke. Results are returned in the order of joke_texts.
+        With include_novelty every evaluation also carries FUSED_NOVELTY_KEY.
+        Repeat judgements (e.g. ensembles) pass a higher temperature and use_cache=False.
+        """
+        if batch_size <= 1:
+            return [self.evaluate_joke(joke_text, judge_model_name, bias_instructions, include_novelty,
+                                       temperature, use_cache)
+                    for joke_text in joke_texts]
+
+        rubric = self.get_joke_evaluation_rubric(include_novelty)
+        required_keys = self._required_keys(include_novelty)
+        results: List[Optional[Dict[str, Any]]] = [None] * len(joke_texts)
+
+        for start in range(0, len(joke_texts), batch_size):
+            indices = list(range(start, min(start + batch_size, len(joke_texts))))
+            random.Random(self._shuffle_seed([joke_texts[index] for index in indices], seed)).shuffle(indices)
+            id_to_index = {f"J{position + 1}": index for position, index in enumerate(indices)}
+            messages = self._construct_batch_judge_messages(
+                [(joke_id, joke_texts[index]) for joke_id, index in id_to_index.items()], rubric, bias_instructions
+            )
+            with llm_stage("judge"):
+                raw_response = self.llm_client.get_completion(
+                    judge_model_name,
+                    messages,
+                    temperature=temperature,
+                    max_tokens=100 + (320 if include_novelty else 300) * len(indices),
+                    response_format={"type": "json_object"},
+                    use_cache=use_cache
+                )
+
+            parsed: Dict[str, Dict[str, Any]] = {}
+            if raw_response:
+                try:
+                    entries = json.loads(raw_response).get("evaluations", [])
+                    for entry in entries:
+                        joke_id = str(entry.get("joke_id", "")).strip("[] ")
+                        if joke_id in id_to_index and required_keys.issubset(entry.keys()):
+                            parsed[joke_id] = {key: value for key, value in entry.items() if key != "joke_id"}
+                except (json.JSONDecodeError, AttributeError, TypeError):
+                    print(f"LLM Judge batch response was not valid JSON: {raw_response}")
+
+            for joke_id, index in id_to_index.items():
+                evaluation = parsed.get(joke_id)
+                if evaluation is None:
+                    continue # Re-judged individually below, which records its own transparency entry
+                results[index] = evaluation
+                record_trace(self.TRACE_COMPONENT, "evaluations", {
+                    "joke_text": joke_texts[index], "judge_model": judge_model_name, "raw_response": raw_response,
+                    "parsed_evaluation": evaluation, "batch_presentation_order": int(joke_id[1:]),
+                    "batch_size": len(indices)
+                })
+
+        failed = [index for index, evaluation in enumerate(results) if evaluation is None]
+        if failed:
+            print(f"LLM Judge batch evaluation fell back to per-joke calls for {len(failed)} joke(s).")
+        for index in failed:
+            results[index] = self.evaluate_joke(joke_texts[index], judge_model_name, bias_instructions, include_novelty,
+                                                temperature, use_cache)
+        return results
+
     def get_transparency_data(self) -> Dict:
-        return self.transparency_data
\ No newline at end of file
+        return trace_component(self.TRACE_COMPONENT, self.TRACE_SECTIONS)
\ No newline at end of file
@@ -0,0 +1,218 @@
+
+import bisect
+import contextlib
+import contextvars
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from.run_trace import current_trace
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_PREFIX = "jokebot"
+
+# Pipeline stage the LLM calls made in this context belong to (observations, plan, joke, ...).
+_current_stage: contextvars.ContextVar[str] = contextvars.ContextVar("llm_stage", default="unknown")
+
+
+@contextlib.contextmanager
+def llm_stage(stage: str) -> Iterator[None]:
+    token = _current_stage.set(stage)
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
+
+
+def current_stage() -> str:
+    return _current_stage.get()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(**labels: str) -> str:
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+class MetricsRegistry:
+    """
+    Process-wide LLM call metrics, rendered in the Prometheus text format.
+    Calls are aggregated by (model, stage): counts by status, prompt/completion tokens,
+    retries, cost and a latency histogram. Cost comes from the response's usage.cost when
+    the provider reports it, else from model_prices (USD per million prompt/completion tokens).
+    Prompt tokens served from the provider's prompt cache, the calls that hit it and their
+    latency are also summed, to compare cached against uncached calls.
+    Extra gauges (queue depth, cache sizes, ...) can be registered as callbacks.
+    """
+
+    def __init__(self, model_prices: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.model_prices = model_prices or {}
+        self._calls: Dict[Tuple[str, str, str], int] = {}
+        self._totals: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self._latency: Dict[Tuple[str, str], List[int]] = {} # Per-bucket counts, +Inf last
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+        self._lock = threading.Lock()
+
+    def cost_of(self, model: str, prompt_tokens: int, completion_tokens: int, reported_cost: Optional[float]) -> float:
+        if reported_cost is not None:
+            return float(reported_cost)
+        prompt_price, completion_price = self.model_prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+    def record_call(self, model: str, stage: str, status: str, latency_s: float,
+                    prompt_tokens: int = 0, completion_tokens: int = 0, cost_usd: float = 0.0, retries: int = 0,
+                    cached_prompt_tokens: int = 0) -> None:
+        key = (model, stage)
+        with self._lock:
+            self._calls[(model, stage, status)] = self._calls.get((model, stage, status), 0) + 1
+            totals = self._totals.setdefault(key, {"prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0,
+                                                   "retries": 0, "latency_seconds_sum": 0.0, "latency_count": 0,
+                                                   "cached_prompt_tokens": 0, "prefix_cached_calls": 0,
+                                                   "prefix_cached_latency_seconds": 0.0})
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+            totals["cost_usd"] += cost_usd
+            totals["retries"] += retries
+            if cached_prompt_tokens:
+                totals["cached_prompt_tokens"] += cached_prompt_tokens
+                totals["prefix_cached_calls"] += 1
+                totals["prefix_cached_latency_seconds"] += latency_s
+            if status != "cache_hit": # Cache hits would drag the latency distribution toward zero
+                totals["latency_seconds_sum"] += latency_s
+                totals["latency_count"] += 1
+                buckets = self._latency.setdefault(key, [0] * (len(LATENCY_BUCKETS) + 1))
+                buckets[bisect.bisect_left(LATENCY_BUCKETS, latency_s)] += 1
+
+    def register_gauge(self, name: str, help_text: str, fn: Callable[[], float]) -> None:
+        with self._lock:
+            self._gauges[name] = (help_text, fn)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Totals per 'model|stage', for logs and tests."""
+        with self._lock:
+            return {f"{model}|{stage}": dict(totals) for (model, stage), totals in self._totals.items()}
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            calls = dict(self._calls)
+            totals = {key: dict(value) for key, value in self._totals.items()}
+            latency = {key: list(value) for key, value in self._latency.items()}
+            gauges = dict(self._gauges)
+
+        lines: List[str] = []
+
+        def family(name: str, metric_type: str, help_text: str) -> str:
+            full_name = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {metric_type}")
+            return full_name
+
+        name = family("llm_calls_total", "counter", "LLM calls by model, pipeline stage and outcome.")
+        for (model, stage, status), count in sorted(calls.items()):
+            lines.append(f"{name}{_labels(model=model, stage=stage, status=status)} {count}")
+        for field, metric_type, help_text in (
+                ("prompt_tokens", "counter", "Prompt tokens reported by the provider."),
+                ("completion_tokens", "counter", "Completion tokens reported by the provider."),
+                ("cost_usd", "counter", "LLM spend in USD."),
+                ("retries", "counter", "Retried LLM requests."),
+                ("cached_prompt_tokens", "counter", "Prompt tokens served from the provider's prompt cache."),
+                ("prefix_cached_calls", "counter", "LLM requests that hit the provider's prompt cache."),
+                ("prefix_cached_latency_seconds", "counter", "Latency of the requests that hit the provider's prompt cache.")):
+            name = family(f"llm_{field}_total", metric_type, help_text)
+            for (model, stage), values in sorted(totals.items()):
+                lines.append(f"{name}{_labels(model=model, stage=stage)} {values[field]:g}")
+
+        name = family("llm_latency_seconds", "histogram", "LLM request latency, excluding cache hits.")
+        for (model, stage), buckets in sorted(latency.items()):
+            cumulative = 0
+            for bound, count in zip(list(LATENCY_BUCKETS) + ["+Inf"], buckets):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(model=model, stage=stage, le=str(bound))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(model=model, stage=stage)} {totals[(model, stage)]['latency_seconds_sum']:g}")
+            lines.append(f"{name}_count{_labels(model=model, stage=stage)} {cumulative}")
+
+        for gauge_name, (help_text, fn) in sorted(gauges.items()):
+            try:
+                value = float(fn())
+            except Exception as e:
+                print(f"Metrics gauge '{gauge_name}' failed: {e}")
+                continue
+            full_name = family(gauge_name, "gauge", help_text)
+            lines.append(f"{full_name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+_default_registry = MetricsRegistry()
+
+
+def default_registry() -> MetricsRegistry:
+    return _default_registry
+
+
+def record_llm_call(model: str, status: str, latency_s: float, usage: Optional[Dict[str, float]] = None,
+                    retries: int = 0, registry: Optional[MetricsRegistry] = None) -> None:
+    """
+    Records one LLM request under the current stage, in the process registry and, during
+    a pipeline run, in the run's trace (summed per stage and model). Cached prompt tokens
+    are read from usage.prompt_tokens_details.cached_tokens, as OpenRouter reports them.
+    """
+    registry = registry or _default_registry
+    usage = usage or {}
+    prompt_tokens = int(usage.get("prompt_tokens") or 0)
+    completion_tokens = int(usage.get("completion_tokens") or 0)
+    cached_prompt_tokens = int((usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0)
+    cost_usd = registry.cost_of(model, prompt_tokens, completion_tokens, usage.get("cost"))
+    stage = current_stage()
+    registry.record_call(model, stage, status, latency_s, prompt_tokens, completion_tokens, cost_usd, retries,
+                         cached_prompt_tokens)
+    trace = current_trace()
+    if trace is not None:
+        trace.accumulate("llm_usage", {"stage": stage, "model": model}, {
+            "calls": 1, "errors": int(status == "error"), "cache_hits": int(status == "cache_hit"),
+            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "cost_usd": cost_usd, "retries": retries, "latency_seconds": 0.0 if status == "cache_hit" else latency_s,
+            "cached_prompt_tokens": cached_prompt_tokens, "prefix_cached_calls": int(cached_prompt_tokens > 0),
+            "prefix_cached_latency_seconds": latency_s if cached_prompt_tokens else 0.0
+        })
+
+
+def prompt_cache_summary(rows: List[Dict[str, float]]) -> Dict[str, Optional[float]]:
+    """
+    Provider prompt caching over llm_usage rows: the share of prompt tokens served from
+    the cache, and the mean latency of calls that hit it against calls that sent their
+    whole prompt (completion cache hits excluded, errors counted as uncached).
+    """
+    prompt_tokens = sum(row.get("prompt_tokens", 0) for row in rows)
+    cached_tokens = sum(row.get("cached_prompt_tokens", 0) for row in rows)
+    cached_calls = sum(row.get("prefix_cached_calls", 0) for row in rows)
+    cached_latency = sum(row.get("prefix_cached_latency_seconds", 0.0) for row in rows)
+    uncached_calls = sum(row.get("calls", 0) - row.get("cache_hits", 0) for row in rows) - cached_calls
+    uncached_latency = sum(row.get("latency_seconds", 0.0) for row in rows) - cached_latency
+    return {
+        "cached_token_ratio": round(cached_tokens / prompt_tokens, 3) if prompt_tokens else None,
+        "cached_calls": cached_calls,
+        "uncached_calls": uncached_calls,
+        "seconds_per_cached_call": round(cached_latency / cached_calls, 4) if cached_calls else None,
+        "seconds_per_uncached_call": round(uncached_latency / uncached_calls, 4) if uncached_calls else None
+    }
+
+
+def summarize_usage(rows: List[Dict[str, float]]) -> Dict[str, Any]:
+    """
+    Run-level totals from RunTrace.totals("llm_usage"), plus each stage's share of LLM time
+    and provider prompt caching overall and per stage.
+    """
+    fields = ("calls", "errors", "cache_hits", "prompt_tokens", "completion_tokens", "cost_usd", "retries", "latency_seconds",
+              "cached_prompt_tokens")
+    totals = {field: sum(row.get(field, 0) for row in rows) for field in fields}
+    stage_latency: Dict[str, float] = {}
+    for row in rows:
+        stage_latency[row["stage"]] = stage_latency.get(row["stage"], 0.0) + row.get("latency_seconds", 0.0)
+    total_latency = totals["latency_seconds"]
+    totals["latency_share_by_stage"] = {stage: round(latency / total_latency, 3) if total_latency else 0.0
+                                        for stage, latency in sorted(stage_latency.items(), key=lambda item: -item[1])}
+    totals["prompt_cache"] = prompt_cache_summary(rows)
+    totals["prompt_cache_by_stage"] = {stage: prompt_cache_summary([row for row in rows if row["stage"] == stage])
+                                       for stage in sorted(stage_latency)}
+    return totals
@@ -0,0 +1,200 @@
+
+import collections
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Rolling-window breaker for one model. It opens when at least min_calls of the last
+    `window` calls were observed and failure_rate_threshold of them failed (errors,
+    empty replies, or calls slower than slow_call_seconds). After cooldown_seconds a
+    single probe call is let through; its outcome closes or re-opens the breaker.
+    Outcomes of calls that finish while the breaker is open are ignored, and each
+    opening starts the window afresh.
+    """
+
+    def __init__(self,
+                 window: int = 20,
+                 min_calls: int = 5,
+                 failure_rate_threshold: float = 0.5,
+                 slow_call_seconds: Optional[float] = None,
+                 cooldown_seconds: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.clock = clock
+        self.state = CLOSED
+        self._outcomes: Deque[bool] = collections.deque(maxlen=window) # True = failure
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        """Whether a call could be let through now; unlike allow() it reserves nothing."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return self.clock() - self._opened_at >= self.cooldown_seconds
+            return not self._probe_in_flight
+
+    def allow(self) -> bool:
+        """Call right before a request; in the half-open state only one probe is let through."""
+        with self._lock:
+            if self.state == OPEN and self.clock() - self._opened_at >= self.cooldown_seconds:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record(self, success: bool, latency_s: float) -> None:
+        failed = not success or (self.slow_call_seconds is not None and latency_s > self.slow_call_seconds)
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                self._outcomes.clear()
+                if failed:
+                    self.state, self._opened_at = OPEN, self.clock()
+                else:
+                    self.state = CLOSED
+                return
+            if self.state == OPEN:
+                return # Stragglers admitted before the breaker opened must not extend or skew its window
+            self._outcomes.append(failed)
+            if len(self._outcomes) >= self.min_calls and \
+               sum(self._outcomes) / len(self._outcomes) >= self.failure_rate_threshold:
+                print(f"Circuit breaker opened after {sum(self._outcomes)} failures in {len(self._outcomes)} calls.")
+                self.state, self._opened_at = OPEN, self.clock()
+                self._outcomes.clear()
+
+    def release(self) -> None:
+        """Ends a call without an outcome, freeing the half-open probe slot if it held it."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self.state, "recent_calls": len(self._outcomes), "recent_failures": sum(self._outcomes)}
+
+
+class ModelRouter:
+    """
+    Routing policy shared by every OpenRouterClient in the process.
+      fallbacks - pipeline stage -> ordered backup models, tried after the requested model
+                  ("*" applies to every stage). Models whose breaker is open are skipped.
+      hedge     - when the current model has not answered by its recent p95 latency
+                  (hedge_quantile, once hedge_min_samples are known), the next model is
+                  fired too and the first usable answer wins. The slower call still
+                  completes and is billed.
+    """
+
+    def __init__(self,
+                 fallbacks: Optional[Dict[str, Sequence[str]]] = None,
+                 hedge: bool = False,
+                 hedge_quantile: float = 0.95,
+                 hedge_min_samples: int = 20,
+                 latency_window: int = 200,
+                 max_hedge_workers: int = 32,
+                 breaker_factory: Callable[[], CircuitBreaker] = CircuitBreaker):
+        self.fallbacks = {stage: list(models) for stage, models in (fallbacks or {}).items()}
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.latency_window = latency_window
+        self.max_hedge_workers = max_hedge_workers
+        self.breaker_factory = breaker_factory
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(model)
+            if breaker is None:
+                breaker = self._breakers[model] = self.breaker_factory()
+            return breaker
+
+    def _count(self, model: str, key: str) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(model, {"calls": 0, "failures": 0, "skipped_open": 0, "hedges": 0,
+                                                   "fallbacks": 0})
+            stats[key] += 1
+
+    def candidates(self, model: str, stage: str) -> List[str]:
+        """
+        The requested model, then the stage's fallbacks, without models whose breaker is open.
+        Empty when every one of them is open, so the call fails fast.
+        """
+        ordered = list(dict.fromkeys([model] + self.fallbacks.get(stage, []) + self.fallbacks.get("*", [])))
+        available = [candidate for candidate in ordered if self.breaker(candidate).available()]
+        for candidate in ordered:
+            if candidate not in available:
+                self._count(candidate, "skipped_open")
+        return available
+
+    def acquire(self, model: str, is_fallback: bool = False) -> bool:
+        if not self.breaker(model).allow():
+            self._count(model, "skipped_open")
+            return False
+        self._count(model, "calls")
+        if is_fallback:
+            self._count(model, "fallbacks")
+        return True
+
+    def record(self, model: str, success: bool, latency_s: float) -> None:
+        self.breaker(model).record(success, latency_s)
+        if success:
+            with self._lock:
+                self._latencies.setdefault(model, collections.deque(maxlen=self.latency_window)).append(latency_s)
+        else:
+            self._count(model, "failures")
+
+    def release(self, model: str) -> None:
+        """For calls that ended without saying anything about the model (e.g. a rejected API key)."""
+        self.breaker(model).release()
+
+    def latency_quantile(self, model: str, quantile: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._latencies.get(model, ()))
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[min(len(samples) - 1, math.ceil(quantile * len(samples)) - 1)]
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        if not self.hedge:
+            return None
+        return self.latency_quantile(model, self.hedge_quantile)
+
+    def note_hedge(self, model: str) -> None:
+        self._count(model, "hedges")
+
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_hedge_workers, thread_name_prefix="llm-hedge")
+            return self._executor
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            models = set(self._breakers) | set(self._stats)
+            stats = {model: dict(self._stats.get(model, {})) for model in models}
+        for model in models:
+            stats[model].update(self.breaker(model).get_stats())
+            stats[model]["p95_latency_s"] = self.latency_quantile(model, 0.95)
+        return stats
@@ -1,108 +1,158 @@
 
 import re
-from typing import Optional, List, Dict, Any
-from nltk.util import ngrams
-from nltk.tokenize import word_tokenize
+from typing import Optional, List, Dict, Any, Tuple
 from.openrouter_client import OpenRouterClient # Corrected import
-
-
-try:
-    from duckduckgo_search import DDGS
-except ImportError:
-    DDGS = None
-    print("Warning: duckduckgo-search library not found. Web cross-referencing will be skipped. Run 'pip install duckduckgo-search'")
+from.joke_corpus_index import NGramCorpusIndex
+from.embedding_index import EmbeddingCorpusIndex
+from.shared_assets import SharedAssets, default_shared_assets
+from.web_search import WebSearchService, default_web_search_service
+from.run_trace import record_trace, trace_component
+from.metrics import llm_stage
+
+SEMANTIC_SIMILARITY_THRESHOLD = 0.75 # Cosine similarity below this is treated as an unrelated joke
+# The same for every joke, so it leads the prompt and the joke follows as the user message.
+PERCEIVED_NOVELTY_SYSTEM_PROMPT = (
+    "Please evaluate the joke the user gives you for its perceived novelty and originality. "
+    "Does it feel like a fresh, creative joke, or does it seem like a common, recycled, or clichéd joke?\n\n"
+    "Provide a novelty score from 0.0 (very unoriginal, common) to 1.0 (highly original, fresh). "
+    "Output only the numerical score. For example: 0.7"
+)
 
 
 class NoveltyChecker:
-    def __init__(self, llm_client: OpenRouterClient, joke_corpus_path: Optional[str] = None): # joke_corpus_path is now unused but kept for signature consistency if ever needed
+    TRACE_COMPONENT = "novelty_checker_data"
+    TRACE_SECTIONS = ("novelty_checks",)
+
+    def __init__(self, llm_client: OpenRouterClient, joke_corpus_path: Optional[str] = None,
+                 embedding_model_name: Optional[str] = None,
+                 embedding_dtype: str = "float16",
+                 use_ann: Optional[bool] = None,
+                 web_search: Optional[WebSearchService] = None,
+                 shared_assets: Optional[SharedAssets] = None):
         self.llm_client = llm_client
-        self.known_jokes_corpus: List[str] = # No longer loading from file
-        self.transparency_data = {"novelty_checks":}
+        self.web_search = web_search or default_web_search_service()
+        self.joke_corpus_path = joke_corpus_path
+        self.embedding_model_name = embedding_model_name
+        self.embedding_dtype = embedding_dtype
+        self.use_ann = use_ann # None = approximate search only for corpora of ANN_MIN_CORPUS_SIZE or more
+        self.known_jokes_corpus: List[str] = [] # The corpus is queried through on-disk indexes, never loaded whole
+        self.shared_assets = shared_assets or default_shared_assets() # Indexes are loaded once per process, not per checker
 
        
 
-    def _preprocess_text(self, text: str) -> str:
+    @staticmethod
+    def _preprocess_text(text: str) -> str:
         text = text.lower()
         text = re.sub(r'[^\w\s]', '', text)
         text = re.sub(r'\s+', ' ', text).strip()
         return text
 
+    def _get_ngram_index(self, n: int) -> Optional[NGramCorpusIndex]:
+        if not self.joke_corpus_path:
+            return None
+        return self.shared_assets.ngram_index(self.joke_corpus_path, n, preprocess=self._preprocess_text)
+
     def check_n_gram_overlap(self, joke_text: str, n: int = 7) -> float:
         """
-        N-gram overlap is no longer used as we don't have a local corpus.
-        Returns 0.0 to indicate no overlap found with a (non-existent) local corpus.
+        Looks the joke's word n-grams up in the local corpus index (built from joke_corpus_path
+        on first use and persisted next to it).
+        Returns the largest fraction of the joke's n-grams shared with any single corpus joke:
+        0.0 = no overlap (or no corpus), 1.0 = every n-gram found in one known joke.
         [14, 15, 16, 17]
         """
-        # This method is effectively disabled without a local corpus.
-        # Returning 0.0 means it's considered "novel" by this specific check.
-        return 0.0 
+        index = self._get_ngram_index(n)
+        if index is None:
+            return 0.0
+        overlap, _ = index.query(joke_text)
+        return overlap
+
+    def _get_embedding_index(self, embedding_model_name: Optional[str]) -> Optional[Tuple[Any, EmbeddingCorpusIndex]]:
+        if not self.joke_corpus_path:
+            return None
+        return self.shared_assets.embedding_index(self.joke_corpus_path, embedding_model_name, self.embedding_dtype,
+                                                  self.use_ann, preprocess=self._preprocess_text)
+
+    def warm_up(self) -> Dict[str, float]:
+        """Loads the corpus indexes and embedder this checker uses now rather than on the first joke."""
+        return self.shared_assets.warm_up(self.joke_corpus_path, embedding_model_names=(self.embedding_model_name,),
+                                          embedding_dtype=self.embedding_dtype, use_ann=self.use_ann,
+                                          preprocess=self._preprocess_text)
+
+    def check_semantic_similarity_batch(self, joke_texts: List[str], embedding_model_name: Optional[str] = None) -> List[float]:
+        """
+        Embeds all jokes in one call and scores them against the precomputed corpus matrix
+        in one batched top-1 search. Returns each joke's highest cosine similarity to any
+        corpus joke (0.0 without a corpus). Higher = less novel.
+        [18, 19, 20, 21, 22]
+        """
+        loaded = self._get_embedding_index(embedding_model_name or self.embedding_model_name)
+        if loaded is None or not joke_texts:
+            return [0.0] * len(joke_texts)
+        embedder, index = loaded
+        if len(index) == 0:
+            return [0.0] * len(joke_texts)
+        queries = embedder(joke_texts)
+        use_ann = index.has_ann and (self.use_ann is not False)
+        best_scores, _ = index.top_k_ann(queries, k=1) if use_ann else index.top_k(queries, k=1)
+        return [max(0.0, float(score)) for score in best_scores[:, 0]]
 
     def check_semantic_similarity_with_corpus(self, joke_text: str, embedding_model_name: Optional[str] = None) -> float:
         """
-        Semantic similarity with a local corpus is no longer used.
-        Returns 0.0 to indicate no similarity found with a (non-existent) local corpus.
+        Highest cosine similarity between the joke and any corpus joke (0.0 without a corpus).
+        Prefer check_semantic_similarity_batch when scoring several jokes.
         [18, 19, 20, 21, 22]
         """
-        # This method is effectively disabled without a local corpus.
-        # Returning 0.0 means it's considered "novel" by this specific check.
-        return 0.0
-
-    def check_web_cross_reference(self, joke_text: str, max_results: int = 5) -> float:
+        return self.check_semantic_similarity_batch([joke_text], embedding_model_name)[0]
+
+    def _web_query(self, joke_text: str) -> str:
+        # Search for the punchline or a significant part of the joke
+        # A simple heuristic: take the last 10 words as a query, or the whole joke if short
+        query_words = joke_text.split()
+        if len(query_words) > 10:
+            query = " ".join(query_words[-10:])
+        else:
+            query = joke_text
+        return f'"{query}"' # Exact phrase search
+
+    def _score_web_results(self, results: Optional[List[Dict[str, Any]]]) -> Optional[float]:
+        if results is None:
+            return None # Search failed; callers must not read this as "not found"
+        if not results:
+            return 0.0 # Not found, high novelty
+
+        # Simple scoring: more results = less novel
+        # This is a basic heuristic and can be refined
+        if len(results) >= 3: # Found on multiple sites
+            return 1.0 # High penalty (widely found)
+        elif len(results) >= 1: # Found on at least one site
+            return 0.5 # Medium penalty
+        return 0.0 # Low penalty (few/no distinct results)
+
+    def check_web_cross_reference(self, joke_text: str, max_results: int = 5) -> Optional[float]:
         """
-        Checks if the joke is widely found online using DuckDuckGo.
-        Returns a penalty score: 0.0 if not found or few results, up to 1.0 if widely found.
+        Checks if the joke is widely found online using the configured search backend (DuckDuckGo by default).
+        Returns a penalty score: 0.0 if not found or few results, up to 1.0 if widely found,
+        or None if the search failed after retries.
         Higher score = LESS novel (more widely found).
+        Lookups go through the rate-limited, memoized WebSearchService, so concurrent calls
+        (the pipeline's evaluator makes one per candidate) share its rate limit and results.
         [23, 24]
         """
-        if DDGS is None:
-            print("Web cross-referencing skipped: duckduckgo-search library not available.")
+        if self.web_search is None:
+            print("Web cross-referencing skipped: no web search backend available.")
             return 0.0 # Assume novel if search can't be performed
+        return self._score_web_results(self.web_search.search(self._web_query(joke_text), max_results))
 
-        try:
-            # Search for the punchline or a significant part of the joke
-            # A simple heuristic: take the last 10 words as a query, or the whole joke if short
-            query_words = joke_text.split()
-            if len(query_words) > 10:
-                query = " ".join(query_words[-10:])
-            else:
-                query = joke_text
-            
-            # Using DDGS context manager for safety
-            with DDGS() as ddgs:
-                results = list(ddgs.text(f'"{query}"', max_results=max_results)) # Exact phrase search
-            
-            # print(f"Web search for '{query}' found {len(results)} results.")
-            
-            if not results:
-                return 0.0 # Not found, high novelty
-            
-            # Simple scoring: more results = less novel
-            # This is a basic heuristic and can be refined
-            if len(results) >= 3: # Found on multiple sites
-                return 1.0 # High penalty (widely found)
-            elif len(results) >= 1: # Found on at least one site
-                return 0.5 # Medium penalty
-            return 0.0 # Low penalty (few/no distinct results)
-
-        except Exception as e:
-            print(f"Error during web search cross-referencing: {e}")
-            return 0.2 # Default to a small penalty if search fails, to be conservative
-    
     def assess_perceived_novelty_with_llm(self, joke_text: str, judge_model_name: str) -> float:
         """
         Uses an LLM to give a subjective score for perceived novelty.
         Returns a score from 0.0 (not novel) to 1.0 (very novel).
         [25, 26, 27, 28, 19, 29]
         """
-        prompt_content = (
-            f"Please evaluate the following joke for its perceived novelty and originality. "
-            f"Does it feel like a fresh, creative joke, or does it seem like a common, recycled, or clichéd joke?\n\n"
-            f"Joke: \"{joke_text}\"\n\n"
-            f"Provide a novelty score from 0.0 (very unoriginal, common) to 1.0 (highly original, fresh). "
-            f"Output only the numerical score. For example: 0.7"
-        )
-        messages = [{"role": "user", "content": prompt_content}]
-        response = self.llm_client.get_completion(judge_model_name, messages, temperature=0.3, max_tokens=10)
+        messages = [{"role": "system", "content": PERCEIVED_NOVELTY_SYSTEM_PROMPT},
+                    {"role": "user", "content": f"Joke: \"{joke_text}\""}]
+        with llm_stage("novelty"):
+            response = self.llm_client.get_completion(judge_model_name, messages, temperature=0.3, max_tokens=10)
         if response:
             try:
                 score = float(response.strip())
@@ -112,44 +162,55 @@ class NoveltyChecker:
         return 0.5 
 
     def calculate_overall_novelty_score(self, joke_text: str, 
-                                        perceived_novelty_model_name: Optional[str] = None) -> Dict[str, float]:
+                                        perceived_novelty_model_name: Optional[str] = None,
+                                        precomputed_scores: Optional[Dict[str, Optional[float]]] = None) -> Dict[str, Optional[float]]:
         """
-        Calculates a composite novelty score, relying on web search and LLM perception.
+        Calculates a composite novelty score from local corpus overlap, web search and LLM perception.
         [30, 31, 25, 19]
         """
         scores = {
-            "n_gram_overlap_score": 0.0, # Unused
-            "semantic_similarity_corpus_score": 0.0, # Unused
-            "web_found_penalty_score": 0.0, # Higher = less novel (more found online)
+            "n_gram_overlap_score": 0.0, # Higher = less novel (shares n-grams with a known joke)
+            "semantic_similarity_corpus_score": 0.0, # Higher = less novel (close paraphrase of a known joke)
+            "web_found_penalty_score": 0.0, # Higher = less novel (more found online); None = search failed
             "perceived_novelty_llm_score": 0.5, # Higher = more novel
             "final_novelty_score": 0.5 # Higher = more novel
         }
 
-        # N-gram and semantic similarity with local corpus are now disabled
-        scores["n_gram_overlap_score"] = self.check_n_gram_overlap(joke_text) # Will be 0.0
-        scores["semantic_similarity_corpus_score"] = self.check_semantic_similarity_with_corpus(joke_text) # Will be 0.0
-        
-        scores["web_found_penalty_score"] = self.check_web_cross_reference(joke_text)
+        scores["n_gram_overlap_score"] = self.check_n_gram_overlap(joke_text) # 0.0 without a corpus
+        precomputed_scores = precomputed_scores or {}
+        if "semantic_similarity_corpus_score" in precomputed_scores:
+            scores["semantic_similarity_corpus_score"] = precomputed_scores["semantic_similarity_corpus_score"]
+        else:
+            scores["semantic_similarity_corpus_score"] = self.check_semantic_similarity_with_corpus(joke_text) # 0.0 without a corpus
+
+        if "web_found_penalty_score" in precomputed_scores:
+            scores["web_found_penalty_score"] = precomputed_scores["web_found_penalty_score"]
+        else:
+            scores["web_found_penalty_score"] = self.check_web_cross_reference(joke_text)
         
-        if perceived_novelty_model_name:
+        if "perceived_novelty_llm_score" in precomputed_scores:
+            scores["perceived_novelty_llm_score"] = precomputed_scores["perceived_novelty_llm_score"]
+        elif perceived_novelty_model_name:
             scores["perceived_novelty_llm_score"] = self.assess_perceived_novelty_with_llm(joke_text, perceived_novelty_model_name)
 
         # Combine scores:
         # Start with LLM's perceived novelty.
-        # Penalize heavily if found on the web.
-        # N-gram and semantic (corpus) scores will be 0, so they won't affect the calculation.
+        # Penalize heavily if found on the web or copied from the local corpus.
+        # Semantic similarity only counts above SEMANTIC_SIMILARITY_THRESHOLD.
         
         novelty_score = scores["perceived_novelty_llm_score"]
-        novelty_score -= scores["web_found_penalty_score"] * 0.7 # Strong penalty if widely found online
-        # The other scores (n_gram_overlap_score, semantic_similarity_corpus_score) are 0.0
-        # so their weighted subtraction won't change novelty_score here.
+        if scores["web_found_penalty_score"] is not None: # A failed search is unknown, not evidence either way
+            novelty_score -= scores["web_found_penalty_score"] * 0.7 # Strong penalty if widely found online
+        novelty_score -= scores["n_gram_overlap_score"] * 0.5 # Verbatim phrasing shared with a known joke
+        excess_similarity = max(0.0, scores["semantic_similarity_corpus_score"] - SEMANTIC_SIMILARITY_THRESHOLD)
+        novelty_score -= excess_similarity / (1.0 - SEMANTIC_SIMILARITY_THRESHOLD) * 0.5 # Reworded known joke
 
         scores["final_novelty_score"] = max(0.0, min(1.0, novelty_score))
         
-        self.transparency_data["novelty_checks"].append({
+        record_trace(self.TRACE_COMPONENT, "novelty_checks", {
             "joke_text": joke_text, "scores": scores.copy()
         })
         return scores
 
     def get_transparency_data(self) -> Dict:
-        return self.transparency_data
\ No newline at end of file
+        return trace_component(self.TRACE_COMPONENT, self.TRACE_SECTIONS)
\ No newline at end of file
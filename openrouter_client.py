@@ -1,27 +1,150 @@
 
+import asyncio
+import contextvars
+import email.utils
 import requests
 import json
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable
+from.completion_cache import CompletionCache
+from.metrics import record_llm_call, current_stage
+from.model_router import ModelRouter
+from.run_controller import RunDeadlineExceeded, current_time_left
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
 
 OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+DEFAULT_POOL_SIZE = 32
+DEFAULT_TIMEOUT: Tuple[float, float] = (5.0, 60.0) # (connect, read) seconds
+DEFAULT_CACHE_MAX_TEMPERATURE = 0.3 # Higher-temperature calls are meant to vary, so they skip the cache by default
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_MAX_RETRY_AFTER = 30.0 # Longest Retry-After (seconds) a request will wait out before giving up
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+# Providers that cache a prompt prefix only up to an explicit cache_control breakpoint. OpenAI,
+# DeepSeek and most others cache prefixes automatically and need no hint.
+CACHE_CONTROL_MODEL_PREFIXES = ("anthropic/", "google/gemini")
+
+_shared_sessions: Dict[int, requests.Session] = {}
+_shared_sessions_lock = threading.Lock()
+
+
+def create_pooled_session(pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_shared_session(pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """
+    Returns a process-wide keep-alive session with a connection pool of `pool_size`.
+    Sessions are shared per pool size so every client (and every request) reuses
+    warm TCP/TLS connections instead of handshaking per completion.
+    """
+    with _shared_sessions_lock:
+        session = _shared_sessions.get(pool_size)
+        if session is None:
+            session = create_pooled_session(pool_size)
+            _shared_sessions[pool_size] = session
+        return session
+
+
+def _error_status(error: BaseException) -> Tuple[Optional[int], Dict[str, str]]:
+    """HTTP status and headers of a failed request (requests or aiohttp), or (None, {})."""
+    response = getattr(error, "response", None)
+    if response is not None and getattr(response, "status_code", None) is not None:
+        return response.status_code, dict(response.headers)
+    status = getattr(error, "status", None)
+    if isinstance(status, int):
+        return status, dict(getattr(error, "headers", None) or {})
+    return None, {}
+
+
+def _retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _cut_by_deadline(error: BaseException) -> bool:
+    """Failed because the run's deadline passed (or cut its timeout short), not because of the model."""
+    time_left = current_time_left()
+    return isinstance(error, RunDeadlineExceeded) or (time_left is not None and time_left <= 0)
+
+
+def _is_client_error(error: BaseException) -> bool:
+    """A 4xx the caller caused (bad key, bad request): says nothing about the model's health."""
+    status, _ = _error_status(error)
+    return status is not None and 400 <= status < 500 and status not in RETRYABLE_STATUSES
+
 
 class OpenRouterClient:
-    def __init__(self, api_key: str):
+    def __init__(self,
+                 api_key: str,
+                 pool_size: int = DEFAULT_POOL_SIZE,
+                 timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+                 session: Optional[requests.Session] = None,
+                 api_url: str = OPENROUTER_API_URL,
+                 cache: Optional[CompletionCache] = None,
+                 cache_max_temperature: float = DEFAULT_CACHE_MAX_TEMPERATURE,
+                 router: Optional[ModelRouter] = None,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 max_retry_after: float = DEFAULT_MAX_RETRY_AFTER,
+                 prompt_cache_hints: bool = False,
+                 cache_control_models: Tuple[str, ...] = CACHE_CONTROL_MODEL_PREFIXES):
         if not api_key:
             raise ValueError("OpenRouter API key is required.")
         self.api_key = api_key
-        self.site_url = "YOUR_SITE_URL_HERE" 
-        self.site_name = "JokeBot" 
+        self.site_url = "YOUR_SITE_URL_HERE"
+        self.site_name = "JokeBot"
+        self.api_url = api_url
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.session = session or get_shared_session(pool_size)
+        self.cache = cache
+        self.cache_max_temperature = cache_max_temperature
+        self.router = router
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.prompt_cache_hints = prompt_cache_hints
+        self.cache_control_models = tuple(cache_control_models)
 
-    def _make_request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
-        headers = {
+    def _headers(self) -> Dict[str, str]:
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
-            "HTTP-Referer": self.site_url, 
-            "X-Title": self.site_name,      
+            "HTTP-Referer": self.site_url,
+            "X-Title": self.site_name,
         }
+
+    def _request_timeout(self) -> Tuple[float, float]:
+        """self.timeout, cut down to the time left before the current run's deadline."""
+        time_left = current_time_left()
+        if time_left is None:
+            return self.timeout
+        time_left = max(time_left, 0.001)
+        return min(self.timeout[0], time_left), min(self.timeout[1], time_left)
+
+    def _make_request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = None
         try:
-            response = requests.post(OPENROUTER_API_URL, headers=headers, data=json.dumps(payload))
+            response = self.session.post(self.api_url, headers=self._headers(), data=json.dumps(payload),
+                                         timeout=self._request_timeout())
             response.raise_for_status()
             return response.json()
         except requests.exceptions.HTTPError as http_err:
@@ -34,30 +157,509 @@ class OpenRouterClient:
             print(f"Failed to decode JSON response: {response.text}")
             raise
 
-    def get_completion(self,
+    def _timed_request(self, payload: Dict[str, Any], retries: int = 0) -> Dict[str, Any]:
+        """_make_request, with latency, token usage and cost recorded under the current stage."""
+        start = time.perf_counter()
+        try:
+            response_data = self._make_request(payload)
+        except Exception:
+            record_llm_call(payload["model"], "error", time.perf_counter() - start, retries=retries)
+            raise
+        record_llm_call(payload["model"], "ok", time.perf_counter() - start, (response_data or {}).get("usage"), retries)
+        return response_data
+
+    def _retry_delay(self, error: BaseException, attempt: int, max_retries: int) -> Optional[float]:
+        """Seconds to wait before retrying after error, or None if it should not be retried."""
+        if attempt >= max_retries:
+            return None
+        status, headers = _error_status(error)
+        if status is None:
+            if isinstance(error, (ValueError, KeyError, TypeError)): # Undecodable reply; retrying won't help
+                return None
+            return 0.5 * 2 ** attempt # Connection reset, timeout
+        if status not in RETRYABLE_STATUSES:
+            return None
+        retry_after = _retry_after_seconds(headers.get("Retry-After") or headers.get("retry-after"))
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_retry_after else None
+        return 0.5 * 2 ** attempt
+
+    def _with_cache_hints(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        With prompt_cache_hints, marks the end of the last system message as a cache_control
+        breakpoint for models in cache_control_models, so the static prefix before it
+        (instructions, rubric) is cached by the provider. Applied per routed model, after
+        the completion cache key was taken.
+        """
+        if not self.prompt_cache_hints or not payload["model"].startswith(self.cache_control_models):
+            return payload
+        messages = list(payload["messages"])
+        system_indices = [index for index, message in enumerate(messages)
+                          if message["role"] == "system" and isinstance(message["content"], str)]
+        if not system_indices:
+            return payload
+        message = messages[system_indices[-1]]
+        messages[system_indices[-1]] = dict(message, content=[
+            {"type": "text", "text": message["content"], "cache_control": {"type": "ephemeral"}}
+        ])
+        return dict(payload, messages=messages)
+
+    def _retry_delay_within_deadline(self, error: BaseException, attempt: int, max_retries: int) -> Optional[float]:
+        """_retry_delay, or None when the retry could not start before the current run's deadline."""
+        delay = self._retry_delay(error, attempt, max_retries)
+        time_left = current_time_left()
+        if delay is not None and time_left is not None and delay >= time_left:
+            return None
+        return delay
+
+    @staticmethod
+    def _check_deadline() -> None:
+        time_left = current_time_left()
+        if time_left is not None and time_left <= 0:
+            raise RunDeadlineExceeded("Run deadline reached")
+
+    def _send(self, payload: Dict[str, Any], max_retries: Optional[int] = None) -> Dict[str, Any]:
+        """
+        One logical request: retried on 408/429/5xx and connection errors, honoring Retry-After.
+        During a run with a deadline, the request times out and stops retrying at the deadline.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        payload = self._with_cache_hints(payload)
+        attempt = 0
+        while True:
+            self._check_deadline()
+            try:
+                return self._timed_request(payload, retries=int(attempt > 0))
+            except Exception as e:
+                delay = self._retry_delay_within_deadline(e, attempt, max_retries)
+                if delay is None:
+                    raise
+                print(f"Retrying {payload['model']} in {delay:.1f}s after: {e}")
+                time.sleep(delay)
+                attempt += 1
+
+    def _route(self, model_name: str, attempt: Callable[[str, int], Any]) -> Any:
+        """
+        Runs attempt(model, max_retries) for model_name and, with a router, its fallbacks:
+        each model is tried in turn (hedged when the router says so) until one returns
+        something truthy. Retries are only spent on the last candidate; before that a
+        failure moves straight on to the next model. Exceptions count as a failed attempt.
+        """
+        if self.router is None:
+            return self._attempt(model_name, attempt, self.max_retries)
+        candidates = self.router.candidates(model_name, current_stage())
+        if self.router.hedge and len(candidates) > 1:
+            return self._route_hedged(candidates, attempt)
+        for index, model in enumerate(candidates):
+            if self.router.acquire(model, is_fallback=index > 0):
+                result = self._attempt(model, attempt, self.max_retries if index == len(candidates) - 1 else 0)
+                if result:
+                    return result
+        return None
+
+    def _attempt(self, model: str, attempt: Callable[[str, int], Any], max_retries: int) -> Any:
+        start = time.perf_counter()
+        try:
+            result = attempt(model, max_retries)
+        except Exception as e:
+            print(f"Error in completion for model {model}: {e}")
+            if self.router is not None:
+                if _is_client_error(e) or _cut_by_deadline(e):
+                    self.router.release(model)
+                else:
+                    self.router.record(model, False, time.perf_counter() - start)
+            return None
+        if self.router is not None:
+            self.router.record(model, bool(result), time.perf_counter() - start)
+        return result
+
+    def _route_hedged(self, candidates: List[str], attempt: Callable[[str, int], Any]) -> Any:
+        executor = self.router.executor()
+        pending = list(enumerate(candidates))
+        running: Dict[Future, str] = {}
+        retries_for = lambda index: self.max_retries if index == len(candidates) - 1 else 0
+        while pending or running:
+            if not running:
+                index, model = pending.pop(0)
+                if self.router.acquire(model, is_fallback=index > 0):
+                    running[executor.submit(contextvars.copy_context().run, self._attempt, model, attempt,
+                                            retries_for(index))] = model
+                continue
+            delay = self.router.hedge_delay(next(iter(running.values()))) if pending and len(running) == 1 else None
+            done, _ = wait(running, timeout=delay, return_when=FIRST_COMPLETED)
+            if not done: # The in-flight call is slower than its usual p95: fire the next model too
+                index, model = pending.pop(0)
+                if self.router.acquire(model, is_fallback=True):
+                    self.router.note_hedge(model)
+                    running[executor.submit(contextvars.copy_context().run, self._attempt, model, attempt,
+                                            retries_for(index))] = model
+                continue
+            for future in done:
+                del running[future]
+                result = future.result()
+                if result:
+                    return result # Any slower call still in flight finishes in the background
+        return None
+
+    def _build_payload(self,
                        model_name: str,
-                       messages: List],
-                       temperature: float = 0.7,
-                       max_tokens: int = 500,
-                       response_format: Optional] = None) -> Optional[str]:
+                       messages: List[Dict[str, str]],
+                       temperature: float,
+                       max_tokens: int,
+                       response_format: Optional[Dict[str, str]],
+                       n: int = 1) -> Dict[str, Any]:
         payload = {
             "model": model_name,
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens,
+            "usage": {"include": True}, # Ask OpenRouter to report token counts and cost
         }
         if response_format:
             payload["response_format"] = response_format
+        if n > 1:
+            payload["n"] = n
+        return payload
 
-        try:
-            response_data = self._make_request(payload)
-            if response_data and "choices" in response_data and len(response_data["choices"]) > 0:
-                choice = response_data["choices"]
-                if "message" in choice and "content" in choice["message"]:
-                    return choice["message"]["content"].strip()
-                elif "delta" in choice and "content" in choice["delta"]: # For streaming
-                    return choice["delta"]["content"].strip()
+    @staticmethod
+    def _extract_content(response_data: Dict[str, Any]) -> Optional[str]:
+        if response_data and "choices" in response_data and len(response_data["choices"]) > 0:
+            choice = response_data["choices"][0]
+            if "message" in choice and "content" in choice["message"]:
+                return choice["message"]["content"].strip()
+            elif "delta" in choice and "content" in choice["delta"]: # For streaming
+                return choice["delta"]["content"].strip()
+        return None
+
+    @staticmethod
+    def _extract_choices(response_data: Dict[str, Any]) -> List[str]:
+        """The non-empty message contents of every choice, in choice order."""
+        contents = []
+        for choice in (response_data or {}).get("choices") or []:
+            content = (choice.get("message") or {}).get("content")
+            if content and content.strip():
+                contents.append(content.strip())
+        return contents
+
+    def _cache_key(self, payload: Dict[str, Any], use_cache: Optional[bool]) -> Optional[str]:
+        """
+        Returns the cache key for payload, or None if this call must not be cached.
+        use_cache=None caches only calls at or below cache_max_temperature; True/False force it.
+        """
+        if self.cache is None or use_cache is False:
+            return None
+        if use_cache is None and payload["temperature"] > self.cache_max_temperature:
             return None
+        return self.cache.make_key(payload)
+
+    def get_completion(self,
+                       model_name: str,
+                       messages: List[Dict[str, str]],
+                       temperature: float = 0.7,
+                       max_tokens: int = 500,
+                       response_format: Optional[Dict[str, str]] = None,
+                       use_cache: Optional[bool] = None) -> Optional[str]:
+        """
+        The reply to messages from model_name, or None if it (and, with a router, every
+        fallback model for the current stage) failed. Only model_name's replies are cached.
+        """
+        payload = self._build_payload(model_name, messages, temperature, max_tokens, response_format)
+        cache_key = self._cache_key(payload, use_cache)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                record_llm_call(model_name, "cache_hit", 0.0)
+                return self._extract_content(cached)
+
+        def attempt(model: str, max_retries: int) -> Optional[str]:
+            response_data = self._send(dict(payload, model=model), max_retries)
+            content = self._extract_content(response_data)
+            if cache_key and content and model == model_name:
+                self.cache.put(cache_key, response_data)
+            return content
+
+        return self._route(model_name, attempt)
+
+    def get_completions(self,
+                        model_name: str,
+                        messages: List[Dict[str, str]],
+                        n: int,
+                        temperature: float = 0.7,
+                        max_tokens: int = 500,
+                        response_format: Optional[Dict[str, str]] = None,
+                        use_cache: Optional[bool] = None) -> List[str]:
+        """
+        Up to n sampled completions of one prompt, requested as a single call with n choices
+        so the prompt is sent (and billed) once. Providers that ignore n return fewer
+        choices; the shortfall is topped up with further requests, at most n in total.
+        """
+        payload = self._build_payload(model_name, messages, temperature, max_tokens, response_format, n=n)
+        cache_key = self._cache_key(payload, use_cache)
+        cached = self.cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            record_llm_call(model_name, "cache_hit", 0.0)
+            contents = self._extract_choices(cached)[:n]
+            if len(contents) >= n:
+                return contents
+
+        def attempt(model: str, max_retries: int) -> List[str]:
+            contents: List[str] = []
+            for _ in range(n):
+                request_payload = self._build_payload(model, messages, temperature, max_tokens, response_format,
+                                                      n=n - len(contents))
+                try:
+                    response_data = self._send(request_payload, max_retries)
+                except Exception as e:
+                    if not contents:
+                        raise
+                    print(f"Error topping up completions for model {model}: {e}")
+                    break
+                choices = self._extract_choices(response_data)
+                if cache_key and choices and not contents and model == model_name:
+                    self.cache.put(cache_key, response_data)
+                if not choices:
+                    break
+                contents.extend(choices)
+                if len(contents) >= n:
+                    break
+            return contents[:n]
+
+        return self._route(model_name, attempt) or []
+
+
+class AsyncOpenRouterClient(OpenRouterClient):
+    """
+    aiohttp-backed client. `get_completion_async` is the native entry point; the
+    inherited synchronous `get_completion` is served from a private event loop thread,
+    so PlanSearcherForJokes, LLMJudge and NoveltyChecker can use it unchanged while
+    all of their calls share one pooled, keep-alive connector.
+    """
+
+    def __init__(self,
+                 api_key: str,
+                 pool_size: int = DEFAULT_POOL_SIZE,
+                 timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+                 api_url: str = OPENROUTER_API_URL,
+                 cache: Optional[CompletionCache] = None,
+                 cache_max_temperature: float = DEFAULT_CACHE_MAX_TEMPERATURE,
+                 router: Optional[ModelRouter] = None,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 max_retry_after: float = DEFAULT_MAX_RETRY_AFTER,
+                 prompt_cache_hints: bool = False,
+                 cache_control_models: Tuple[str, ...] = CACHE_CONTROL_MODEL_PREFIXES):
+        if aiohttp is None:
+            raise ImportError("AsyncOpenRouterClient requires aiohttp. Run 'pip install aiohttp'")
+        super().__init__(api_key, pool_size=pool_size, timeout=timeout, api_url=api_url,
+                         cache=cache, cache_max_temperature=cache_max_temperature, router=router,
+                         max_retries=max_retries, max_retry_after=max_retry_after,
+                         prompt_cache_hints=prompt_cache_hints, cache_control_models=cache_control_models)
+        self._async_sessions: Dict[asyncio.AbstractEventLoop, "aiohttp.ClientSession"] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, name="openrouter-async", daemon=True)
+                self._loop_thread.start()
+            return self._loop
+
+    def _get_async_session(self) -> "aiohttp.ClientSession":
+        # aiohttp sessions are bound to the loop they were created on.
+        loop = asyncio.get_running_loop()
+        session = self._async_sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            client_timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+            session = aiohttp.ClientSession(connector=connector, timeout=client_timeout)
+            self._async_sessions[loop] = session
+        return session
+
+    async def _make_request_async(self, payload: Dict[str, Any],
+                                  timeout: Optional[Tuple[float, float]] = None) -> Dict[str, Any]:
+        session = self._get_async_session()
+        connect_timeout, read_timeout = timeout or self._request_timeout()
+        try:
+            async with session.post(self.api_url, headers=self._headers(), data=json.dumps(payload),
+                                    timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                                                  sock_read=read_timeout)) as response:
+                text = await response.text()
+                if response.status >= 400:
+                    print(f"HTTP error occurred: {response.status} - {text}")
+                    response.raise_for_status()
+                return json.loads(text)
+        except aiohttp.ClientError as req_err:
+            print(f"Request exception occurred: {req_err}")
+            raise
+        except json.JSONDecodeError:
+            print(f"Failed to decode JSON response: {text}")
+            raise
+
+    async def _timed_request_async(self, payload: Dict[str, Any], retries: int = 0) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            response_data = await self._make_request_async(payload)
+        except Exception:
+            record_llm_call(payload["model"], "error", time.perf_counter() - start, retries=retries)
+            raise
+        record_llm_call(payload["model"], "ok", time.perf_counter() - start, (response_data or {}).get("usage"), retries)
+        return response_data
+
+    async def _send_async(self, payload: Dict[str, Any], max_retries: Optional[int] = None) -> Dict[str, Any]:
+        max_retries = self.max_retries if max_retries is None else max_retries
+        payload = self._with_cache_hints(payload)
+        attempt = 0
+        while True:
+            self._check_deadline()
+            try:
+                return await self._timed_request_async(payload, retries=int(attempt > 0))
+            except Exception as e:
+                delay = self._retry_delay_within_deadline(e, attempt, max_retries)
+                if delay is None:
+                    raise
+                print(f"Retrying {payload['model']} in {delay:.1f}s after: {e}")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _attempt_async(self, model: str, attempt: Callable[[str, int], Awaitable[Any]], max_retries: int) -> Any:
+        start = time.perf_counter()
+        try:
+            result = await attempt(model, max_retries)
         except Exception as e:
-            print(f"Error in get_completion for model {model_name}: {e}")
-            return None
\ No newline at end of file
+            print(f"Error in async completion for model {model}: {e}")
+            if self.router is not None:
+                if _is_client_error(e) or _cut_by_deadline(e):
+                    self.router.release(model)
+                else:
+                    self.router.record(model, False, time.perf_counter() - start)
+            return None
+        if self.router is not None:
+            self.router.record(model, bool(result), time.perf_counter() - start)
+        return result
+
+    async def _route_async(self, model_name: str, attempt: Callable[[str, int], Awaitable[Any]]) -> Any:
+        """Async counterpart of _route; hedged calls are concurrent tasks on the caller's loop."""
+        if self.router is None:
+            return await self._attempt_async(model_name, attempt, self.max_retries)
+        candidates = self.router.candidates(model_name, current_stage())
+        pending = list(enumerate(candidates))
+        running: Dict["asyncio.Task", str] = {}
+        retries_for = lambda index: self.max_retries if index == len(candidates) - 1 else 0
+        try:
+            while pending or running:
+                if not running:
+                    index, model = pending.pop(0)
+                    if self.router.acquire(model, is_fallback=index > 0):
+                        running[asyncio.ensure_future(self._attempt_async(model, attempt, retries_for(index)))] = model
+                    continue
+                delay = self.router.hedge_delay(next(iter(running.values()))) \
+                    if pending and len(running) == 1 else None
+                done, _ = await asyncio.wait(running, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    index, model = pending.pop(0)
+                    if self.router.acquire(model, is_fallback=True):
+                        self.router.note_hedge(model)
+                        running[asyncio.ensure_future(self._attempt_async(model, attempt, retries_for(index)))] = model
+                    continue
+                for task in done:
+                    del running[task]
+                    result = task.result()
+                    if result:
+                        return result
+            return None
+        finally:
+            for task in running: # Unlike the threaded path, a losing hedge can simply be cancelled
+                task.cancel()
+
+    def _make_request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        # The loop thread does not see this thread's run deadline, so its timeout is worked out here.
+        future = asyncio.run_coroutine_threadsafe(self._make_request_async(payload, self._request_timeout()),
+                                                  self._ensure_loop())
+        return future.result()
+
+    async def get_completion_async(self,
+                                   model_name: str,
+                                   messages: List[Dict[str, str]],
+                                   temperature: float = 0.7,
+                                   max_tokens: int = 500,
+                                   response_format: Optional[Dict[str, str]] = None,
+                                   use_cache: Optional[bool] = None) -> Optional[str]:
+        payload = self._build_payload(model_name, messages, temperature, max_tokens, response_format)
+        cache_key = self._cache_key(payload, use_cache)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                record_llm_call(model_name, "cache_hit", 0.0)
+                return self._extract_content(cached)
+
+        async def attempt(model: str, max_retries: int) -> Optional[str]:
+            response_data = await self._send_async(dict(payload, model=model), max_retries)
+            content = self._extract_content(response_data)
+            if cache_key and content and model == model_name:
+                self.cache.put(cache_key, response_data)
+            return content
+
+        return await self._route_async(model_name, attempt)
+
+    async def get_completions_async(self,
+                                    model_name: str,
+                                    messages: List[Dict[str, str]],
+                                    n: int,
+                                    temperature: float = 0.7,
+                                    max_tokens: int = 500,
+                                    response_format: Optional[Dict[str, str]] = None,
+                                    use_cache: Optional[bool] = None) -> List[str]:
+        """Async counterpart of get_completions."""
+        payload = self._build_payload(model_name, messages, temperature, max_tokens, response_format, n=n)
+        cache_key = self._cache_key(payload, use_cache)
+        cached = self.cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            record_llm_call(model_name, "cache_hit", 0.0)
+            contents = self._extract_choices(cached)[:n]
+            if len(contents) >= n:
+                return contents
+
+        async def attempt(model: str, max_retries: int) -> List[str]:
+            contents: List[str] = []
+            for _ in range(n):
+                request_payload = self._build_payload(model, messages, temperature, max_tokens, response_format,
+                                                      n=n - len(contents))
+                try:
+                    response_data = await self._send_async(request_payload, max_retries)
+                except Exception as e:
+                    if not contents:
+                        raise
+                    print(f"Error topping up completions for model {model}: {e}")
+                    break
+                choices = self._extract_choices(response_data)
+                if cache_key and choices and not contents and model == model_name:
+                    self.cache.put(cache_key, response_data)
+                if not choices:
+                    break
+                contents.extend(choices)
+                if len(contents) >= n:
+                    break
+            return contents[:n]
+
+        return await self._route_async(model_name, attempt) or []
+
+    async def aclose(self) -> None:
+        loop = asyncio.get_running_loop()
+        session = self._async_sessions.pop(loop, None)
+        if session is not None:
+            await session.close()
+
+    def close(self) -> None:
+        if self._loop is None:
+            return
+        for loop, session in list(self._async_sessions.items()):
+            if loop is self._loop:
+                asyncio.run_coroutine_threadsafe(session.close(), self._loop).result()
+                del self._async_sessions[loop]
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop.close()
+        self._loop = None
+        self._loop_thread = None
@@ -0,0 +1,135 @@
+
+import json
+import math
+import re
+import threading
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+# complete(model_name, messages, temperature, max_tokens) -> response text or None
+CompletionFn = Callable[[str, List[Dict[str, str]], float, int], Optional[str]]
+PlanItem = Tuple[Tuple[str, ...], str] # (observation combo, plan)
+# Sent ahead of the topic and plans so every scoring call shares it as a cacheable prefix.
+PLAN_SCORING_SYSTEM_PROMPT = (
+    "The user gives you a topic and numbered candidate joke plans. "
+    "Rate how likely each plan is to produce a funny, original joke, from 1 (weak) to 10 (excellent). "
+    "Respond only with JSON of the form {\"scores\": [{\"plan_id\": \"P1\", \"score\": <1-10>}, ...]}."
+)
+
+
+def normalize_plan(plan: str) -> str:
+    text = re.sub(r"^\s*plan\s*:\s*", "", plan.lower())
+    text = re.sub(r"[^\w\s]", "", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _features(normalized: str) -> FrozenSet[str]:
+    tokens = normalized.split()
+    return frozenset(tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])])
+
+
+class PlanPruner:
+    """
+    Filters joke plans before the expensive instantiation / critique / refinement chain.
+    PLANSEARCH drafts the plans it would have developed anyway (max_keep of them); plans
+    that normalize to the same text, or whose unigram+bigram Jaccard similarity to an
+    earlier plan reaches similarity_threshold (cosine, with an embedder), are dropped.
+    The survivors are optionally rated in one call to a small scoring_model, and only the
+    best keep_ratio of the drafts go on. calls_saved is net of the scoring calls.
+    Counters are cumulative.
+    """
+
+    def __init__(self,
+                 keep_ratio: float = 0.5,
+                 similarity_threshold: float = 0.8,
+                 scoring_model: Optional[str] = None,
+                 embedder: Optional[Callable[[List[str]], Any]] = None):
+        if not 0 < keep_ratio <= 1:
+            raise ValueError("keep_ratio must be in (0, 1]")
+        self.keep_ratio = keep_ratio
+        self.similarity_threshold = similarity_threshold
+        self.scoring_model = scoring_model
+        self.embedder = embedder
+        self._lock = threading.Lock()
+        self.stats = {"plans_seen": 0, "duplicates_pruned": 0, "low_score_pruned": 0,
+                      "scoring_calls": 0, "calls_saved": 0}
+
+    def dedupe(self, items: List[PlanItem]) -> Tuple[List[PlanItem], List[PlanItem]]:
+        """Returns (kept, duplicates); the first of each group of near-identical plans is kept."""
+        normalized = [normalize_plan(plan) for _, plan in items]
+        if self.embedder is not None and items:
+            vectors = self.embedder(normalized)
+            similarity = lambda i, j: float(vectors[i] @ vectors[j])
+        else:
+            features = [_features(text) for text in normalized]
+            similarity = lambda i, j: len(features[i] & features[j]) / len(features[i] | features[j]) \
+                if features[i] | features[j] else 1.0
+        kept_indices: List[int] = []
+        duplicates: List[PlanItem] = []
+        seen_texts = set()
+        for index, item in enumerate(items):
+            if normalized[index] in seen_texts or \
+               any(similarity(index, other) >= self.similarity_threshold for other in kept_indices):
+                duplicates.append(item)
+                continue
+            seen_texts.add(normalized[index])
+            kept_indices.append(index)
+        return [items[index] for index in kept_indices], duplicates
+
+    def _score(self, topic: str, items: List[PlanItem], complete: CompletionFn) -> Optional[List[float]]:
+        plans_str = "\n".join(f"[P{position + 1}] {plan}" for position, (_, plan) in enumerate(items))
+        messages = [{"role": "system", "content": PLAN_SCORING_SYSTEM_PROMPT},
+                    {"role": "user", "content": f"Topic: '{topic}'\nCandidate joke plans:\n{plans_str}"}]
+        with self._lock:
+            self.stats["scoring_calls"] += 1
+        response = complete(self.scoring_model, messages, 0.0, 20 + 15 * len(items))
+        if not response:
+            return None
+        try:
+            entries = json.loads(response).get("scores", [])
+            by_id = {str(entry["plan_id"]).strip("[] "): float(entry["score"]) for entry in entries}
+        except (json.JSONDecodeError, AttributeError, KeyError, TypeError, ValueError):
+            print(f"Plan scoring response was not valid JSON: {response}")
+            return None
+        return [by_id.get(f"P{position + 1}", 0.0) for position in range(len(items))]
+
+    def prune(self,
+              topic: str,
+              items: List[PlanItem],
+              max_keep: int,
+              complete: CompletionFn,
+              calls_per_plan: int) -> Tuple[List[PlanItem], Dict[str, Any]]:
+        """
+        Returns the plans to develop, in their original order, and a record of the decision.
+        calls_per_plan is what developing one drafted plan would have cost; calls_saved is the
+        calls not spent on dropped plans, minus the scoring call.
+        """
+        kept, duplicates = self.dedupe(items)
+        keep = min(max_keep, max(1, math.floor(len(items) * self.keep_ratio))) if items else 0
+        scores = None
+        scoring_calls = 0
+        if self.scoring_model and len(kept) > keep:
+            scores = self._score(topic, kept, complete)
+            scoring_calls = 1
+        if scores is not None:
+            ranked = sorted(range(len(kept)), key=lambda index: -scores[index]) # Stable on ties
+            survivors = sorted(ranked[:keep])
+        else:
+            survivors = list(range(min(keep, len(kept)))) # Unscored: earliest (highest scheduled) plans first
+        selected = [kept[index] for index in survivors]
+        low_score = len(kept) - len(selected)
+        calls_saved = (len(duplicates) + low_score) * calls_per_plan - scoring_calls
+        with self._lock:
+            self.stats["plans_seen"] += len(items)
+            self.stats["duplicates_pruned"] += len(duplicates)
+            self.stats["low_score_pruned"] += low_score
+            self.stats["calls_saved"] += calls_saved
+        decision = {
+            "topic": topic, "plans_drafted": len(items), "duplicates_pruned": len(duplicates),
+            "low_score_pruned": low_score, "kept_plans": [plan for _, plan in selected],
+            "scores": scores, "calls_saved": calls_saved
+        }
+        return selected, decision
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats)
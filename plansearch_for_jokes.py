@@ -1,110 +1,331 @@
 
-from typing import List, Dict, Any, Optional, Set, Tuple
+from typing import List, Dict, Any, Iterable, Optional, Set, Tuple, Callable
+import contextvars
 import itertools
+import math
+from concurrent.futures import ThreadPoolExecutor
 from.openrouter_client import OpenRouterClient # Corrected import
+from.progress_events import ProgressCallback, emit_progress
+from.run_trace import record_trace, trace_component
+from.call_budget import CallBudget, estimate_tokens
+from.combination_scheduler import CombinationScheduler
+from.plan_pruner import PlanPruner
+from.metrics import llm_stage
+from.topic_memo import TopicMemoStore
+
+# When set, transparency records from the current task are buffered here and merged
+# into the run trace by the coordinating thread in candidate order.
+_transparency_buffer: contextvars.ContextVar[Optional[Dict[str, List[Dict[str, Any]]]]] = \
+    contextvars.ContextVar("plansearch_transparency_buffer", default=None)
+# LLM call/token budget of the run_plansearch call executing in this context, if any.
+_call_budget: contextvars.ContextVar[Optional[CallBudget]] = contextvars.ContextVar("plansearch_call_budget", default=None)
+# Cross-run memo of observations and plans used by the run_plansearch call executing in this context, if any.
+_topic_memo: contextvars.ContextVar[Optional[TopicMemoStore]] = contextvars.ContextVar("plansearch_topic_memo", default=None)
+
+# Each stage's instructions are fixed, so they are sent as the system message ahead of the variable
+# topic, observations, plan and joke: every call of a stage then starts with the same prefix, which
+# providers serve from their prompt cache. The user messages put the run-wide topic first.
+OBSERVATIONS_SYSTEM_PROMPT = (
+    "For the topic the user gives you, brainstorm a diverse list of associated concepts, facts, stereotypes, "
+    "common sayings, potential ambiguities, and inherent comedic elements. "
+    "Think about what makes the topic potentially funny (e.g., irony, absurdity, wordplay opportunities). "
+    "List each observation on a new line."
+)
+DERIVED_OBSERVATIONS_SYSTEM_PROMPT = (
+    "The user gives you a topic and some initial observations about it. "
+    "Brainstorm several new, non-obvious, and potentially humorous derivative observations or concepts "
+    "that build upon or combine these existing observations. Focus on finding unique angles, "
+    "contrasts, or absurdities related to the topic. List each new observation on a new line."
+)
+PLAN_SYSTEM_PROMPT = (
+    "The user gives you a topic and key observations or elements to incorporate. "
+    "Based on these observations, devise a high-level plan or comedic strategy for a joke. "
+    "Describe the intended structure (e.g., setup-punchline, pun-based, observational, character-based) "
+    "and the core humorous mechanism. Be specific but concise. For example: "
+    "'Plan: Setup a common scenario involving the topic, then introduce an unexpected twist based on "
+    "one of the observations for the punchline, aiming for surprise.'"
+)
+JOKE_SYSTEM_PROMPT = (
+    "The user gives you a topic and a joke plan. Based on this plan, write a complete, funny joke. "
+    "The joke should be well-structured and deliver a clear punchline. "
+    "Focus on originality and cleverness."
+)
+REFINEMENT_SYSTEM_PROMPT = (
+    "The user gives you a topic, the original plan for a joke and a critique of a previous attempt at it. "
+    "Based on the plan and addressing the critique, generate a new, improved, and funny joke. "
+    "Ensure the joke is coherent and directly implements the core idea of the plan while learning from the critique."
+)
+CRITIQUE_SYSTEM_PROMPT = (
+    "The user gives you a joke plan and a joke generated from it. "
+    "Critically evaluate this joke based on the provided plan. Is it funny? Original? Does it effectively implement the plan? "
+    "Provide specific, constructive criticism. For example, 'The setup is good, but the punchline is predictable. "
+    "It could be funnier if it subverted expectations more related to [aspect of plan].'"
+)
+
 
 class PlanSearcherForJokes:
-    def __init__(self, llm_client: OpenRouterClient):
+    TRACE_COMPONENT = "plansearch_data"
+    TRACE_SECTIONS = ("observations", "plans", "jokes_generated")
+
+    def __init__(self, llm_client: OpenRouterClient, max_concurrency: int = 4, samples_per_plan: int = 1):
         self.llm_client = llm_client
-        self.transparency_data = {"observations":, "plans":, "jokes_generated":}
+        self.max_concurrency = max(1, max_concurrency)
+        self.samples_per_plan = max(1, samples_per_plan)
+
+    def _record(self, section: str, entry: Dict[str, Any]) -> None:
+        buffer = _transparency_buffer.get()
+        if buffer is not None:
+            buffer.setdefault(section, []).append(entry)
+        else:
+            record_trace(self.TRACE_COMPONENT, section, entry)
+
+    def _run_buffered(self, fn: Callable[..., Any], *args: Any) -> Tuple[Any, Dict[str, List[Dict[str, Any]]]]:
+        # Runs inside a per-task copy of the submitting thread's context (see _collect_in_order).
+        buffer: Dict[str, List[Dict[str, Any]]] = {}
+        _transparency_buffer.set(buffer)
+        return fn(*args), buffer
+
+    def _complete(self, model_name: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int,
+                  stage: Optional[str] = None) -> Optional[str]:
+        budget = _call_budget.get()
+        if budget is not None:
+            prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+            if not budget.try_spend(prompt_tokens + max_tokens):
+                return None
+        if stage is None: # Callers such as PlanPruner set the stage themselves
+            return self.llm_client.get_completion(model_name, messages, temperature=temperature, max_tokens=max_tokens)
+        with llm_stage(stage):
+            return self.llm_client.get_completion(model_name, messages, temperature=temperature, max_tokens=max_tokens)
+
+    def _complete_many(self, model_name: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int,
+                       n: int, stage: str) -> List[str]:
+        """n samples of one prompt in a single multi-choice request (one call, prompt billed once)."""
+        get_completions = getattr(self.llm_client, "get_completions", None)
+        calls = 1 if get_completions is not None else n
+        budget = _call_budget.get()
+        if budget is not None:
+            prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+            if not budget.try_spend(prompt_tokens * calls + max_tokens * n, calls=calls):
+                return []
+        with llm_stage(stage):
+            if get_completions is None: # Clients without multi-choice support
+                completions = [self.llm_client.get_completion(model_name, messages, temperature=temperature, max_tokens=max_tokens)
+                               for _ in range(n)]
+                return [completion for completion in completions if completion]
+            return get_completions(model_name, messages, n, temperature=temperature, max_tokens=max_tokens)
+
+    def _collect_in_order(self,
+                          executor: ThreadPoolExecutor,
+                          fn: Callable[[Any], Any],
+                          items: Iterable[Any],
+                          target: int,
+                          accept: Callable[[Any], bool] = bool,
+                          max_wave: Optional[int] = None) -> List[Tuple[Any, Any]]:
+        """
+        Runs fn over items concurrently until `target` accepted results are collected or
+        the call budget runs out. Work is submitted in waves sized to the remaining target,
+        and results (and their transparency records) are consumed in item order, so the
+        outcome matches a serial walk over items that stops once the target is reached.
+        items may be a lazy iterator (e.g. a CombinationScheduler schedule); it is only
+        advanced when a wave is submitted, and max_wave caps waves so that feedback from
+        finished work can steer what the iterator yields next.
+        """
+        results: List[Tuple[Any, Any]] = []
+        items = iter(items)
+        budget = _call_budget.get()
+        while len(results) < target and not (budget is not None and budget.exhausted()):
+            wave = list(itertools.islice(items, min(target - len(results), max_wave or target)))
+            if not wave:
+                break
+            futures = [executor.submit(contextvars.copy_context().run, self._run_buffered, fn, item) for item in wave]
+            for item, future in zip(wave, futures):
+                result, buffer = future.result()
+                for section, entries in buffer.items():
+                    for entry in entries:
+                        record_trace(self.TRACE_COMPONENT, section, entry)
+                if accept(result):
+                    results.append((item, result))
+        return results
 
 
     def _prompt_for_observations(self, topic: str, model_name: str, existing_observations: Optional[List[str]] = None) -> List[str]:
         
         if existing_observations:
-            prompt_content = (
-                f"Given the topic '{topic}' and the following initial observations:\n"
-                f"{'\n'.join([f'- {obs}' for obs in existing_observations])}\n\n"
-                f"Brainstorm several new, non-obvious, and potentially humorous derivative observations or concepts "
-                f"that build upon or combine these existing observations. Focus on finding unique angles, "
-                f"contrasts, or absurdities related to '{topic}'. List each new observation on a new line."
-            )
+            existing_str = "\n".join([f"- {obs}" for obs in existing_observations])
+            messages = [{"role": "system", "content": DERIVED_OBSERVATIONS_SYSTEM_PROMPT},
+                        {"role": "user", "content": f"Topic: '{topic}'\nInitial observations:\n{existing_str}"}]
         else:
-            prompt_content = (
-                f"For the topic '{topic}', brainstorm a diverse list of associated concepts, facts, stereotypes, "
-                f"common sayings, potential ambiguities, and inherent comedic elements. "
-                f"Think about what makes '{topic}' potentially funny (e.g., irony, absurdity, wordplay opportunities). "
-                f"List each observation on a new line."
-            )
-        
-        messages = [{"role": "user", "content": prompt_content}]
-        response = self.llm_client.get_completion(model_name, messages, temperature=0.8, max_tokens=300)
+            messages = [{"role": "system", "content": OBSERVATIONS_SYSTEM_PROMPT},
+                        {"role": "user", "content": f"Topic: '{topic}'"}]
+
+        response = self._complete(model_name, messages, temperature=0.8, max_tokens=300, stage="observations")
         if response:
             obs_list = [obs.strip() for obs in response.split('\n') if obs.strip()]
-            self.transparency_data["observations"].append({
+            self._record("observations", {
                 "topic": topic, "existing_observations": existing_observations, "generated_observations": obs_list
             })
             return obs_list
-        return
+        return []
+
+    def _first_order_observations(self, topic: str, model_name: str, count: int) -> List[str]:
+        """count first-order observations, mixing memoized ones with fresh ones when a topic memo is bound."""
+        memo = _topic_memo.get()
+        if memo is None:
+            return self._prompt_for_observations(topic, model_name)[:count]
+        fresh_count = memo.fresh_count(topic, model_name, count)
+        fresh: List[str] = []
+        if fresh_count:
+            generated = self._prompt_for_observations(topic, model_name)
+            known = set(memo.observations(topic, model_name))
+            fresh = [obs for obs in generated if obs not in known][:fresh_count]
+            memo.add_observations(topic, model_name, generated, used=fresh)
+        reused = memo.take_observations(topic, model_name, count - len(fresh), exclude=fresh)
+        if reused:
+            self._record("observations", {"topic": topic, "existing_observations": None,
+                                          "generated_observations": reused, "memoized": True})
+        return reused + fresh # Memoized core first, so the earliest combinations are the memoized ones
+
+    def _derived_observations(self, topic: str, model_name: str, combo: Tuple[str, ...]) -> List[str]:
+        memo = _topic_memo.get()
+        derived = memo.get_derived(topic, model_name, combo) if memo is not None else None
+        if derived is not None:
+            self._record("observations", {"topic": topic, "existing_observations": list(combo),
+                                          "generated_observations": derived, "memoized": True})
+            return derived
+        derived = self._prompt_for_observations(topic, model_name, existing_observations=list(combo))
+        if memo is not None and derived:
+            memo.put_derived(topic, model_name, combo, derived)
+        return derived
 
-    def _generate_observation_combinations(self, observations: List[str], max_subset_size: int = 2) -> List]:
+    def _generate_observation_combinations(self, observations: List[str], max_subset_size: int = 2) -> List[Tuple[str, ...]]:
        
-        combinations =
+        combinations = []
         for i in range(1, max_subset_size + 1):
             for subset in itertools.combinations(observations, i):
                 combinations.append(subset)
         return combinations
 
     def _prompt_for_joke_plan(self, topic: str, observation_combo: Tuple[str,...], model_name: str) -> Optional[str]:
-        
+        memo = _topic_memo.get()
+        if memo is not None:
+            plan = memo.get_plan(topic, model_name, observation_combo)
+            if plan:
+                self._record("plans", {
+                    "topic": topic, "observation_combo": observation_combo, "generated_plan": plan, "memoized": True
+                })
+                return plan
+
         observations_str = "\n".join([f"- {obs}" for obs in observation_combo])
-        prompt_content = (
-            f"Topic: '{topic}'\n"
-            f"Key Observations/Elements to incorporate:\n{observations_str}\n\n"
-            f"Based on these observations, devise a high-level plan or comedic strategy for a joke. "
-            f"Describe the intended structure (e.g., setup-punchline, pun-based, observational, character-based) "
-            f"and the core humorous mechanism. Be specific but concise. For example: "
-            f"'Plan: Setup a common scenario involving {topic}, then introduce an unexpected twist based on "
-            f"[{', '.join(observation_combo[:1]) if observation_combo else 'a key observation'}] for the punchline, "
-            f"aiming for surprise.'"
-        )
-        messages = [{"role": "user", "content": prompt_content}]
-        plan = self.llm_client.get_completion(model_name, messages, temperature=0.7, max_tokens=150)
+        messages = [{"role": "system", "content": PLAN_SYSTEM_PROMPT},
+                    {"role": "user", "content": f"Topic: '{topic}'\nKey Observations/Elements to incorporate:\n{observations_str}"}]
+        plan = self._complete(model_name, messages, temperature=0.7, max_tokens=150, stage="plan")
+        if plan and memo is not None:
+            memo.put_plan(topic, model_name, observation_combo, plan)
         if plan:
-            self.transparency_data["plans"].append({
+            self._record("plans", {
                 "topic": topic, "observation_combo": observation_combo, "generated_plan": plan
             })
         return plan
 
     def _prompt_for_joke_instantiation(self, topic: str, plan: str, model_name: str, critique: Optional[str] = None) -> Optional[str]:
+        jokes = self._prompt_for_joke_instantiations(topic, plan, model_name, 1, critique)
+        return jokes[0] if jokes else None
+
+    def _prompt_for_joke_instantiations(self, topic: str, plan: str, model_name: str, samples: int,
+                                        critique: Optional[str] = None) -> List[str]:
        
         if critique:
-            prompt_content = (
-                f"Topic: '{topic}'\n"
-                f"Original Joke Plan: {plan}\n"
-                f"Critique of previous attempt: {critique}\n\n"
-                f"Based on the plan and addressing the critique, generate a new, improved, and funny joke. "
-                f"Ensure the joke is coherent and directly implements the core idea of the plan while learning from the critique."
-            )
+            messages = [{"role": "system", "content": REFINEMENT_SYSTEM_PROMPT},
+                        {"role": "user", "content": f"Topic: '{topic}'\nOriginal Joke Plan: {plan}\nCritique of previous attempt: {critique}"}]
         else:
-            prompt_content = (
-                f"Topic: '{topic}'\n"
-                f"Joke Plan: {plan}\n\n"
-                f"Based on this plan, write a complete, funny joke. "
-                f"The joke should be well-structured and deliver a clear punchline. "
-                f"Focus on originality and cleverness."
-            )
-        messages = [{"role": "user", "content": prompt_content}]
-        joke = self.llm_client.get_completion(model_name, messages, temperature=0.9, max_tokens=200)
-        if joke:
-             self.transparency_data["jokes_generated"].append({
-                "topic": topic, "plan": plan, "critique": critique, "joke": joke
+            messages = [{"role": "system", "content": JOKE_SYSTEM_PROMPT},
+                        {"role": "user", "content": f"Topic: '{topic}'\nJoke Plan: {plan}"}]
+        stage = "refinement" if critique else "joke"
+        if samples > 1:
+            jokes = list(dict.fromkeys(self._complete_many(model_name, messages, temperature=0.9, max_tokens=200, n=samples,
+                                                           stage=stage)))
+        else:
+            joke = self._complete(model_name, messages, temperature=0.9, max_tokens=200, stage=stage)
+            jokes = [joke] if joke else []
+        for sample_index, joke in enumerate(jokes):
+             self._record("jokes_generated", {
+                "topic": topic, "plan": plan, "critique": critique, "joke": joke, "sample_index": sample_index
             })
-        return joke
+        return jokes
 
     def _prompt_for_critique(self, joke: str, plan: str, model_name: str) -> Optional[str]:
         
-        prompt_content = (
-            f"Joke Plan: {plan}\n"
-            f"Generated Joke: \"{joke}\"\n\n"
-            f"Critically evaluate this joke based on the provided plan. Is it funny? Original? Does it effectively implement the plan? "
-            f"Provide specific, constructive criticism. For example, 'The setup is good, but the punchline is predictable. "
-            f"It could be funnier if it subverted expectations more related to [aspect of plan].'"
-        )
-        messages = [{"role": "user", "content": prompt_content}]
-        critique = self.llm_client.get_completion(model_name, messages, temperature=0.6, max_tokens=150)
+        messages = [{"role": "system", "content": CRITIQUE_SYSTEM_PROMPT},
+                    {"role": "user", "content": f"Joke Plan: {plan}\nGenerated Joke: \"{joke}\""}]
+        critique = self._complete(model_name, messages, temperature=0.6, max_tokens=150, stage="critique")
         return critique
 
+    def _develop_plan(self,
+                      topic: str,
+                      obs_combo_for_plan: Tuple[str, ...],
+                      plan_model: str,
+                      joke_model: str,
+                      critique_model: Optional[str],
+                      use_critique_refinement: bool,
+                      on_candidate: Optional[Callable[[Dict[str, Any]], None]] = None,
+                      progress_callback: Optional[ProgressCallback] = None,
+                      samples_per_plan: int = 1) -> Optional[List[Dict[str, Any]]]:
+        """
+        Runs the plan -> instantiation -> critique -> refinement chain for one observation combo.
+        Returns None if no plan was produced, otherwise the (possibly empty) list of candidates.
+        Each candidate is also handed to on_candidate as soon as it exists.
+        """
+        plan = self._prompt_for_joke_plan(topic, obs_combo_for_plan, plan_model)
+        if not plan:
+            return None
+        return self._instantiate_plan(topic, obs_combo_for_plan, plan, joke_model, critique_model,
+                                      use_critique_refinement, on_candidate, progress_callback, samples_per_plan)
+
+    def _instantiate_plan(self,
+                          topic: str,
+                          obs_combo_for_plan: Tuple[str, ...],
+                          plan: str,
+                          joke_model: str,
+                          critique_model: Optional[str],
+                          use_critique_refinement: bool,
+                          on_candidate: Optional[Callable[[Dict[str, Any]], None]] = None,
+                          progress_callback: Optional[ProgressCallback] = None,
+                          samples_per_plan: int = 1) -> List[Dict[str, Any]]:
+        """
+        The instantiation -> critique -> refinement part of _develop_plan, for an existing plan.
+        With samples_per_plan > 1 the plan is instantiated that many times in one multi-choice
+        request; every sample is a candidate, and the first one is critiqued and refined.
+        """
+        emit_progress(progress_callback, "plan", {"observation_combo": list(obs_combo_for_plan), "plan": plan})
+
+        candidates: List[Dict[str, Any]] = []
+
+        def emit(candidate: Dict[str, Any]) -> None:
+            candidates.append(candidate)
+            emit_progress(progress_callback, "candidate", {
+                "joke_text": candidate["joke_text"], "plan": plan, "refined": candidate["refined"]
+            })
+            if on_candidate:
+                on_candidate(candidate)
+
+        jokes = self._prompt_for_joke_instantiations(topic, plan, joke_model, samples_per_plan)
+        for sample_index, sample in enumerate(jokes):
+            emit({
+                "joke_text": sample, "plan": plan, "observations_used": obs_combo_for_plan, "refined": False,
+                "sample_index": sample_index
+            })
+        if jokes:
+            joke = jokes[0]
+            if use_critique_refinement and critique_model:
+                critique = self._prompt_for_critique(joke, plan, critique_model)
+                if critique:
+                    refined_joke = self._prompt_for_joke_instantiation(topic, plan, joke_model, critique=critique)
+                    if refined_joke and refined_joke != joke:
+                        emit({
+                            "joke_text": refined_joke, "plan": plan, "observations_used": obs_combo_for_plan, "refined": True, "critique": critique
+                        })
+        return candidates
+
     def run_plansearch(self,
                        topic: str,
                        observation_model: str,
@@ -114,71 +335,142 @@ class PlanSearcherForJokes:
                        num_first_order_obs: int = 5,
                        num_second_order_obs_per_combo: int = 2, # Reduced for speed
                        max_plans_to_develop: int = 5,      # Reduced for speed
-                       use_critique_refinement: bool = True) -> List]:
-        self.transparency_data = {"observations":, "plans":, "jokes_generated":} # Reset for new run
+                       use_critique_refinement: bool = True,
+                       max_concurrency: Optional[int] = None,
+                       on_candidate: Optional[Callable[[Dict[str, Any]], None]] = None,
+                       progress_callback: Optional[ProgressCallback] = None,
+                       combination_scheduler: Optional[CombinationScheduler] = None,
+                       budget: Optional[CallBudget] = None,
+                       max_subset_size: int = 2,
+                       plan_pruner: Optional[PlanPruner] = None,
+                       samples_per_plan: Optional[int] = None,
+                       topic_memo: Optional[TopicMemoStore] = None) -> List[Dict[str, Any]]:
+        """
+        Returns the candidate jokes in deterministic source order. If on_candidate is given it is
+        called (from worker threads) with each candidate the moment it is produced, so callers
+        can start evaluating before the search finishes. Every candidate passed to on_candidate
+        is also in the returned list. progress_callback receives "observations",
+        "second_order_observations", "plan" and "candidate" events as they happen.
+
+        With a combination_scheduler, observation subsets are tried best-first (see
+        CombinationScheduler) rather than in itertools order, and generated lazily. With a
+        budget, every PLANSEARCH LLM call is charged to it and the search stops when it runs out.
+        With a plan_pruner, plans are drafted first and only those that survive deduplication
+        and scoring (see PlanPruner) are instantiated and critiqued.
+        With a topic_memo, observations, derived observations and plans memoized by earlier
+        runs on the same topic and models are reused instead of regenerated, and new ones are
+        added to it (see TopicMemoStore for the freshness mix).
+        """
+        # The budget and memo are bound in a private copy of the context, which the worker tasks inherit.
+        context = contextvars.copy_context()
+        context.run(_call_budget.set, budget)
+        context.run(_topic_memo.set, topic_memo)
+        return context.run(self._search, topic, observation_model, plan_model, joke_model, critique_model,
+                           num_first_order_obs, num_second_order_obs_per_combo, max_plans_to_develop,
+                           use_critique_refinement, max_concurrency, on_candidate, progress_callback,
+                           combination_scheduler, max_subset_size, plan_pruner,
+                           max(1, samples_per_plan or self.samples_per_plan))
+
+    def _search(self,
+                topic: str,
+                observation_model: str,
+                plan_model: str,
+                joke_model: str,
+                critique_model: Optional[str],
+                num_first_order_obs: int,
+                num_second_order_obs_per_combo: int,
+                max_plans_to_develop: int,
+                use_critique_refinement: bool,
+                max_concurrency: Optional[int],
+                on_candidate: Optional[Callable[[Dict[str, Any]], None]],
+                progress_callback: Optional[ProgressCallback],
+                combination_scheduler: Optional[CombinationScheduler],
+                max_subset_size: int,
+                plan_pruner: Optional[PlanPruner],
+                samples_per_plan: int) -> List[Dict[str, Any]]:
         print(f"Starting PLANSEARCH for topic: {topic}")
-        candidate_jokes_details =
+        candidate_jokes_details = []
 
-        first_order_obs = self._prompt_for_observations(topic, observation_model)
+        first_order_obs = self._first_order_observations(topic, observation_model, num_first_order_obs)
         if not first_order_obs:
             print("Failed to generate first-order observations.")
-            return
-        first_order_obs = first_order_obs[:num_first_order_obs]
+            return []
         print(f"Generated {len(first_order_obs)} first-order observations.")
+        emit_progress(progress_callback, "observations", {"observations": first_order_obs})
 
         all_observations_set: Set[str] = set(first_order_obs)
         
-        first_order_combinations = self._generate_observation_combinations(first_order_obs, max_subset_size=2)
-        second_order_obs_sources =
+        if combination_scheduler is not None:
+            first_order_combinations = combination_scheduler.schedule(first_order_obs, max_subset_size)
+        else:
+            first_order_combinations = self._generate_observation_combinations(first_order_obs, max_subset_size=max_subset_size)
+        workers = max(1, max_concurrency or self.max_concurrency)
 
-        for i, combo in enumerate(first_order_combinations):
-            if len(second_order_obs_sources) >= max_plans_to_develop * 1.5: # Limit calls
-                break
-            
-            derived_obs_list = self._prompt_for_observations(topic, observation_model, existing_observations=list(combo))
-            if derived_obs_list:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="plansearch") as executor:
+            # Second-order observation prompts are independent of each other, so they fan out.
+            derived_results = self._collect_in_order(
+                executor,
+                lambda combo: self._derived_observations(topic, observation_model, combo),
+                first_order_combinations,
+                target=math.ceil(max_plans_to_develop * 1.5) # Limit calls
+            )
+            second_order_obs_sources = []
+            for combo, derived_obs_list in derived_results:
                 derived_obs_list = derived_obs_list[:num_second_order_obs_per_combo]
                 second_order_obs_sources.append({'source_combo': combo, 'derived': derived_obs_list})
                 all_observations_set.update(derived_obs_list)
-        
-        print(f"Total unique observations collected: {len(all_observations_set)}")
 
-        plan_candidates_sources = first_order_combinations + \
-                                  [tuple(obs_item['derived']) for obs_item in second_order_obs_sources if obs_item['derived']]
-        
-        developed_plans_count = 0
-        for i, obs_combo_for_plan in enumerate(plan_candidates_sources):
-            if developed_plans_count >= max_plans_to_develop:
-                break
-            if not obs_combo_for_plan: continue
-
-           
-            plan = self._prompt_for_joke_plan(topic, obs_combo_for_plan, plan_model)
-            if not plan:
-                continue
-            
-            developed_plans_count += 1
-           
-
-            joke = self._prompt_for_joke_instantiation(topic, plan, joke_model)
-            if joke:
-                candidate_jokes_details.append({
-                    "joke_text": joke, "plan": plan, "observations_used": obs_combo_for_plan, "refined": False
-                })
-                
-                if use_critique_refinement and critique_model:
-                    critique = self._prompt_for_critique(joke, plan, critique_model)
-                    if critique:
-                        # print(f"Critique: {critique}")
-                        refined_joke = self._prompt_for_joke_instantiation(topic, plan, joke_model, critique=critique)
-                        if refined_joke and refined_joke!= joke:
-                            candidate_jokes_details.append({
-                                "joke_text": refined_joke, "plan": plan, "observations_used": obs_combo_for_plan, "refined": True, "critique": critique
-                            })
-                            
+            print(f"Total unique observations collected: {len(all_observations_set)}")
+            emit_progress(progress_callback, "second_order_observations", {
+                "sources": [{"source_combo": list(item["source_combo"]), "derived": item["derived"]} for item in second_order_obs_sources]
+            })
+
+            derived_combos = [tuple(obs_item['derived']) for obs_item in second_order_obs_sources if obs_item['derived']]
+            if combination_scheduler is not None:
+                plan_candidates_sources = combination_scheduler.schedule(first_order_obs, max_subset_size, extra_combos=derived_combos)
+            else:
+                plan_candidates_sources = [combo for combo in first_order_combinations + derived_combos if combo]
+
+            if plan_pruner is not None:
+                # Draft the plans that would have been developed, then spend the expensive chain
+                # only on the ones worth developing.
+                drafted = self._collect_in_order(
+                    executor,
+                    lambda combo: self._prompt_for_joke_plan(topic, combo, plan_model),
+                    plan_candidates_sources,
+                    target=max_plans_to_develop
+                )
+                calls_per_plan = 1 + (2 if use_critique_refinement and critique_model else 0)
+                with llm_stage("plan_scoring"):
+                    selected, decision = plan_pruner.prune(topic, drafted, max_plans_to_develop, self._complete, calls_per_plan)
+                self._record("plan_pruning", decision)
+                print(f"Plan pruning kept {len(selected)} of {len(drafted)} plans, saving {decision['calls_saved']} calls.")
+                developed = self._collect_in_order(
+                    executor,
+                    lambda item: self._instantiate_plan(topic, item[0], item[1], joke_model, critique_model,
+                                                        use_critique_refinement, on_candidate, progress_callback,
+                                                        samples_per_plan),
+                    selected,
+                    target=len(selected),
+                    accept=lambda candidates: True
+                )
+            else:
+                # Each plan's develop/critique/refine chain is an independent task.
+                developed = self._collect_in_order(
+                    executor,
+                    lambda combo: self._develop_plan(topic, combo, plan_model, joke_model,
+                                                     critique_model, use_critique_refinement, on_candidate,
+                                                     progress_callback, samples_per_plan),
+                    plan_candidates_sources,
+                    target=max_plans_to_develop,
+                    accept=lambda candidates: candidates is not None,
+                    max_wave=workers if combination_scheduler is not None and combination_scheduler.bandit_weight else None
+                )
+            for _, candidates in developed:
+                candidate_jokes_details.extend(candidates)
         
         print(f"PLANSEARCH finished. Generated {len(candidate_jokes_details)} candidate jokes.")
         return candidate_jokes_details
 
     def get_transparency_data(self) -> Dict:
-        return self.transparency_data
\ No newline at end of file
+        return trace_component(self.TRACE_COMPONENT, self.TRACE_SECTIONS)
\ No newline at end of file
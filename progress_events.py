@@ -0,0 +1,22 @@
+
+from typing import Any, Callable, Dict, Optional
+
+# Called as callback(event_type, data) from whichever thread produced the event;
+# data must be JSON-serializable.
+ProgressCallback = Callable[[str, Dict[str, Any]], None]
+
+
+class RunCancelled(Exception):
+    """Raised from a progress callback to abort the run that emitted the event."""
+
+
+def emit_progress(callback: Optional[ProgressCallback], event_type: str, data: Dict[str, Any]) -> None:
+    if callback is None:
+        return
+    try:
+        callback(event_type, data)
+    except RunCancelled:
+        raise
+    except Exception as e:
+        # A broken listener must never take the pipeline down with it.
+        print(f"Progress callback failed for event '{event_type}': {e}")
@@ -0,0 +1,261 @@
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from.metrics import current_stage
+from.openrouter_client import DEFAULT_POOL_SIZE
+from.web_search import SearchBackend
+
+LLM = "llm"
+SEARCH = "search"
+_REPLAYED_HEADERS = ("Retry-After",) # Response headers the client acts on; nothing else is kept
+_BATCH_ITEM = re.compile(r"^\[[A-Z]\d+\]", re.MULTILINE) # [J1], [P2], ... items of a batched prompt
+
+
+def request_key(request: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(request, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def _llm_shape(payload: Dict[str, Any], stage: str) -> str:
+    """
+    What a replay miss may fall back on: same model, stage, kind of request and system
+    prompt, with as many batch items, but any variable text. A single-joke judge call
+    then never gets a batch's reply, nor a batch of three one recorded for five.
+    """
+    messages = payload.get("messages") or []
+    system = json.dumps([message.get("content") for message in messages if message.get("role") == "system"],
+                        sort_keys=True)
+    variable = "".join(message["content"] if isinstance(message.get("content"), str) else json.dumps(message.get("content"))
+                       for message in messages if message.get("role") != "system")
+    return (f"{payload.get('model')}|{stage}|{payload.get('n', 1)}|{bool(payload.get('response_format'))}|"
+            f"{hashlib.sha256(system.encode('utf-8')).hexdigest()[:16]}|{len(_BATCH_ITEM.findall(variable))}")
+
+
+class TranscriptRecorder:
+    """
+    Appends every LLM and web-search exchange to a JSON-lines transcript as it happens.
+    Request bodies and replies are stored; credentials and other headers are not.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = 0
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, request: Dict[str, Any], latency_s: float, shape: Optional[str] = None,
+               **outcome: Any) -> None:
+        line = json.dumps(dict(outcome, kind=kind, key=request_key(request), shape=shape, request=request,
+                               latency_s=round(latency_s, 6)), default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self.records += 1
+
+
+class TranscriptReplayer:
+    """
+    Serves recorded exchanges back in recording order. A request is matched exactly (same
+    canonical request body); repeats of one request cycle through its recorded replies.
+    On a miss an LLM request takes the next reply recorded for the same model, pipeline
+    stage, request kind, system prompt and number of batch items (prompts shift when e.g.
+    judge batches are composed differently), unless strict, in which case it gets a 404 and search returns no results.
+    Each reply is delayed by its recorded latency times latency_scale, or by
+    fixed_latency_s when given.
+    """
+
+    def __init__(self,
+                 path: str,
+                 latency_scale: float = 1.0,
+                 fixed_latency_s: Optional[float] = None,
+                 strict: bool = False):
+        self.path = path
+        self.latency_scale = latency_scale
+        self.fixed_latency_s = fixed_latency_s
+        self.strict = strict
+        self._exact: Dict[Tuple[str, str], Deque[Dict[str, Any]]] = {}
+        self._shapes: Dict[Tuple[str, str], Deque[Dict[str, Any]]] = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._exact.setdefault((record["kind"], record["key"]), deque()).append(record)
+                    if record.get("shape"):
+                        self._shapes.setdefault((record["kind"], record["shape"]), deque()).append(record)
+        self._lock = threading.Lock()
+        self._in_flight = {LLM: 0, SEARCH: 0}
+        self.stats = {kind: {"exact": 0, "approximate": 0, "misses": 0, "peak_in_flight": 0, "busy_seconds": 0.0}
+                      for kind in (LLM, SEARCH)}
+
+    @staticmethod
+    def _next(records: Optional[Deque[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        if not records:
+            return None
+        record = records[0]
+        records.rotate(-1)
+        return record
+
+    def lookup(self, kind: str, request: Dict[str, Any], shape: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._next(self._exact.get((kind, request_key(request))))
+            match = "exact"
+            if record is None and shape is not None and not self.strict:
+                record, match = self._next(self._shapes.get((kind, shape))), "approximate"
+            self.stats[kind][match if record is not None else "misses"] += 1
+        return record
+
+    def replay_delay(self, record: Optional[Dict[str, Any]]) -> None:
+        if self.fixed_latency_s is not None:
+            delay = self.fixed_latency_s
+        else:
+            delay = (record or {}).get("latency_s", 0.0) * self.latency_scale
+        if delay > 0:
+            time.sleep(delay)
+
+    def begin(self, kind: str) -> float:
+        with self._lock:
+            self._in_flight[kind] += 1
+            self.stats[kind]["peak_in_flight"] = max(self.stats[kind]["peak_in_flight"], self._in_flight[kind])
+        return time.perf_counter()
+
+    def end(self, kind: str, started: float) -> None:
+        with self._lock:
+            self._in_flight[kind] -= 1
+            self.stats[kind]["busy_seconds"] += time.perf_counter() - started
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {kind: dict(stats) for kind, stats in self.stats.items()}
+
+
+def _payload(request: requests.PreparedRequest) -> Dict[str, Any]:
+    body = request.body or b"{}"
+    return json.loads(body.decode("utf-8") if isinstance(body, bytes) else body)
+
+
+class RecordingHTTPAdapter(HTTPAdapter):
+    """Pooled adapter that sends OpenRouter requests for real and records each exchange."""
+
+    def __init__(self, recorder: TranscriptRecorder, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.recorder = recorder
+
+    def send(self, request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:
+        payload = _payload(request)
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except requests.exceptions.RequestException as e:
+            self.recorder.record(LLM, payload, time.perf_counter() - start, _llm_shape(payload, current_stage()),
+                                 error=f"{type(e).__name__}: {e}")
+            raise
+        try:
+            body: Any = response.json()
+        except ValueError:
+            body = response.text
+        headers = {name: response.headers[name] for name in _REPLAYED_HEADERS if name in response.headers}
+        self.recorder.record(LLM, payload, time.perf_counter() - start, _llm_shape(payload, current_stage()),
+                             status=response.status_code, headers=headers, body=body)
+        return response
+
+
+class ReplayHTTPAdapter(BaseAdapter):
+    """Answers OpenRouter requests from a transcript without touching the network."""
+
+    def __init__(self, replayer: TranscriptReplayer):
+        super().__init__()
+        self.replayer = replayer
+
+    def send(self, request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:
+        payload = _payload(request)
+        started = self.replayer.begin(LLM)
+        try:
+            record = self.replayer.lookup(LLM, payload, _llm_shape(payload, current_stage()))
+            self.replayer.replay_delay(record)
+        finally:
+            self.replayer.end(LLM, started)
+        if record is not None and "error" in record:
+            raise requests.exceptions.ConnectionError(f"Replayed: {record['error']}", request=request)
+
+        response = requests.Response()
+        if record is None:
+            response.status_code, body, headers = 404, {"error": {"message": "No recorded reply for this request"}}, {}
+        else:
+            response.status_code, body, headers = record["status"], record["body"], record.get("headers") or {}
+        response._content = (json.dumps(body) if not isinstance(body, str) else body).encode("utf-8")
+        response.headers = CaseInsensitiveDict(dict(headers, **{"Content-Type": "application/json"}))
+        response.encoding = "utf-8"
+        response.reason = "Replayed"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+def _session(adapter: BaseAdapter) -> requests.Session:
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def recording_session(recorder: TranscriptRecorder, pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """A session for OpenRouterClient(session=...) that records every call it makes."""
+    return _session(RecordingHTTPAdapter(recorder, pool_connections=4, pool_maxsize=pool_size))
+
+
+def replay_session(replayer: TranscriptReplayer) -> requests.Session:
+    """A session for OpenRouterClient(session=...) served entirely from a transcript."""
+    return _session(ReplayHTTPAdapter(replayer))
+
+
+class RecordingSearchBackend(SearchBackend):
+    """Wraps a live backend (DDGS by default in the app) and records each query and its results."""
+
+    def __init__(self, backend: SearchBackend, recorder: TranscriptRecorder):
+        self.backend = backend
+        self.recorder = recorder
+        self.name = f"recording:{backend.name}"
+
+    def search(self, query: str, max_results: int) -> List[Dict[str, Any]]:
+        request = {"query": query, "max_results": max_results}
+        start = time.perf_counter()
+        try:
+            results = self.backend.search(query, max_results)
+        except Exception as e:
+            self.recorder.record(SEARCH, request, time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+            raise
+        self.recorder.record(SEARCH, request, time.perf_counter() - start, results=results)
+        return results
+
+
+class ReplaySearchBackend(SearchBackend):
+    """Recorded search results (or failures); an unrecorded query finds nothing."""
+
+    name = "replay"
+
+    def __init__(self, replayer: TranscriptReplayer):
+        self.replayer = replayer
+
+    def search(self, query: str, max_results: int) -> List[Dict[str, Any]]:
+        started = self.replayer.begin(SEARCH)
+        try:
+            record = self.replayer.lookup(SEARCH, {"query": query, "max_results": max_results})
+            self.replayer.replay_delay(record)
+        finally:
+            self.replayer.end(SEARCH, started)
+        if record is None:
+            return []
+        if "error" in record:
+            raise ConnectionError(f"Replayed: {record['error']}")
+        return list(record["results"])
@@ -0,0 +1,145 @@
+
+import contextvars
+import time
+from typing import Any, Callable, Dict, Optional
+
+from.call_budget import CallBudget
+from.run_trace import RunTrace
+
+# The controller of the run executing in this context, so LLM calls can be cut off at its deadline.
+_current_controller: contextvars.ContextVar[Optional["RunController"]] = \
+    contextvars.ContextVar("run_controller", default=None)
+
+
+class RunDeadlineExceeded(Exception):
+    """Raised instead of starting (or retrying) an LLM request once the run's deadline has passed."""
+
+
+class RunController(CallBudget):
+    """
+    Wall-clock deadline and token/cost caps for a whole pipeline run.
+    PLANSEARCH spends through it like any CallBudget and stops once it is exhausted().
+    Generation closes once the time left drops to judge_reserve of the deadline, or once
+    spend reaches (1 - judge_reserve) of the token or cost cap, so the remainder goes to
+    evaluating what already exists. Evaluation (judge batches, novelty calls, ensemble
+    rounds) stops at evaluation_stop_reason(): the deadline itself or the full token or
+    cost cap, and the run returns its best-so-far ranking. While the controller is
+    current, LLM requests are timed out and stop retrying at the deadline.
+    Spend is read from the run trace's LLM usage totals (tokens and cost reported by the
+    provider); without reported usage, PLANSEARCH's up-front token reservations count.
+    """
+
+    def __init__(self,
+                 deadline_seconds: Optional[float] = None,
+                 max_tokens: Optional[int] = None,
+                 max_cost_usd: Optional[float] = None,
+                 max_calls: Optional[int] = None,
+                 judge_reserve: float = 0.3,
+                 clock: Callable[[], float] = time.monotonic):
+        if not 0 <= judge_reserve < 1:
+            raise ValueError("judge_reserve must be in [0, 1)")
+        super().__init__(max_calls=max_calls) # Token cap is checked against actual spend below
+        self.deadline_seconds = deadline_seconds
+        self.token_cap = max_tokens
+        self.max_cost_usd = max_cost_usd
+        self.judge_reserve = judge_reserve
+        self.clock = clock
+        self.started_at: Optional[float] = None
+        self.generation_closed_reason: Optional[str] = None
+        self._trace: Optional[RunTrace] = None
+
+    def start(self, trace: Optional[RunTrace] = None) -> None:
+        """Starts the clock; called by the pipeline when the run begins, not when it is queued."""
+        self.started_at = self.clock()
+        self._trace = trace
+
+    def elapsed(self) -> float:
+        return 0.0 if self.started_at is None else self.clock() - self.started_at
+
+    def time_left(self) -> Optional[float]:
+        if self.deadline_seconds is None:
+            return None
+        return self.deadline_seconds - self.elapsed()
+
+    def past_deadline(self) -> bool:
+        time_left = self.time_left()
+        return time_left is not None and time_left <= 0
+
+    def exhausted(self) -> bool:
+        """As for any CallBudget: True once generation must stop (closed, a call denied, or max_calls reached)."""
+        with self._lock:
+            if self.generation_closed_reason is not None:
+                return True
+        return super().exhausted()
+
+    def evaluation_stop_reason(self) -> Optional[str]:
+        """Why evaluation must stop now ("deadline", "token_budget" or "cost_budget"), or None."""
+        if self.past_deadline():
+            return "deadline"
+        spent = self.spent()
+        if self.token_cap is not None and spent["tokens"] >= self.token_cap:
+            return "token_budget"
+        if self.max_cost_usd is not None and spent["cost_usd"] >= self.max_cost_usd:
+            return "cost_budget"
+        return None
+
+    def spent(self) -> Dict[str, float]:
+        rows = self._trace.totals("llm_usage") if self._trace is not None else []
+        with self._lock:
+            reserved_tokens = self.tokens
+        used_tokens = sum(row.get("prompt_tokens", 0) + row.get("completion_tokens", 0) for row in rows)
+        return {"tokens": max(used_tokens, reserved_tokens), "cost_usd": sum(row.get("cost_usd", 0.0) for row in rows)}
+
+    def _generation_block(self, tokens: int) -> Optional[str]:
+        time_left = self.time_left()
+        if time_left is not None and time_left <= self.deadline_seconds * self.judge_reserve:
+            return "deadline"
+        generation_share = 1 - self.judge_reserve
+        spent = self.spent()
+        if self.token_cap is not None and spent["tokens"] + tokens > self.token_cap * generation_share:
+            return "token_budget"
+        if self.max_cost_usd is not None and spent["cost_usd"] >= self.max_cost_usd * generation_share:
+            return "cost_budget"
+        return None
+
+    def try_spend(self, tokens: int, calls: int = 1) -> bool:
+        reason = self._generation_block(tokens)
+        if reason is not None:
+            with self._lock:
+                self.denied += calls
+                if self.generation_closed_reason is None:
+                    self.generation_closed_reason = reason
+                    print(f"Run controller closed generation ({reason}) after {self.elapsed():.1f}s.")
+            return False
+        if not super().try_spend(tokens, calls):
+            with self._lock:
+                self.generation_closed_reason = self.generation_closed_reason or "call_budget"
+            return False
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(super().get_stats(), **self.spent())
+        stats.update({
+            "max_tokens": self.token_cap, "max_cost_usd": self.max_cost_usd,
+            "deadline_seconds": self.deadline_seconds, "elapsed_seconds": round(self.elapsed(), 3),
+            "generation_closed_reason": self.generation_closed_reason
+        })
+        return stats
+
+
+def current_controller() -> Optional[RunController]:
+    return _current_controller.get()
+
+
+def set_current_controller(controller: Optional[RunController]) -> contextvars.Token:
+    return _current_controller.set(controller)
+
+
+def reset_current_controller(token: contextvars.Token) -> None:
+    _current_controller.reset(token)
+
+
+def current_time_left() -> Optional[float]:
+    """Seconds until the current run's deadline, or None without one."""
+    controller = _current_controller.get()
+    return controller.time_left() if controller is not None else None
@@ -0,0 +1,161 @@
+
+import contextvars
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+MAX_TRACE_STRING_CHARS = 2000
+# Raw LLM replies are only kept as a preview; the parsed result is stored next to them.
+COMPACTED_FIELDS = {"raw_response": 300}
+MAX_ENTRIES_PER_SECTION = 500
+
+# The trace of the pipeline run executing in the current context. Worker threads
+# inherit it by being submitted through contextvars.copy_context().run.
+_current_trace: contextvars.ContextVar[Optional["RunTrace"]] = contextvars.ContextVar("run_trace", default=None)
+
+
+def _compact(value: Any, limit: int = MAX_TRACE_STRING_CHARS) -> Any:
+    if isinstance(value, str):
+        return value if len(value) <= limit else value[:limit] + f"... [{len(value) - limit} chars truncated]"
+    if isinstance(value, dict):
+        return {key: _compact(item, COMPACTED_FIELDS.get(key, limit)) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_compact(item, limit) for item in value]
+    return value
+
+
+class RunTrace:
+    """
+    Transparency records for a single pipeline run, grouped as component -> section -> entries.
+    Entries are compacted on the way in (long strings truncated, raw responses reduced
+    to a preview) and each section keeps at most max_entries_per_section of them.
+    """
+
+    def __init__(self, run_id: Optional[str] = None, topic: Optional[str] = None,
+                 llm_choices: Optional[Dict[str, str]] = None,
+                 max_entries_per_section: int = MAX_ENTRIES_PER_SECTION):
+        self.run_id = run_id or uuid.uuid4().hex
+        self.created_at = time.time()
+        self.max_entries_per_section = max_entries_per_section
+        self.summary: Dict[str, Any] = {"topic": topic, "llm_choices": llm_choices or {}}
+        self._components: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+        self._totals: Dict[str, Dict[Tuple[Tuple[str, str], ...], Dict[str, float]]] = {}
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def record(self, component: str, section: str, entry: Dict[str, Any]) -> None:
+        entry = _compact(entry)
+        with self._lock:
+            entries = self._components.setdefault(component, {}).setdefault(section, [])
+            if len(entries) < self.max_entries_per_section:
+                entries.append(entry)
+            else:
+                self._dropped += 1
+
+    def accumulate(self, section: str, labels: Dict[str, str], values: Dict[str, float]) -> None:
+        """Adds values to the running totals kept for labels, e.g. token usage per stage and model."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            totals = self._totals.setdefault(section, {}).setdefault(key, {})
+            for name, value in values.items():
+                totals[name] = totals.get(name, 0) + value
+
+    def totals(self, section: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(key, **values) for key, values in self._totals.get(section, {}).items()]
+
+    def component(self, component: str, sections: Iterable[str] = ()) -> Dict[str, List[Dict[str, Any]]]:
+        with self._lock:
+            data = {section: list(entries) for section, entries in self._components.get(component, {}).items()}
+        for section in sections:
+            data.setdefault(section, [])
+        return data
+
+    def set_summary(self, **fields: Any) -> None:
+        with self._lock:
+            self.summary.update(_compact(fields))
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            data: Dict[str, Any] = dict(self.summary, run_id=self.run_id, created_at=self.created_at)
+            for component, sections in self._components.items():
+                data[component] = {section: list(entries) for section, entries in sections.items()}
+            for section, rows in self._totals.items():
+                data[section] = [dict(key, **values) for key, values in rows.items()]
+            if self._dropped:
+                data["dropped_entries"] = self._dropped
+            return data
+
+
+def current_trace() -> Optional[RunTrace]:
+    return _current_trace.get()
+
+
+def set_current_trace(trace: Optional[RunTrace]) -> contextvars.Token:
+    return _current_trace.set(trace)
+
+
+def reset_current_trace(token: contextvars.Token) -> None:
+    _current_trace.reset(token)
+
+
+def record_trace(component: str, section: str, entry: Dict[str, Any]) -> None:
+    """Adds entry to the current run's trace. Outside a run there is nothing to record into."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.record(component, section, entry)
+
+
+def trace_component(component: str, sections: Iterable[str] = ()) -> Dict[str, List[Dict[str, Any]]]:
+    trace = _current_trace.get()
+    if trace is None:
+        return {section: [] for section in sections}
+    return trace.component(component, sections)
+
+
+class RunTraceStore:
+    """Completed run traces by run id, bounded by count (least recently used evicted first) and TTL."""
+
+    def __init__(self, max_runs: int = 256, ttl_seconds: Optional[float] = 3600):
+        self.max_runs = max_runs
+        self.ttl_seconds = ttl_seconds
+        self._traces: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float) -> None:
+        if self.ttl_seconds is None:
+            return
+        while self._traces:
+            run_id, (stored_at, _) = next(iter(self._traces.items()))
+            if now - stored_at <= self.ttl_seconds:
+                break
+            del self._traces[run_id]
+
+    def put(self, trace: RunTrace) -> None:
+        now = time.monotonic()
+        data = trace.to_dict()
+        with self._lock:
+            self._traces.pop(trace.run_id, None)
+            self._traces[trace.run_id] = (now, data)
+            self._expire(now)
+            while len(self._traces) > self.max_runs:
+                self._traces.popitem(last=False)
+
+    def get(self, run_id: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._traces.get(run_id)
+            if entry is None:
+                return None
+            if self.ttl_seconds is not None and now - entry[0] > self.ttl_seconds: # Recently read, so not at the front
+                del self._traces[run_id]
+                return None
+            self._traces.move_to_end(run_id)
+            return entry[1]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._traces)
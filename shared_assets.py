@@ -0,0 +1,114 @@
+
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from.joke_corpus_index import NGramCorpusIndex
+from.embedding_index import EmbeddingCorpusIndex, get_embedder
+
+ANN_MIN_CORPUS_SIZE = 200_000 # Exact top-k is fast enough below this many corpus jokes
+
+
+class SharedAssets:
+    """
+    Process-wide registry of read-only corpus assets: n-gram indexes and (embedder,
+    embedding index) pairs, loaded once per key and shared by every NoveltyChecker.
+    With mmap (the default) index arrays are memory-mapped, so forked workers and
+    separate processes share their pages through the page cache; with mmap=False they
+    are read into memory, which forked workers share copy-on-write when loaded before
+    the fork (see warm_up). A load that fails is remembered as None and not retried.
+    The preprocess function of the first load for a key is the one kept.
+    """
+
+    def __init__(self, mmap: bool = True):
+        self.mmap = mmap
+        self._ngram_indexes: Dict[Tuple[str, int], Optional[NGramCorpusIndex]] = {}
+        self._embedding_indexes: Dict[Tuple[str, Optional[str], str, Optional[bool]],
+                                      Optional[Tuple[Any, EmbeddingCorpusIndex]]] = {}
+        self._load_seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def ngram_index(self, corpus_path: str, n: int,
+                    preprocess: Optional[Callable[[str], str]] = None) -> Optional[NGramCorpusIndex]:
+        key = (corpus_path, n)
+        with self._lock:
+            if key not in self._ngram_indexes:
+                start = time.perf_counter()
+                try:
+                    self._ngram_indexes[key] = NGramCorpusIndex.load_or_build(corpus_path, n, preprocess=preprocess,
+                                                                              mmap=self.mmap)
+                except Exception as e:
+                    print(f"Could not load n-gram index for corpus {corpus_path}: {e}")
+                    self._ngram_indexes[key] = None # Don't retry on every joke
+                self._load_seconds[f"ngram{n}:{corpus_path}"] = time.perf_counter() - start
+            return self._ngram_indexes[key]
+
+    def embedding_index(self, corpus_path: str, embedding_model_name: Optional[str] = None,
+                        dtype: str = "float16", use_ann: Optional[bool] = None,
+                        preprocess: Optional[Callable[[str], str]] = None) -> Optional[Tuple[Any, EmbeddingCorpusIndex]]:
+        """(embedder, index); use_ann=None builds the ANN lists only for corpora of ANN_MIN_CORPUS_SIZE or more."""
+        key = (corpus_path, embedding_model_name, dtype, use_ann)
+        with self._lock:
+            if key not in self._embedding_indexes:
+                start = time.perf_counter()
+                try:
+                    embedder = get_embedder(embedding_model_name, preprocess=preprocess)
+                    index = EmbeddingCorpusIndex.load_or_build(corpus_path, embedder, dtype=dtype, mmap=self.mmap)
+                    ann = use_ann if use_ann is not None else len(index) >= ANN_MIN_CORPUS_SIZE
+                    if ann and not index.has_ann:
+                        index = EmbeddingCorpusIndex.load_or_build(corpus_path, embedder, dtype=dtype, ann=True,
+                                                                   mmap=self.mmap)
+                    self._embedding_indexes[key] = (embedder, index)
+                except Exception as e:
+                    print(f"Could not load embedding index for corpus {corpus_path}: {e}")
+                    self._embedding_indexes[key] = None # Don't retry on every joke
+                self._load_seconds[f"embedding:{embedding_model_name or 'default'}:{corpus_path}"] = time.perf_counter() - start
+            return self._embedding_indexes[key]
+
+    def warm_up(self, corpus_path: Optional[str],
+                ngram_sizes: Iterable[int] = (7,),
+                embedding_model_names: Iterable[Optional[str]] = (None,),
+                embedding_dtype: str = "float16",
+                use_ann: Optional[bool] = None,
+                preprocess: Optional[Callable[[str], str]] = None) -> Dict[str, float]:
+        """
+        Loads (building if needed) every asset a NoveltyChecker for corpus_path will ask for
+        and runs one query through each, so nothing is left to load lazily in a forked worker.
+        Returns the load time per asset.
+        """
+        if corpus_path:
+            for n in ngram_sizes:
+                index = self.ngram_index(corpus_path, n, preprocess)
+                if index is not None:
+                    index.query("warm up")
+            for embedding_model_name in embedding_model_names:
+                loaded = self.embedding_index(corpus_path, embedding_model_name, embedding_dtype, use_ann, preprocess)
+                if loaded is not None and len(loaded[1]):
+                    embedder, index = loaded
+                    queries = embedder(["warm up"])
+                    if index.has_ann and use_ann is not False:
+                        index.top_k_ann(queries, k=1)
+                    else:
+                        index.top_k(queries, k=1)
+        return self.get_stats()["load_seconds"]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ngram_indexes": sum(1 for index in self._ngram_indexes.values() if index is not None),
+                "embedding_indexes": sum(1 for loaded in self._embedding_indexes.values() if loaded is not None),
+                "load_seconds": {name: round(seconds, 4) for name, seconds in self._load_seconds.items()}
+            }
+
+
+_default_assets: Optional[SharedAssets] = None
+_default_assets_lock = threading.Lock()
+
+
+def default_shared_assets() -> SharedAssets:
+    """The process-wide registry NoveltyChecker uses unless given its own."""
+    global _default_assets
+    with _default_assets_lock:
+        if _default_assets is None:
+            _default_assets = SharedAssets()
+        return _default_assets
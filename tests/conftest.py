@@ -0,0 +1,15 @@
+"""
+The modules use package-relative imports, so the tests import the repository as a package
+named `jokebot`, whatever its directory is called.
+"""
+import importlib.machinery
+import importlib.util
+import pathlib
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+if "jokebot" not in sys.modules:
+    spec = importlib.machinery.ModuleSpec("jokebot", None, is_package=True)
+    spec.submodule_search_locations = [str(ROOT)]
+    sys.modules["jokebot"] = importlib.util.module_from_spec(spec)
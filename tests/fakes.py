@@ -0,0 +1,29 @@
+import json
+import re
+from typing import Any, Dict, List
+
+from jokebot.metrics import record_llm_call
+
+
+class FakeClient:
+    """
+    Answers every pipeline prompt instantly and counts the calls. The observation prompt
+    gets `observations` lines, plan scoring gets descending scores, anything else a reply
+    unique to the call. Calls are recorded like OpenRouterClient records them.
+    """
+
+    def __init__(self, observations: int = 12):
+        self.observations = observations
+        self.calls = 0
+
+    def get_completion(self, model_name: str, messages: List[Dict[str, Any]], temperature: float = 0.7,
+                       max_tokens: int = 500, **kwargs: Any) -> str:
+        self.calls += 1
+        record_llm_call(model_name, "ok", 0.0)
+        prompt = "\n".join(message["content"] for message in messages)
+        plan_ids = re.findall(r"^\[(P\d+)\]", prompt, re.M)
+        if plan_ids:
+            return json.dumps({"scores": [{"plan_id": plan_id, "score": 10 - index} for index, plan_id in enumerate(plan_ids)]})
+        if "brainstorm" in prompt.lower():
+            return "\n".join(f"observation {i}" for i in range(self.observations))
+        return f"reply {self.calls}"
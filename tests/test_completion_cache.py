@@ -0,0 +1,26 @@
+import time
+
+from jokebot.completion_cache import CompletionCache
+
+
+def test_purge_counts_the_rows_it_expires(tmp_path):
+    cache = CompletionCache(str(tmp_path / "cache.db"), ttl_seconds=60, purge_interval=3)
+    cache.put("old", {"text": "old"})
+    cache._conn.execute("UPDATE completions SET created_at = ?", (time.time() - 120,))
+    cache._memory.clear()
+    cache.put("a", {"text": "a"})
+    cache.put("b", {"text": "b"}) # Third store: purges
+    stats = cache.get_stats()
+    assert stats["expired"] == 1
+    assert stats["disk_entries"] == 2
+    assert cache.get("old") is None
+    assert cache.get_stats()["expired"] == 1 # Already purged, so not counted again
+
+
+def test_purge_counts_the_rows_it_evicts(tmp_path):
+    cache = CompletionCache(str(tmp_path / "cache.db"), max_memory_entries=1, max_disk_entries=10)
+    for i in range(11):
+        cache.put(f"key {i}", {"text": str(i)})
+    stats = cache.get_stats()
+    assert stats["disk_evictions"] == 2 # Down to 90% of max_disk_entries
+    assert stats["disk_entries"] == 9
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+from jokebot.job_queue import JobQueue, SQLiteJobStore, JOB_FAILED, JOB_RUNNING
+
+
+def running_job(store: SQLiteJobStore, job_id: str, **fields):
+    store.create({"id": job_id, "owner": "key", "status": JOB_RUNNING, "params": {}, "created_at": 0.0})
+    if fields:
+        store.update(job_id, **fields)
+
+
+def test_restart_only_interrupts_jobs_of_processes_that_are_gone(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    store = SQLiteJobStore(db_path)
+    sibling = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    finished = subprocess.Popen([sys.executable, "-c", "pass"])
+    finished.wait()
+    try:
+        running_job(store, "sibling", pid=sibling.pid)
+        running_job(store, "dead", pid=finished.pid)
+        running_job(store, "other_host", pid=finished.pid, host="elsewhere")
+        running_job(store, "legacy", pid=None)
+
+        JobQueue(run_job=lambda params, progress: None, store=SQLiteJobStore(db_path))
+
+        assert store.get("sibling")["status"] == JOB_RUNNING
+        assert store.get("other_host")["status"] == JOB_RUNNING
+        assert store.get("dead")["status"] == JOB_FAILED
+        assert store.get("legacy")["status"] == JOB_FAILED
+    finally:
+        sibling.kill()
+        sibling.wait()
+
+
+def test_jobs_record_the_process_that_runs_them(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+    running_job(store, "mine")
+    assert store.get("mine")["pid"] == os.getpid()
@@ -0,0 +1,27 @@
+from jokebot.judge_ensemble import JudgeEnsemble
+from jokebot.llm_judge import LLMJudge
+from jokebot.run_trace import RunTrace, set_current_trace, reset_current_trace
+
+from fakes import FakeClient
+
+
+def test_extra_judge_calls_count_the_per_joke_fallbacks():
+    # The fake judge never answers with valid JSON, so every batch falls back to one call per joke.
+    client = FakeClient()
+    candidates = [{"joke_text": f"joke {i}", "evaluation": {"overall_funniness": 6 + i % 2}} for i in range(4)]
+    token = set_current_trace(RunTrace())
+    try:
+        summary = JudgeEnsemble(["m2"], max_rounds=2, batch_size=5).rank(
+            candidates, 2, LLMJudge(client), "m1", lambda joke_detail, funniness: funniness
+        )
+    finally:
+        reset_current_trace(token)
+    assert summary["rounds"] == 2
+    assert summary["extra_judge_calls"] == client.calls == 2 * (1 + 4)
+
+
+def test_extra_judge_calls_are_unknown_outside_a_run():
+    candidates = [{"joke_text": f"joke {i}", "evaluation": {"overall_funniness": 6}} for i in range(3)]
+    summary = JudgeEnsemble(["m2"], max_rounds=1).rank(candidates, 1, LLMJudge(FakeClient()), "m1",
+                                                        lambda joke_detail, funniness: funniness)
+    assert summary["extra_judge_calls"] is None
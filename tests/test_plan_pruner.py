@@ -0,0 +1,40 @@
+from typing import Optional
+
+from jokebot.plan_pruner import PlanPruner
+from jokebot.plansearch_for_jokes import PlanSearcherForJokes
+
+from fakes import FakeClient
+
+
+def run_calls(plan_pruner: Optional[PlanPruner]) -> int:
+    client = FakeClient(observations=5)
+    PlanSearcherForJokes(client).run_plansearch("cats", "m", "m", "m", "m", max_plans_to_develop=5,
+                                                plan_pruner=plan_pruner)
+    return client.calls
+
+
+def test_pruning_spends_fewer_calls_and_reports_the_net_saving():
+    unpruned = run_calls(None)
+    pruner = PlanPruner(keep_ratio=0.5, scoring_model="scorer")
+    pruned = run_calls(pruner)
+    assert pruned < unpruned
+    stats = pruner.get_stats()
+    assert stats["scoring_calls"] == 1
+    assert stats["calls_saved"] == unpruned - pruned
+
+
+def test_pruning_without_a_scoring_model_drafts_no_extra_plans():
+    unpruned = run_calls(None)
+    pruner = PlanPruner(keep_ratio=0.5)
+    pruned = run_calls(pruner)
+    assert pruner.get_stats()["plans_seen"] == 5
+    assert pruner.get_stats()["calls_saved"] == unpruned - pruned > 0
+
+
+def test_duplicate_plans_are_dropped():
+    pruner = PlanPruner(keep_ratio=1.0)
+    items = [(("a",), "Plan: a cat sits"), (("b",), "a cat sits!"), (("c",), "dogs bark at night")]
+    selected, decision = pruner.prune("cats", items, 3, lambda *args: None, calls_per_plan=3)
+    assert [plan for _, plan in selected] == ["Plan: a cat sits", "dogs bark at night"]
+    assert decision["duplicates_pruned"] == 1
+    assert decision["calls_saved"] == 3
@@ -0,0 +1,44 @@
+from jokebot.call_budget import CallBudget
+from jokebot.combination_scheduler import CombinationScheduler
+from jokebot.plansearch_for_jokes import PlanSearcherForJokes
+from jokebot.run_controller import RunController
+
+from fakes import FakeClient
+
+
+def run_budgeted(budget: CallBudget):
+    searcher = PlanSearcherForJokes(FakeClient())
+    develop_tasks = []
+    develop_plan = searcher._develop_plan
+    searcher._develop_plan = lambda *args, **kwargs: develop_tasks.append(args[1]) or develop_plan(*args, **kwargs)
+    searcher.run_plansearch("cats", "m", "m", "m", "m", num_first_order_obs=12, max_subset_size=4,
+                            combination_scheduler=CombinationScheduler(), budget=budget)
+    return searcher, develop_tasks
+
+
+def test_call_budget_stops_plansearch_waves():
+    budget = CallBudget(max_calls=3)
+    searcher, develop_tasks = run_budgeted(budget)
+    assert searcher.llm_client.calls == 3
+    assert develop_tasks == []
+
+
+def test_run_controller_stops_plansearch_waves_once_generation_closes():
+    controller = RunController(max_tokens=2000)
+    controller.start()
+    searcher, develop_tasks = run_budgeted(controller)
+    assert controller.generation_closed_reason == "token_budget"
+    assert controller.exhausted()
+    assert develop_tasks == []
+    # Only the wave that was already in flight when generation closed may be turned away.
+    assert controller.denied <= 8
+
+
+def test_evaluation_continues_after_generation_closes():
+    controller = RunController(max_tokens=2000)
+    controller.start()
+    assert not controller.try_spend(1500)
+    assert controller.exhausted()
+    assert controller.evaluation_stop_reason() is None
+    controller.tokens = 2000
+    assert controller.evaluation_stop_reason() == "token_budget"
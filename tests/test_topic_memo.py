@@ -0,0 +1,30 @@
+from jokebot.topic_memo import TopicMemoStore
+
+
+def run_once(memo: TopicMemoStore, run: int, count: int = 5):
+    """The memo calls PLANSEARCH's _first_order_observations makes, with every generated observation new."""
+    fresh_count = memo.fresh_count("cats", "m", count)
+    generated = [f"observation {run}-{i}" for i in range(count)]
+    fresh = generated[:fresh_count]
+    memo.add_observations("cats", "m", generated, used=fresh)
+    return memo.take_observations("cats", "m", count - len(fresh), exclude=fresh)
+
+
+def test_memoized_core_survives_repeated_runs_past_the_limit():
+    memo = TopicMemoStore(max_observations_per_model=6)
+    core = set(run_once(memo, 0)) | {f"observation 0-{i}" for i in range(5)}
+    reused = [run_once(memo, run) for run in range(1, 30)]
+    assert all(len(taken) == 3 for taken in reused)
+    assert reused[-1] == reused[1]
+    assert set(reused[-1]) <= core
+    assert len(memo.observations("cats", "m")) == 6
+
+
+def test_derived_observations_are_evicted_least_recently_used():
+    memo = TopicMemoStore(max_derived_per_topic=2)
+    memo.put_derived("cats", "m", ("a",), ["core"])
+    memo.put_derived("cats", "m", ("b",), ["other"])
+    assert memo.get_derived("cats", "m", ("a",)) == ["core"]
+    memo.put_derived("cats", "m", ("c",), ["new"])
+    assert memo.get_derived("cats", "m", ("a",)) == ["core"]
+    assert memo.get_derived("cats", "m", ("b",)) is None
@@ -0,0 +1,180 @@
+
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+Combo = Tuple[str, ...]
+
+
+def normalize_topic(topic: str) -> str:
+    text = re.sub(r"[^\w\s]", "", topic.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class _TopicEntry:
+    def __init__(self):
+        # model -> observation -> [times used, tick of last use (or of insertion)], oldest first
+        self.observations: Dict[str, Dict[str, List[int]]] = {}
+        self.derived: Dict[Tuple[str, Combo], List[str]] = {} # (model, source combo) -> second-order observations
+        self.plans: Dict[Tuple[str, Combo], str] = {} # (model, observation combo) -> plan
+
+
+class TopicMemoStore:
+    """
+    PLANSEARCH's front half (first- and second-order observations and plans) memoized
+    across runs, per normalized topic and model. Topics are evicted least recently used
+    beyond max_topics and dropped ttl_seconds after their last update. Within a topic, the
+    least used (then least recently used) observations and the least recently used
+    derivations and plans go first beyond their caps, so the memoized core survives.
+    freshness is the share of first-order observations drawn from a new LLM call on a
+    memo hit (new ones extend the memo). The rest are the most-used memoized ones, so
+    later runs rebuild the same combinations and hit the memoized derivations and plans,
+    while the fresh share keeps adding new angles.
+    """
+
+    def __init__(self,
+                 max_topics: int = 512,
+                 ttl_seconds: Optional[float] = 24 * 3600,
+                 freshness: float = 0.3,
+                 max_observations_per_model: int = 40,
+                 max_derived_per_topic: int = 200,
+                 max_plans_per_topic: int = 200):
+        if not 0 <= freshness <= 1:
+            raise ValueError("freshness must be in [0, 1]")
+        self.max_topics = max_topics
+        self.ttl_seconds = ttl_seconds
+        self.freshness = freshness
+        self.max_observations_per_model = max_observations_per_model
+        self.max_derived_per_topic = max_derived_per_topic
+        self.max_plans_per_topic = max_plans_per_topic
+        self._topics: "OrderedDict[str, Tuple[float, _TopicEntry]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._tick = 0 # Orders observation uses; bumped under the lock
+        self.stats = {"observation_hits": 0, "derived_hits": 0, "plan_hits": 0, "misses": 0}
+
+    def _expire(self, now: float) -> None:
+        if self.ttl_seconds is None:
+            return
+        for topic in [topic for topic, (updated_at, _) in self._topics.items() if now - updated_at > self.ttl_seconds]:
+            del self._topics[topic]
+
+    def _entry(self, topic: str, create: bool) -> Optional[_TopicEntry]:
+        # Caller holds the lock.
+        key = normalize_topic(topic)
+        now = time.monotonic()
+        self._expire(now)
+        item = self._topics.get(key)
+        if item is None:
+            if not create:
+                return None
+            item = (now, _TopicEntry())
+        elif create:
+            item = (now, item[1]) # Writes keep a topic fresh
+        self._topics[key] = item
+        self._topics.move_to_end(key)
+        while len(self._topics) > self.max_topics:
+            self._topics.popitem(last=False)
+        return item[1]
+
+    @staticmethod
+    def _trim(mapping: Dict, limit: int) -> None:
+        # Least recently used first: hits move their key to the end (see _touch).
+        while len(mapping) > limit:
+            del mapping[next(iter(mapping))]
+
+    @staticmethod
+    def _touch(mapping: Dict, key: Tuple[str, Combo]) -> None:
+        mapping[key] = mapping.pop(key)
+
+    def _trim_observations(self, uses: Dict[str, List[int]]) -> None:
+        excess = len(uses) - self.max_observations_per_model
+        if excess > 0:
+            for observation in sorted(uses, key=lambda obs: tuple(uses[obs]))[:excess]:
+                del uses[observation]
+
+    def _use(self, uses: Dict[str, List[int]], observation: str) -> None:
+        self._tick += 1
+        uses[observation][0] += 1
+        uses[observation][1] = self._tick
+
+    def fresh_count(self, topic: str, model: str, count: int) -> int:
+        """How many of count first-order observations should come from a new LLM call."""
+        with self._lock:
+            entry = self._entry(topic, create=False)
+            known = len(entry.observations.get(model, {})) if entry else 0
+        if known == 0:
+            return count
+        return min(count, max(math.ceil(self.freshness * count), count - known))
+
+    def observations(self, topic: str, model: str) -> List[str]:
+        with self._lock:
+            entry = self._entry(topic, create=False)
+            return list(entry.observations.get(model, {})) if entry else []
+
+    def take_observations(self, topic: str, model: str, count: int, exclude: Sequence[str] = ()) -> List[str]:
+        """Up to count memoized first-order observations, most used (then oldest) first, and marks them used."""
+        with self._lock:
+            entry = self._entry(topic, create=False)
+            if entry is None or count <= 0:
+                return []
+            uses = entry.observations.get(model, {})
+            order = {observation: position for position, observation in enumerate(uses)}
+            picked = sorted((obs for obs in uses if obs not in exclude), key=lambda obs: (-uses[obs][0], order[obs]))[:count]
+            for observation in picked:
+                self._use(uses, observation)
+            self.stats["observation_hits"] += bool(picked)
+            return picked
+
+    def add_observations(self, topic: str, model: str, observations: Sequence[str], used: Sequence[str] = ()) -> None:
+        with self._lock:
+            uses = self._entry(topic, create=True).observations.setdefault(model, {})
+            for observation in observations:
+                if observation not in uses:
+                    self._tick += 1
+                    uses[observation] = [0, self._tick]
+            for observation in used:
+                if observation in uses:
+                    self._use(uses, observation)
+            self._trim_observations(uses)
+
+    def get_derived(self, topic: str, model: str, combo: Combo) -> Optional[List[str]]:
+        with self._lock:
+            entry = self._entry(topic, create=False)
+            derived = entry.derived.get((model, tuple(combo))) if entry else None
+            self.stats["derived_hits" if derived else "misses"] += 1
+            if derived:
+                self._touch(entry.derived, (model, tuple(combo)))
+            return list(derived) if derived else None
+
+    def put_derived(self, topic: str, model: str, combo: Combo, derived: Sequence[str]) -> None:
+        with self._lock:
+            entry = self._entry(topic, create=True)
+            entry.derived[(model, tuple(combo))] = list(derived)
+            self._trim(entry.derived, self.max_derived_per_topic)
+
+    def get_plan(self, topic: str, model: str, combo: Combo) -> Optional[str]:
+        with self._lock:
+            entry = self._entry(topic, create=False)
+            plan = entry.plans.get((model, tuple(combo))) if entry else None
+            self.stats["plan_hits" if plan else "misses"] += 1
+            if plan:
+                self._touch(entry.plans, (model, tuple(combo)))
+            return plan
+
+    def put_plan(self, topic: str, model: str, combo: Combo, plan: str) -> None:
+        with self._lock:
+            entry = self._entry(topic, create=True)
+            entry.plans[(model, tuple(combo))] = plan
+            self._trim(entry.plans, self.max_plans_per_topic)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire(time.monotonic())
+            return len(self._topics)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats, topics=len(self._topics))
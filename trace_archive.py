@@ -0,0 +1,459 @@
+
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+import weakref
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# pyarrow (~130 ms to import) is loaded when the first TraceArchive is created, not with the app.
+pa: Any = None
+pc: Any = None
+
+try:
+    import fcntl
+except ImportError: # Not on Windows: compaction is then only serialized within one process
+    fcntl = None
+
+SEGMENT_SUFFIX = ".arrow"
+COMPACTED_FROM_KEY = b"compacted_from" # Schema metadata: the segments a compacted segment replaces
+
+# Column name -> type, per table. Every row carries run_id and created_at so tables join and filter by time.
+# New columns go at the end of a table; segments written before they existed read them as nulls.
+TABLE_COLUMNS: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    "runs": (
+        ("run_id", "string"), ("created_at", "float64"), ("topic", "string"), ("evaluation_mode", "string"),
+        ("observation_model", "string"), ("plan_model", "string"), ("joke_model", "string"),
+        ("critique_model", "string"), ("judge_model", "string"), ("novelty_model", "string"),
+        ("wall_time_seconds", "float64"), ("llm_calls", "int64"), ("llm_errors", "int64"), ("cache_hits", "int64"),
+        ("prompt_tokens", "int64"), ("completion_tokens", "int64"), ("cost_usd", "float64"),
+        ("llm_latency_seconds", "float64"), ("candidates", "int64"), ("top_score", "float64"),
+        ("deadline_reached", "bool"), ("error", "string"), ("summary_json", "string"),
+        ("cached_prompt_tokens", "int64"),
+    ),
+    "llm_usage": (
+        ("run_id", "string"), ("created_at", "float64"), ("model", "string"), ("stage", "string"),
+        ("calls", "int64"), ("errors", "int64"), ("cache_hits", "int64"), ("prompt_tokens", "int64"),
+        ("completion_tokens", "int64"), ("cost_usd", "float64"), ("retries", "int64"), ("latency_seconds", "float64"),
+        ("cached_prompt_tokens", "int64"), ("prefix_cached_calls", "int64"), ("prefix_cached_latency_seconds", "float64"),
+    ),
+    "observations": (
+        ("run_id", "string"), ("created_at", "float64"), ("parent_observations", "list<string>"),
+        ("observation", "string"),
+    ),
+    "plans": (
+        ("run_id", "string"), ("created_at", "float64"), ("observation_combo", "list<string>"), ("plan", "string"),
+    ),
+    "jokes": (
+        ("run_id", "string"), ("created_at", "float64"), ("plan", "string"), ("critique", "string"),
+        ("joke", "string"), ("sample_index", "int64"),
+    ),
+    "novelty_checks": (
+        ("run_id", "string"), ("created_at", "float64"), ("joke_text", "string"),
+        ("n_gram_overlap_score", "float64"), ("semantic_similarity_corpus_score", "float64"),
+        ("web_found_penalty_score", "float64"), ("perceived_novelty_llm_score", "float64"),
+        ("final_novelty_score", "float64"),
+    ),
+    "evaluations": (
+        ("run_id", "string"), ("created_at", "float64"), ("joke_text", "string"), ("judge_model", "string"),
+        ("overall_funniness", "float64"), ("originality", "float64"), ("coherence", "float64"),
+        ("setup_effectiveness", "float64"), ("punchline_impact", "float64"), ("brevity", "float64"),
+        ("perceived_novelty", "float64"), ("batch_size", "int64"), ("rationale", "string"),
+    ),
+}
+
+# Summary fields that get their own runs column; everything else is kept in summary_json.
+_RUN_COLUMN_FIELDS = {"run_id", "created_at", "topic", "evaluation_mode", "models", "wall_time_seconds",
+                      "llm_usage_totals", "deadline_reached", "error", "final_ranked_jokes_summary"}
+_TRACE_SECTIONS = {"plansearch_data", "llm_judge_data", "novelty_checker_data", "llm_usage"}
+
+
+def _float(value: Any) -> Optional[float]:
+    try:
+        return None if value is None or isinstance(value, bool) else float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _int(value: Any) -> Optional[int]:
+    number = _float(value)
+    return None if number is None else int(number)
+
+
+def _text(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def _ratio(part: Optional[float], whole: Optional[float]) -> Optional[float]:
+    return round((part or 0) / whole, 3) if whole else None
+
+
+def trace_rows(data: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """Flattens one run's trace (RunTrace.to_dict()) into rows for each archive table."""
+    run = {"run_id": data.get("run_id"), "created_at": _float(data.get("created_at"))}
+    plansearch = data.get("plansearch_data") or {}
+    models = data.get("models") or {}
+    usage = data.get("llm_usage_totals") or {}
+    scores = [_float(entry.get("score")) for entry in data.get("final_ranked_jokes_summary") or []]
+    scores = [score for score in scores if score is not None]
+    rest = {key: value for key, value in data.items() if key not in _RUN_COLUMN_FIELDS and key not in _TRACE_SECTIONS}
+
+    rows: Dict[str, List[Dict[str, Any]]] = {table: [] for table in TABLE_COLUMNS}
+    rows["runs"].append(dict(
+        run, topic=_text(data.get("topic")), evaluation_mode=_text(data.get("evaluation_mode")),
+        observation_model=_text(models.get("observation")), plan_model=_text(models.get("plan")),
+        joke_model=_text(models.get("joke_instantiation")), critique_model=_text(models.get("critique")),
+        judge_model=_text(models.get("judge")), novelty_model=_text(models.get("novelty_llm")),
+        wall_time_seconds=_float(data.get("wall_time_seconds")), llm_calls=_int(usage.get("calls")),
+        llm_errors=_int(usage.get("errors")), cache_hits=_int(usage.get("cache_hits")),
+        prompt_tokens=_int(usage.get("prompt_tokens")), completion_tokens=_int(usage.get("completion_tokens")),
+        cost_usd=_float(usage.get("cost_usd")), llm_latency_seconds=_float(usage.get("latency_seconds")),
+        candidates=len(plansearch.get("jokes_generated") or []), top_score=max(scores) if scores else None,
+        deadline_reached=bool(data.get("deadline_reached", False)), error=_text(data.get("error")),
+        summary_json=json.dumps(rest, default=str), cached_prompt_tokens=_int(usage.get("cached_prompt_tokens"))
+    ))
+    for entry in data.get("llm_usage") or []:
+        rows["llm_usage"].append(dict(run, model=_text(entry.get("model")), stage=_text(entry.get("stage")),
+                                      **{name: _int(entry.get(name)) for name in ("calls", "errors", "cache_hits",
+                                         "prompt_tokens", "completion_tokens", "retries", "cached_prompt_tokens",
+                                         "prefix_cached_calls")},
+                                      cost_usd=_float(entry.get("cost_usd")),
+                                      latency_seconds=_float(entry.get("latency_seconds")),
+                                      prefix_cached_latency_seconds=_float(entry.get("prefix_cached_latency_seconds"))))
+    for entry in plansearch.get("observations") or []:
+        parents = [str(observation) for observation in entry.get("existing_observations") or []]
+        for observation in entry.get("generated_observations") or []:
+            rows["observations"].append(dict(run, parent_observations=parents, observation=_text(observation)))
+    for entry in plansearch.get("plans") or []:
+        rows["plans"].append(dict(run, observation_combo=[str(observation) for observation in entry.get("observation_combo") or []],
+                                  plan=_text(entry.get("generated_plan"))))
+    for entry in plansearch.get("jokes_generated") or []:
+        rows["jokes"].append(dict(run, plan=_text(entry.get("plan")), critique=_text(entry.get("critique")),
+                                  joke=_text(entry.get("joke")), sample_index=_int(entry.get("sample_index"))))
+    for entry in (data.get("novelty_checker_data") or {}).get("novelty_checks") or []:
+        novelty = entry.get("scores") or {}
+        rows["novelty_checks"].append(dict(run, joke_text=_text(entry.get("joke_text")),
+                                           **{name: _float(novelty.get(name)) for name, _ in TABLE_COLUMNS["novelty_checks"][3:]}))
+    for entry in (data.get("llm_judge_data") or {}).get("evaluations") or []:
+        evaluation = entry.get("parsed_evaluation") or {}
+        rows["evaluations"].append(dict(
+            run, joke_text=_text(entry.get("joke_text")), judge_model=_text(entry.get("judge_model")),
+            **{name: _float(evaluation.get(name)) for name in ("overall_funniness", "originality", "coherence",
+                                                               "setup_effectiveness", "punchline_impact", "brevity",
+                                                               "perceived_novelty")},
+            batch_size=_int(entry.get("batch_size")), rationale=_text(evaluation.get("rationale"))
+        ))
+    return rows
+
+
+def _load_pyarrow() -> None:
+    global pa, pc
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.compute
+            import pyarrow.ipc
+        except ImportError:
+            raise ImportError("TraceArchive requires pyarrow. Run 'pip install pyarrow'")
+        pa, pc = pyarrow, pyarrow.compute
+
+
+def _schema(table: str) -> "pa.Schema":
+    types = {"string": pa.string(), "float64": pa.float64(), "int64": pa.int64(), "bool": pa.bool_(),
+             "list<string>": pa.list_(pa.string())}
+    return pa.schema([(name, types[type_name]) for name, type_name in TABLE_COLUMNS[table]])
+
+
+def _read_segment(path: str) -> "pa.Table":
+    # Zero-copy: the table's buffers point into the memory-mapped file.
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+def _conform(data: "pa.Table", schema: "pa.Schema") -> "pa.Table":
+    """A segment's table with exactly schema's columns; columns added since it was written are null."""
+    if data.schema.names == schema.names:
+        return data
+    return pa.Table.from_arrays([data[field.name] if field.name in data.schema.names else pa.nulls(len(data), field.type)
+                                 for field in schema], schema=schema)
+
+
+class TraceArchive:
+    """
+    Append-only columnar archive of finished run traces, one directory per table (runs,
+    llm_usage, observations, plans, jokes, novelty_checks, evaluations) under `directory`.
+    append() only buffers rows; a background thread writes them out every
+    flush_interval_s (or once flush_runs runs are buffered) as an uncompressed Arrow IPC
+    segment per table. Segments are tiered: once a level holds compaction_fanout of them
+    they are merged into one segment of the next level, up to max_level. Several
+    processes may share one directory; each writes its own segments and compaction is
+    serialized by a lock file. Queries memory-map the segments, so aggregates over many
+    runs run in Arrow without building Python objects per row. Requires pyarrow.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 flush_interval_s: float = 30.0,
+                 flush_runs: int = 256,
+                 compaction_fanout: int = 8,
+                 max_level: int = 3):
+        _load_pyarrow()
+        self.directory = directory
+        self.flush_interval_s = flush_interval_s
+        self.flush_runs = flush_runs
+        self.compaction_fanout = max(2, compaction_fanout)
+        self.max_level = max_level
+        for table in TABLE_COLUMNS:
+            os.makedirs(os.path.join(directory, table), exist_ok=True)
+        self._schemas = {table: _schema(table) for table in TABLE_COLUMNS}
+        self.stats = {"runs_appended": 0, "runs_flushed": 0, "segments_written": 0, "segments_compacted": 0,
+                      "flush_errors": 0}
+        self._reset()
+        # Buffered rows and the flush thread belong to the process that appended them.
+        reset = weakref.WeakMethod(self._reset)
+        os.register_at_fork(after_in_child=lambda: reset() and reset()())
+        close = weakref.WeakMethod(self.close)
+        atexit.register(lambda: close() and close()())
+
+    def _reset(self) -> None:
+        self._buffer: Dict[str, List[Dict[str, Any]]] = {table: [] for table in TABLE_COLUMNS}
+        self._buffered_runs = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def append(self, data: Dict[str, Any]) -> None:
+        """Queues one finished run's trace (RunTrace.to_dict()) for the next flush."""
+        rows = trace_rows(data)
+        with self._lock:
+            for table, table_rows in rows.items():
+                self._buffer[table].extend(table_rows)
+            self._buffered_runs += 1
+            self.stats["runs_appended"] += 1
+            if self._thread is None and not self._stopped.is_set():
+                self._thread = threading.Thread(target=self._background_loop, name="trace-archive", daemon=True)
+                self._thread.start()
+            if self._buffered_runs >= self.flush_runs:
+                self._wake.set()
+
+    def _background_loop(self) -> None:
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval_s)
+            self._wake.clear()
+            try:
+                if self.flush():
+                    self.compact()
+            except Exception as e:
+                print(f"Trace archive flush failed: {e}")
+                with self._lock:
+                    self.stats["flush_errors"] += 1
+
+    def _segment_path(self, table: str, level: int) -> str:
+        name = f"L{level}-{time.time_ns():020d}-{os.getpid()}-{uuid.uuid4().hex[:8]}{SEGMENT_SUFFIX}"
+        return os.path.join(self.directory, table, name)
+
+    def _write_segment(self, table: str, data: "pa.Table", level: int) -> str:
+        path = self._segment_path(table, level)
+        directory, name = os.path.split(path)
+        temporary = os.path.join(directory, f".{name}.tmp")
+        with pa.OSFile(temporary, "wb") as sink:
+            with pa.ipc.new_file(sink, data.schema) as writer:
+                writer.write_table(data)
+        os.replace(temporary, path) # Readers never see a partial segment
+        return path
+
+    def flush(self) -> int:
+        """Writes the buffered runs out as level-0 segments. Returns the number of runs written."""
+        with self._flush_lock:
+            with self._lock:
+                buffer, runs = self._buffer, self._buffered_runs
+                self._buffer = {table: [] for table in TABLE_COLUMNS}
+                self._buffered_runs = 0
+            if not runs:
+                return 0
+            written = 0
+            for table, rows in buffer.items():
+                if rows:
+                    self._write_segment(table, pa.Table.from_pylist(rows, schema=self._schemas[table]), 0)
+                    written += 1
+            with self._lock:
+                self.stats["runs_flushed"] += runs
+                self.stats["segments_written"] += written
+            return runs
+
+    def _segment_names(self, table: str) -> List[str]:
+        return sorted(name for name in os.listdir(os.path.join(self.directory, table))
+                      if name.endswith(SEGMENT_SUFFIX) and not name.startswith("."))
+
+    def compact(self) -> int:
+        """Merges every full tier of segments into the next level. Returns the number of segments merged."""
+        lock_file = open(os.path.join(self.directory, ".compaction.lock"), "w")
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return 0 # Another process is compacting this archive
+            merged = 0
+            for table in TABLE_COLUMNS:
+                for level in range(self.max_level):
+                    names = [name for name in self._segment_names(table) if name.startswith(f"L{level}-")]
+                    while len(names) >= self.compaction_fanout:
+                        batch, names = names[:self.compaction_fanout], names[self.compaction_fanout:]
+                        paths = [os.path.join(self.directory, table, name) for name in batch]
+                        data = pa.concat_tables([_conform(_read_segment(path), self._schemas[table])
+                                                 for path in paths]).combine_chunks()
+                        # Until the inputs are deleted, readers skip them in favour of this segment.
+                        data = data.replace_schema_metadata({COMPACTED_FROM_KEY: json.dumps(batch).encode("utf-8")})
+                        self._write_segment(table, data, level + 1)
+                        for path in paths:
+                            os.remove(path)
+                        merged += len(batch)
+            with self._lock:
+                self.stats["segments_compacted"] += merged
+            return merged
+        finally:
+            lock_file.close()
+
+    def _load_segments(self, table: str) -> List["pa.Table"]:
+        for _ in range(3):
+            try:
+                tables = {name: _read_segment(os.path.join(self.directory, table, name))
+                          for name in self._segment_names(table)}
+                break
+            except FileNotFoundError: # Compacted away between listing and opening; list again
+                continue
+        else:
+            raise RuntimeError(f"Trace archive table {table} kept changing while being read")
+        replaced = set()
+        for data in tables.values():
+            compacted_from = (data.schema.metadata or {}).get(COMPACTED_FROM_KEY)
+            if compacted_from:
+                replaced.update(json.loads(compacted_from))
+        return [_conform(data, self._schemas[table]) for name, data in tables.items() if name not in replaced]
+
+    def table(self, name: str, columns: Optional[Sequence[str]] = None, since: Optional[float] = None,
+              until: Optional[float] = None, include_buffered: bool = True) -> "pa.Table":
+        """
+        All archived rows of a table as one Arrow table backed by the memory-mapped segments
+        (plus, by default, rows not flushed yet), optionally restricted to runs created in
+        [since, until) (Unix time) and to the given columns.
+        """
+        if name not in TABLE_COLUMNS:
+            raise ValueError(f"Unknown trace archive table '{name}'. Use one of: {', '.join(TABLE_COLUMNS)}")
+        parts = self._load_segments(name)
+        if include_buffered:
+            with self._lock:
+                rows = list(self._buffer[name])
+            if rows:
+                parts.append(pa.Table.from_pylist(rows, schema=self._schemas[name]))
+        data = pa.concat_tables(parts) if parts else self._schemas[name].empty_table()
+        if since is not None:
+            data = data.filter(pc.greater_equal(data["created_at"], since))
+        if until is not None:
+            data = data.filter(pc.less(data["created_at"], until))
+        return data.select(list(columns)) if columns else data
+
+    def aggregate(self, name: str, group_by: Sequence[str], aggregations: Iterable[Tuple[str, str]],
+                  since: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Grouped aggregates computed in Arrow, e.g.
+        aggregate("llm_usage", ["stage"], [("latency_seconds", "sum"), ("calls", "sum")]).
+        Result columns are named <column>_<function>.
+        """
+        aggregations = list(aggregations)
+        columns = list(dict.fromkeys(list(group_by) + [column for column, _ in aggregations]))
+        return self.table(name, columns, since).group_by(list(group_by)).aggregate(aggregations).to_pylist()
+
+    def stage_latency(self, since: Optional[float] = None) -> List[Dict[str, Any]]:
+        """LLM time per pipeline stage across runs, slowest stage first, with the share of prompt tokens cached."""
+        rows = self.aggregate("llm_usage", ["stage"], [("latency_seconds", "sum"), ("calls", "sum"),
+                                                        ("errors", "sum"), ("retries", "sum"), ("prompt_tokens", "sum"),
+                                                        ("cached_prompt_tokens", "sum")], since)
+        total = sum(row["latency_seconds_sum"] or 0.0 for row in rows)
+        stages = [{
+            "stage": row["stage"], "calls": row["calls_sum"], "errors": row["errors_sum"], "retries": row["retries_sum"],
+            "latency_seconds": round(row["latency_seconds_sum"] or 0.0, 3),
+            "seconds_per_call": round((row["latency_seconds_sum"] or 0.0) / row["calls_sum"], 4) if row["calls_sum"] else None,
+            "latency_share": round((row["latency_seconds_sum"] or 0.0) / total, 3) if total else 0.0,
+            "cached_token_ratio": _ratio(row["cached_prompt_tokens_sum"], row["prompt_tokens_sum"])
+        } for row in rows]
+        return sorted(stages, key=lambda stage: -stage["latency_seconds"])
+
+    def model_stats(self, since: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Reliability, speed and spend per model across runs, highest error rate first."""
+        rows = self.aggregate("llm_usage", ["model"], [("calls", "sum"), ("errors", "sum"), ("retries", "sum"),
+                                                        ("latency_seconds", "sum"), ("cost_usd", "sum"),
+                                                        ("prompt_tokens", "sum"), ("completion_tokens", "sum"),
+                                                        ("cached_prompt_tokens", "sum")], since)
+        models = []
+        for row in rows:
+            calls = row["calls_sum"] or 0
+            models.append({
+                "model": row["model"], "calls": calls, "errors": row["errors_sum"], "retries": row["retries_sum"],
+                "error_rate": round(row["errors_sum"] / calls, 4) if calls else None,
+                "seconds_per_call": round((row["latency_seconds_sum"] or 0.0) / calls, 4) if calls else None,
+                "cost_usd": round(row["cost_usd_sum"] or 0.0, 6),
+                "tokens": (row["prompt_tokens_sum"] or 0) + (row["completion_tokens_sum"] or 0),
+                "cached_token_ratio": _ratio(row["cached_prompt_tokens_sum"], row["prompt_tokens_sum"])
+            })
+        return sorted(models, key=lambda model: (-(model["error_rate"] or 0), -(model["seconds_per_call"] or 0)))
+
+    def joke_quality_by_model(self, role: str = "joke_model", since: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Judge scores of the jokes from runs grouped by the model that filled `role` (a runs
+        column: joke_model, plan_model, observation_model, critique_model or judge_model),
+        lowest mean funniness first.
+        """
+        if role not in dict(TABLE_COLUMNS["runs"]) or not role.endswith("_model"):
+            raise ValueError(f"Unknown model role '{role}'")
+        evaluations = self.table("evaluations", ["run_id", "overall_funniness"], since)
+        runs = self.table("runs", ["run_id", role], since)
+        joined = evaluations.join(runs, "run_id")
+        rows = joined.group_by([role]).aggregate([("overall_funniness", "mean"), ("overall_funniness", "count"),
+                                                  ("run_id", "count_distinct")]).to_pylist()
+        return sorted(({"model": row[role], "mean_funniness": round(row["overall_funniness_mean"], 3)
+                        if row["overall_funniness_mean"] is not None else None,
+                        "judged_jokes": row["overall_funniness_count"], "runs": row["run_id_count_distinct"]}
+                       for row in rows), key=lambda row: (row["mean_funniness"] is None, row["mean_funniness"] or 0))
+
+    def run_summary(self, since: Optional[float] = None) -> Dict[str, Any]:
+        """Run counts and wall-time percentiles, spend and failure counts across runs."""
+        runs = self.table("runs", ["wall_time_seconds", "cost_usd", "deadline_reached", "error", "top_score"], since)
+        if runs.num_rows == 0:
+            return {"runs": 0}
+        wall_time = runs["wall_time_seconds"]
+        p50, p95 = pc.quantile(wall_time, q=[0.5, 0.95]).to_pylist() if pc.count(wall_time).as_py() else (None, None)
+        return {
+            "runs": runs.num_rows,
+            "wall_time_p50_s": p50, "wall_time_p95_s": p95,
+            "cost_usd": pc.sum(runs["cost_usd"]).as_py() or 0.0,
+            "mean_top_score": pc.mean(runs["top_score"]).as_py(),
+            "deadline_reached": pc.sum(pc.cast(runs["deadline_reached"], pa.int64())).as_py() or 0,
+            "errors": pc.count(runs["error"]).as_py()
+        }
+
+    def segment_counts(self) -> Dict[str, Dict[int, int]]:
+        counts: Dict[str, Dict[int, int]] = {}
+        for table in TABLE_COLUMNS:
+            for name in self._segment_names(table):
+                level = int(name[1:name.index("-")])
+                counts.setdefault(table, {}).setdefault(level, 0)
+                counts[table][level] += 1
+        return counts
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, buffered_runs=self._buffered_runs)
+
+    def close(self) -> None:
+        """Stops the background thread and writes out whatever is still buffered."""
+        self._stopped.set()
+        self._wake.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self.flush()
@@ -2,7 +2,7 @@
 from typing import Dict, List, Any, Optional
 
 class TransparencyProvider:
-    def get_plansearch_code_details(self) -> Dict]]:
+    def get_plansearch_code_details(self) -> Dict[str, List[Dict[str, str]]]:
 
         return {
             "plansearch_for_jokes.py": [
@@ -22,7 +22,7 @@ def _prompt_for_observations(self, topic: str, model_name: str, existing_observa
                     "function_name": "_generate_observation_combinations",
                     "description": "Systematically creates subsets of observations (e.g., pairs) to explore combined comedic angles, a core PLANSEARCH diversity technique. [5]",
                     "code_snippet": """
-def _generate_observation_combinations(self, observations: List[str], max_subset_size: int = 2) -> List]:
+def _generate_observation_combinations(self, observations: List[str], max_subset_size: int = 2) -> List[Tuple[str, ...]]:
     #... (uses itertools.combinations)...
     return combinations
 """
@@ -53,16 +53,19 @@ def _prompt_for_critique(self, joke: str, plan: str, model_name: str) -> Optiona
                     "function_name": "evaluate_joke",
                     "description": "Uses a judge LLM to evaluate a joke based on a predefined rubric, incorporating bias mitigation instructions. [9, 32, 10, 11, 6, 12, 33, 34, 35, 36, 13, 37, 7]",
                     "code_snippet": """
-def evaluate_joke(self, joke_text: str, judge_model_name: str,...) -> Optional]:
+def evaluate_joke(self, joke_text: str, judge_model_name: str,...) -> Optional[Dict[str, Any]]:
     rubric = self.get_joke_evaluation_rubric()
-    prompt_content = self._construct_judge_prompt(joke_text, rubric, bias_instructions)
+    messages = self._construct_judge_messages(joke_text, rubric, bias_instructions) # Static system prompt, then the joke
     #... (LLM call with response_format={'type': 'json_object'})...
     #... (JSON parsing and validation)...
     return evaluation
 """
                 }
             ],
-            "novelty_checker.py":",
+            "novelty_checker.py": [
+                {
+                    "function_name": "check_web_cross_reference",
+                    "description": "Searches the web for the joke's text and penalizes jokes that already appear online. [23, 24]",
                     "code_snippet": """
 def check_web_cross_reference(self, joke_text: str, max_results: int = 5) -> float:
     if DDGS is None: return 0.0
@@ -87,10 +90,13 @@ def assess_perceived_novelty_with_llm(self, joke_text: str, judge_model_name: st
             ]
         }
 
-    def get_pipeline_visualization_data(self, last_run_data: Optional = None) -> Dict[str, Any]:
+    def get_pipeline_visualization_data(self, last_run_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
 
         
-        nodes =", "type": "process_group"},
+        nodes = [
+            {"id": "start", "label": "Topic Input", "type": "input"},
+
+            {"id": "plansearch_group", "label": "PLANSEARCH Module [5]", "type": "process_group"},
             {"id": "obs1", "label": "1. First-Order Observations", "type": "process", "parent": "plansearch_group"},
             {"id": "obs2", "label": "2. Second-Order Observations", "type": "process", "parent": "plansearch_group"},
             {"id": "plan_form", "label": "3. Joke Plan Formulation", "type": "process", "parent": "plansearch_group"},
@@ -136,9 +142,9 @@ def assess_perceived_novelty_with_llm(self, joke_text: str, judge_model_name: st
 
         if last_run_data and last_run_data.get('plansearch_data'):
             ps_data = last_run_data['plansearch_data']
-            num_obs = len(ps_data.get('observations',))
-            num_plans = len(ps_data.get('plans',))
-            num_jokes_gen = len(ps_data.get('jokes_generated',))
+            num_obs = len(ps_data.get('observations', []))
+            num_plans = len(ps_data.get('plans', []))
+            num_jokes_gen = len(ps_data.get('jokes_generated', []))
             for node in nodes:
                 if node['id'] == 'obs1':
                     node['label'] += f" (Actual: {num_obs} sets)"
@@ -148,4 +154,14 @@ def assess_perceived_novelty_with_llm(self, joke_text: str, judge_model_name: st
                      node['label'] += f" (Actual: {num_jokes_gen} cands)"
 
 
-        return {"nodes": nodes, "edges": edges, "annotations": annotations, "raw_last_run_data_summary": last_run_data}
\ No newline at end of file
+        return {"nodes": nodes, "edges": edges, "annotations": annotations, "raw_last_run_data_summary": last_run_data}
+
+    def get_run_statistics(self, trace_archive: Any, since: Optional[float] = None) -> Dict[str, Any]:
+        """Aggregates over the archived runs (a TraceArchive): slow stages, unreliable models, weak joke models."""
+        return {
+            "runs": trace_archive.run_summary(since),
+            "stage_latency": trace_archive.stage_latency(since),
+            "models": trace_archive.model_stats(since),
+            "joke_quality_by_joke_model": trace_archive.joke_quality_by_model("joke_model", since),
+            "joke_quality_by_judge_model": trace_archive.joke_quality_by_model("judge_model", since)
+        }
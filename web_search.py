@@ -0,0 +1,219 @@
+
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+_ddgs_class: Any = None
+_ddgs_probed = False
+_ddgs_lock = threading.Lock()
+
+
+def load_ddgs() -> Any:
+    """
+    The duckduckgo_search DDGS class, imported on first use rather than at module import
+    (it pulls in an HTTP client stack most code paths never touch). None if not installed.
+    """
+    global _ddgs_class, _ddgs_probed
+    with _ddgs_lock:
+        if not _ddgs_probed:
+            try:
+                from duckduckgo_search import DDGS
+                _ddgs_class = DDGS
+            except ImportError:
+                print("Warning: duckduckgo-search library not found. Web cross-referencing will be skipped. Run 'pip install duckduckgo-search'")
+            _ddgs_probed = True
+        return _ddgs_class
+
+
+class SearchBackend:
+    """A web search provider. search() returns result dicts and raises on failure."""
+
+    name = "base"
+
+    def search(self, query: str, max_results: int) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+
+class DDGSSearchBackend(SearchBackend):
+    """DuckDuckGo text search, reusing one DDGS session per worker thread."""
+
+    name = "duckduckgo"
+
+    def __init__(self):
+        self._ddgs_class = load_ddgs()
+        if self._ddgs_class is None:
+            raise ImportError("DDGSSearchBackend requires duckduckgo-search. Run 'pip install duckduckgo-search'")
+        self._local = threading.local()
+
+    def search(self, query: str, max_results: int) -> List[Dict[str, Any]]:
+        ddgs = getattr(self._local, "ddgs", None)
+        if ddgs is None:
+            ddgs = self._local.ddgs = self._ddgs_class()
+        return list(ddgs.text(query, max_results=max_results) or [])
+
+
+class StaticSearchBackend(SearchBackend):
+    """
+    In-process fake provider for tests and offline runs. Returns canned results per
+    query (empty by default) after `latency_s`, and fails the first `failures_per_query`
+    attempts of each query to exercise the retry path.
+    """
+
+    name = "static"
+
+    def __init__(self, results: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                 latency_s: float = 0.0, failures_per_query: int = 0):
+        self.results = results or {}
+        self.latency_s = latency_s
+        self.failures_per_query = failures_per_query
+        self.calls: List[str] = []
+        self._attempts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def search(self, query: str, max_results: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            self.calls.append(query)
+            attempt = self._attempts[query] = self._attempts.get(query, 0) + 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        if attempt <= self.failures_per_query:
+            raise ConnectionError(f"Injected failure {attempt} for query {query!r}")
+        return list(self.results.get(query, []))[:max_results]
+
+
+class TokenBucket:
+    """Blocking token-bucket rate limiter: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def normalize_query(query: str) -> str:
+    query = query.lower()
+    query = re.sub(r'[^\w\s"]', '', query)
+    return re.sub(r'\s+', ' ', query).strip()
+
+
+class WebSearchService:
+    """
+    Concurrent, rate-limited and memoized front end for a SearchBackend.
+    Identical normalized queries share one in-flight request and a TTL'd result;
+    transient errors are retried with exponential backoff up to `max_retries` times.
+    A query that still fails resolves to None, so callers can tell "not found" from
+    "could not check".
+    """
+
+    def __init__(self,
+                 backend: SearchBackend,
+                 rate_per_second: float = 1.0,
+                 burst: int = 3,
+                 max_workers: int = 4,
+                 cache_ttl_seconds: float = 24 * 3600,
+                 max_cache_entries: int = 10_000,
+                 max_retries: int = 3,
+                 backoff_base_s: float = 1.0):
+        self.backend = backend
+        self.rate_limiter = TokenBucket(rate_per_second, burst)
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.max_cache_entries = max_cache_entries
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="web-search")
+        self._cache: "OrderedDict[Tuple[str, int], Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._in_flight: Dict[Tuple[str, int], Future] = {}
+        self._lock = threading.Lock()
+        self.stats = {"cache_hits": 0, "coalesced": 0, "backend_calls": 0, "retries": 0, "failures": 0}
+
+    def _search_with_retries(self, query: str, max_results: int) -> Optional[List[Dict[str, Any]]]:
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            with self._lock:
+                self.stats["backend_calls"] += 1
+            try:
+                return self.backend.search(query, max_results)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"Web search failed after {attempt + 1} attempts for '{query}': {e}")
+                    with self._lock:
+                        self.stats["failures"] += 1
+                    return None
+                with self._lock:
+                    self.stats["retries"] += 1
+                time.sleep(self.backoff_base_s * (2 ** attempt) * (0.5 + random.random()))
+        return None
+
+    def _run(self, key: Tuple[str, int], query: str, max_results: int) -> Optional[List[Dict[str, Any]]]:
+        try:
+            results = self._search_with_retries(query, max_results)
+            if results is not None:
+                with self._lock:
+                    self._cache[key] = (time.monotonic(), results)
+                    self._cache.move_to_end(key)
+                    while len(self._cache) > self.max_cache_entries:
+                        self._cache.popitem(last=False)
+            return results
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def submit(self, query: str, max_results: int = 5) -> Future:
+        key = (normalize_query(query), max_results)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and time.monotonic() - cached[0] <= self.cache_ttl_seconds:
+                self._cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+                future: Future = Future()
+                future.set_result(cached[1])
+                return future
+            if key in self._in_flight:
+                self.stats["coalesced"] += 1
+                return self._in_flight[key]
+            future = self._executor.submit(self._run, key, query, max_results)
+            self._in_flight[key] = future
+            return future
+
+    def search(self, query: str, max_results: int = 5) -> Optional[List[Dict[str, Any]]]:
+        return self.submit(query, max_results).result()
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats, cache_entries=len(self._cache))
+
+
+_default_service: Optional[WebSearchService] = None
+_default_service_lock = threading.Lock()
+
+
+def default_web_search_service() -> Optional[WebSearchService]:
+    """
+    Process-wide DuckDuckGo service, so the rate limit and the result memo hold
+    across every NoveltyChecker (and every request) in the process.
+    """
+    global _default_service
+    if load_ddgs() is None:
+        return None
+    with _default_service_lock:
+        if _default_service is None:
+            _default_service = WebSearchService(DDGSSearchBackend())
+        return _default_service